@@ -0,0 +1,292 @@
+import io
+import os
+import json
+import wave
+import subprocess
+
+# 混音使用的采样率
+MIX_SAMPLE_RATE = 44100
+# 语音片段解码后的采样率（edge-tts原始采样率），混音时再转换
+SPEECH_SAMPLE_RATE = 24000
+# MP3解码器固有的延迟（采样数），批量解码时按此对齐片段边界
+_MP3_DECODER_DELAY = 529
+
+# MPEG音频Layer III的码率表（kbps），按MPEG版本区分
+_BITRATES_V1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0]
+_BITRATES_V2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0]
+# 版本位 → 采样率表（3: MPEG1, 2: MPEG2, 0: MPEG2.5）
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+
+# 逐词时间保存在ID3v2.4的TXXX帧中，MP3解码器和mp3_frames都会跳过ID3标签
+_BOUNDARY_TAG = b"tts_boundaries"
+
+
+def _synchsafe(value):
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def attach_boundaries(data, boundaries):
+    """
+    把合成引擎返回的逐词时间写入MP3开头的ID3标签，数据进入语音缓存后时间信息也不会丢失
+    :param data: MP3数据（不带ID3标签）
+    :param boundaries: [(开始秒数, 时长秒数, 文本), ...]
+    :return: 带标签的MP3数据
+    """
+    payload = b"\x03" + _BOUNDARY_TAG + b"\x00" + json.dumps([list(item) for item in boundaries], ensure_ascii=False).encode('utf-8')
+    frame = b"TXXX" + _synchsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _synchsafe(len(frame)) + frame + data[_skip_id3(data):]
+
+
+def read_boundaries(data):
+    """
+    读取attach_boundaries写入的逐词时间
+    :param data: MP3数据
+    :return: [(开始秒数, 时长秒数, 文本), ...]，没有记录时返回None
+    """
+    end = _skip_id3(data)
+    offset = 10
+    while data and offset + 10 <= end:
+        frame_id = data[offset:offset + 4]
+        size = (data[offset + 4] << 21) | (data[offset + 5] << 14) | (data[offset + 6] << 7) | data[offset + 7]
+        body = data[offset + 10:offset + 10 + size]
+        if frame_id == b"TXXX" and body[1:].startswith(_BOUNDARY_TAG + b"\x00"):
+            try:
+                return [tuple(item) for item in json.loads(body[len(_BOUNDARY_TAG) + 2:].decode('utf-8'))]
+            except ValueError:
+                return None
+        if size == 0:
+            break
+        offset += 10 + size
+    return None
+
+
+def _skip_id3(data):
+    """
+    跳过文件开头的ID3v2标签
+    """
+    if len(data) >= 10 and data[:3] == b'ID3':
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        return 10 + size
+    return 0
+
+
+def mp3_frames(data):
+    """
+    解析MP3帧头（仅Layer III），不解码音频
+    :param data: MP3文件内容
+    :return: 生成器，逐帧返回 (偏移, 帧长度, 采样数, 采样率)
+    """
+    offset = _skip_id3(data)
+    size = len(data)
+    while offset + 4 <= size:
+        b0, b1, b2 = data[offset], data[offset + 1], data[offset + 2]
+        version = (b1 >> 3) & 3
+        layer = (b1 >> 1) & 3
+        bitrate_index = b2 >> 4
+        rate_index = (b2 >> 2) & 3
+        # 不是有效帧头时向后搜索同步字
+        if b0 != 0xFF or (b1 & 0xE0) != 0xE0 or version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            offset += 1
+            continue
+        sample_rate = _SAMPLE_RATES[version][rate_index]
+        padding = (b2 >> 1) & 1
+        if version == 3:
+            bitrate = _BITRATES_V1[bitrate_index] * 1000
+            samples = 1152
+            frame_length = 144 * bitrate // sample_rate + padding
+        else:
+            bitrate = _BITRATES_V2[bitrate_index] * 1000
+            samples = 576
+            frame_length = 72 * bitrate // sample_rate + padding
+        if frame_length <= 4:
+            offset += 1
+            continue
+        yield offset, frame_length, samples, sample_rate
+        offset += frame_length
+
+
+def mp3_duration(source):
+    """
+    通过帧头计算MP3时长，比打开音频解码快得多（离线引擎生成的WAV按文件头计算）
+    :param source: MP3文件路径或文件内容
+    :return: 时长（秒）
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            source = f.read()
+    if _is_wav(source):
+        with wave.open(io.BytesIO(source)) as reader:
+            return reader.getnframes() / reader.getframerate()
+    duration = 0.0
+    for _, _, samples, sample_rate in mp3_frames(source):
+        duration += samples / sample_rate
+    return duration
+
+
+def _is_wav(data):
+    return len(data) >= 12 and data[:4] == b'RIFF' and data[8:12] == b'WAVE'
+
+
+def decode_wav(data, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    在进程内解码PCM格式的WAV（离线合成引擎的输出），混成单声道并线性插值到目标采样率
+    :param data: WAV文件内容
+    :param sample_rate: 输出采样率
+    :return: float32单声道数组
+    """
+    import numpy as np
+    with wave.open(io.BytesIO(data)) as reader:
+        channels = reader.getnchannels()
+        width = reader.getsampwidth()
+        source_rate = reader.getframerate()
+        raw = reader.readframes(reader.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width in (2, 4):
+        dtype = np.int16 if width == 2 else np.int32
+        samples = np.frombuffer(raw, dtype=dtype).astype(np.float32) / float(np.iinfo(dtype).max)
+    else:
+        raise ValueError(f"不支持的WAV采样位宽: {width * 8} bit")
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    if source_rate != sample_rate and len(samples) > 1:
+        positions = np.arange(int(len(samples) * sample_rate / source_rate)) * (source_rate / sample_rate)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return samples.astype(np.float32)
+
+
+def write_wav(path, samples, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    把float32单声道数组写成16位WAV（供需要文件路径的FFmpeg滤镜使用）
+    :param path: 输出路径
+    :param samples: float32单声道数组
+    :param sample_rate: 采样率
+    :return: 输出路径
+    """
+    import numpy as np
+    with wave.open(path, 'wb') as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(sample_rate)
+        writer.writeframes((np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes())
+    return path
+
+
+def _is_info_frame(frame):
+    """
+    Xing/Info/VBRI帧只包含元数据，拼接时需要去掉，否则解码器会把它当作静音帧
+    """
+    head = frame[:64]
+    return b'Xing' in head or b'Info' in head or b'VBRI' in head
+
+
+def _decode_pcm(data, input_format, sample_rate):
+    """
+    用一次FFmpeg把内存中的音频解码为float32单声道数组
+    """
+    import numpy as np
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', input_format,
+        '-i', 'pipe:0',
+        '-f', 'f32le',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        'pipe:1'
+    ]
+    try:
+        result = subprocess.run(cmd, input=data, capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg解码失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def decode_mp3_batch(clips, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    把多段MP3拼成一个码流，只启动一次FFmpeg解码，再按每段的帧数切开
+    :param clips: MP3数据列表（None表示缺失）
+    :param sample_rate: 输出采样率
+    :return: 与clips顺序一致的float32单声道数组列表，缺失或无法解析的为None
+    """
+    import numpy as np
+    results = [None] * len(clips)
+    # 源采样率不同的片段不能放进同一个码流，按采样率分组
+    groups = {}
+    for index, data in enumerate(clips):
+        if not data:
+            continue
+        payload = []
+        samples = 0
+        source_rate = None
+        for offset, length, frame_samples, frame_rate in mp3_frames(data):
+            frame = data[offset:offset + length]
+            if _is_info_frame(frame):
+                continue
+            if source_rate is None:
+                source_rate = frame_rate
+            elif frame_rate != source_rate:
+                break
+            payload.append(frame)
+            samples += frame_samples
+        if samples:
+            groups.setdefault(source_rate, []).append((index, b''.join(payload), samples))
+
+    for source_rate, items in groups.items():
+        ratio = sample_rate / source_rate
+        total = sum(samples for _, _, samples in items)
+        delay = int(round(_MP3_DECODER_DELAY * ratio))
+        pcm = _decode_pcm(b''.join(payload for _, payload, _ in items), 'mp3', sample_rate)
+        # 解码输出整体延后了解码器延迟，补齐到期望长度后按累计帧数切分
+        expected = int(round(total * ratio)) + delay
+        if len(pcm) < expected:
+            pcm = np.concatenate([pcm, np.zeros(expected - len(pcm), dtype=np.float32)])
+        cumulative = 0
+        for index, _, samples in items:
+            start = int(round(cumulative * ratio)) + delay
+            cumulative += samples
+            end = int(round(cumulative * ratio)) + delay
+            results[index] = pcm[start:end]
+    return results
+
+
+def decode_clips(clips, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    解码合成引擎返回的音频：MP3一起交给decode_mp3_batch，WAV在进程内直接解码
+    :param clips: 音频数据列表（None表示缺失）
+    :param sample_rate: 输出采样率
+    :return: 与clips顺序一致的float32单声道数组列表
+    """
+    results = [None] * len(clips)
+    mp3_indices = []
+    for index, data in enumerate(clips):
+        if data and _is_wav(data):
+            results[index] = decode_wav(data, sample_rate)
+        elif data:
+            mp3_indices.append(index)
+    if mp3_indices:
+        for index, speech in zip(mp3_indices, decode_mp3_batch([clips[i] for i in mp3_indices], sample_rate)):
+            results[index] = speech
+    return results
+
+
+def load_audio_files(paths):
+    """
+    读取音频文件内容，不存在的文件返回None
+    :param paths: 文件路径列表
+    :return: 文件内容列表
+    """
+    clips = []
+    for path in paths:
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                clips.append(f.read())
+        else:
+            clips.append(None)
+    return clips
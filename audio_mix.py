@@ -0,0 +1,425 @@
+import os
+import time
+import subprocess
+import numpy as np
+from combine import has_audio_stream, probe_video
+from audio_codec import MIX_SAMPLE_RATE, SPEECH_SAMPLE_RATE
+from dub_timeline import solve_timeline, timeline_report
+
+# 按输出文件扩展名选择音频编码
+_AUDIO_CODECS = {
+    '.mp3': ['-c:a', 'libmp3lame', '-q:a', '2'],
+    '.m4a': ['-c:a', 'aac', '-b:a', '192k'],
+    '.aac': ['-c:a', 'aac', '-b:a', '192k'],
+    '.wav': ['-c:a', 'pcm_s16le'],
+}
+# 响度目标（近似LUFS）：配音和原音轨都先对齐到这个响度
+TARGET_LOUDNESS = -16.0
+# 原音轨响度校正的上限（dB），避免把接近静音的音轨放大成噪声
+MAX_BED_CORRECTION = 12.0
+# 闪避包络的时间参数（秒）：提前开始压低、语音结束后缓慢恢复
+DUCK_ATTACK = 0.08
+DUCK_RELEASE = 0.35
+DUCK_BLOCK = 0.01
+# 语音片段首尾静音裁剪：帧长、相对片段最响帧的门限、绝对门限（dB）和保留的余量（秒）
+TRIM_FRAME = 0.01
+TRIM_RELATIVE_DB = -40.0
+TRIM_FLOOR_DB = -60.0
+TRIM_HEAD = 0.03
+TRIM_TAIL = 0.06
+# 单个片段响度校正的上限（dB）
+MAX_CLIP_CORRECTION = 10.0
+
+
+def decode_audio_track(path, sample_rate=MIX_SAMPLE_RATE, channels=2, duration=None):
+    """
+    把媒体文件的音轨解码为float32数组，直接读入预分配的缓冲区
+    :param path: 媒体文件路径
+    :param sample_rate: 输出采样率
+    :param channels: 输出声道数
+    :param duration: 预计时长（秒），用于预分配缓冲区
+    :return: 形状为(采样数, 声道数)的数组，文件没有音轨时返回None
+    """
+    if not has_audio_stream(path):
+        return None
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', path,
+        '-vn',
+        '-f', 'f32le',
+        '-ac', str(channels),
+        '-ar', str(sample_rate),
+        'pipe:1'
+    ]
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+    capacity = int((duration or 60) * sample_rate) + sample_rate
+    buffer = np.zeros((capacity, channels), dtype=np.float32)
+    filled = 0
+    while True:
+        raw = memoryview(buffer).cast('B')
+        if filled == len(raw):
+            # 实际音轨比预计的长，扩大缓冲区
+            buffer = np.concatenate([buffer, np.zeros((len(buffer), channels), dtype=np.float32)])
+            continue
+        read = process.stdout.readinto(raw[filled:])
+        if not read:
+            break
+        filled += read
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(f"FFmpeg解码音轨失败: {stderr.decode('utf-8', errors='ignore')}")
+    return buffer[:filled // (4 * channels)]
+
+
+def stretch(samples, step):
+    """
+    线性插值重采样：step为每个输出采样前进的输入采样数
+    同时完成采样率转换和变速（与moviepy的with_speed_scaled一样会改变音高）
+    :param samples: 一维float32数组
+    :param step: 步长
+    :return: 重采样后的数组
+    """
+    if abs(step - 1.0) < 1e-6 or len(samples) < 2:
+        return samples
+    n_out = int(len(samples) / step)
+    positions = np.arange(n_out, dtype=np.float64) * step
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def time_stretch(samples, factor, sample_rate=SPEECH_SAMPLE_RATE, frame_ms=40, search_ms=6):
+    """
+    保持音高的变速（WSOLA）：按分析步长取帧，在名义位置附近寻找与上一帧自然延续最相似的位置，
+    再用50%重叠的汉宁窗叠加。每帧的相似度搜索用一次np.correlate完成，叠加整体向量化
+    :param samples: 一维float32数组
+    :param factor: 变速倍数（大于1加快、变短）
+    :param sample_rate: 采样率
+    :param frame_ms: 帧长（毫秒）
+    :param search_ms: 对齐搜索范围（毫秒）
+    :return: 变速后的数组
+    """
+    if abs(factor - 1.0) < 1e-3:
+        return samples
+    frame = max(2, int(sample_rate * frame_ms / 1000) // 2 * 2)
+    hop = frame // 2
+    n = len(samples)
+    if n < frame * 2:
+        return samples
+    x = np.asarray(samples, dtype=np.float32)
+    count = int((n - frame) / (hop * factor)) + 1
+    nominal = (np.arange(count) * hop * factor).astype(np.int64)
+    radius = int(sample_rate * search_ms / 1000)
+    # 前缀能量和，用于按候选窗口能量归一化相似度
+    energy = np.concatenate([[0.0], np.cumsum(x.astype(np.float64) ** 2)])
+
+    starts = nominal.copy()
+    for k in range(1, count):
+        natural = starts[k - 1] + hop
+        if natural + frame > n:
+            starts[k] = min(nominal[k], n - frame)
+            continue
+        low = max(0, nominal[k] - radius)
+        high = min(n - frame, nominal[k] + radius)
+        if high <= low:
+            starts[k] = min(nominal[k], n - frame)
+            continue
+        score = np.correlate(x[low:high + frame], x[natural:natural + frame], mode='valid')
+        norm = np.sqrt(energy[low + frame:high + frame + 1] - energy[low:high + 1]) + 1e-9
+        starts[k] = low + int(np.argmax(score / norm))
+
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)
+    frames = x[starts[:, None] + np.arange(frame)] * window
+    out = np.zeros((count + 1, hop), dtype=np.float32)
+    out[:-1] += frames[:, :hop]
+    out[1:] += frames[:, hop:]
+    return out.reshape(-1)[:int(n / factor)]
+
+
+def loudness(samples, sample_rate, block_seconds=0.4):
+    """
+    按BS.1770的门限方式估计响度（不做K加权）：400ms块的均方能量，
+    先去掉-70dB以下的块，再去掉比平均响度低10dB的块
+    :param samples: 一维或(采样数, 声道数)的数组
+    :param sample_rate: 采样率
+    :param block_seconds: 测量块长度（秒）
+    :return: 响度（dB），没有有效内容时返回None
+    """
+    block = max(1, int(block_seconds * sample_rate))
+    count = len(samples) // block
+    if count == 0:
+        return None
+    power = np.square(samples[:count * block], dtype=np.float32)
+    if power.ndim > 1:
+        power = power.mean(axis=1)
+    power = power.reshape(count, block).mean(axis=1)
+    power = power[power > 10 ** (-70 / 10)]
+    if not len(power):
+        return None
+    power = power[power > power.mean() * 10 ** (-10 / 10)]
+    return float(10 * np.log10(power.mean()))
+
+
+def trim_and_normalize(arrays, sample_rate=SPEECH_SAMPLE_RATE, frame_seconds=TRIM_FRAME, relative_db=TRIM_RELATIVE_DB, floor_db=TRIM_FLOOR_DB,
+                       head=TRIM_HEAD, tail=TRIM_TAIL, max_correction=MAX_CLIP_CORRECTION):
+    """
+    批量裁剪语音片段首尾的静音，并把各片段的响度拉齐到所有片段的中位数
+    所有片段按帧长补齐后拼成一个(总帧数, 帧长)的数组，帧能量、首尾位置和有效部分的能量都一次算出，不逐段循环计算
+    :param arrays: float32单声道数组列表（None表示缺失）
+    :param sample_rate: 采样率
+    :param frame_seconds: 能量检测的帧长（秒）
+    :param relative_db: 低于片段最响帧这么多dB的帧算作静音
+    :param floor_db: 低于这个绝对电平的帧一律算作静音
+    :param head: 裁剪后在语音开始前保留的秒数
+    :param tail: 裁剪后在语音结束后保留的秒数（尾音衰减较慢，留得多一些）
+    :param max_correction: 单个片段增益的上限（dB）
+    :return: 与arrays顺序一致的数组列表，缺失或全是静音的为None
+    """
+    frame = max(1, int(frame_seconds * sample_rate))
+    indices = [i for i, speech in enumerate(arrays) if speech is not None and len(speech)]
+    results = [None] * len(arrays)
+    if not indices:
+        return results
+    lengths = np.array([len(arrays[i]) for i in indices])
+    counts = -(-lengths // frame)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    batch = np.zeros((int(counts.sum()), frame), dtype=np.float32)
+    flat = batch.reshape(-1)
+    for i, start in zip(indices, starts):
+        flat[start * frame:start * frame + len(arrays[i])] = arrays[i]
+    power = np.square(batch).mean(axis=1)
+
+    # 每帧所属片段最响帧的能量，得到逐帧的静音门限
+    peak = np.maximum.reduceat(power, starts)
+    owner = np.repeat(np.arange(len(indices)), counts)
+    threshold = np.maximum(peak[owner] * 10 ** (relative_db / 10), 10 ** (floor_db / 10))
+    active = power > threshold
+    # 每个片段第一个和最后一个有声帧：有声帧的序号，无声帧记为极值后按片段取最小/最大
+    position = np.arange(len(power))
+    first = np.minimum.reduceat(np.where(active, position, len(power)), starts) - starts
+    last = np.maximum.reduceat(np.where(active, position, -1), starts) - starts
+    voiced = np.add.reduceat(active.astype(np.int64), starts)
+    energy = np.add.reduceat(np.where(active, power, 0.0), starts) / np.maximum(voiced, 1)
+
+    levels = 10 * np.log10(np.maximum(energy[voiced > 0], 1e-12))
+    reference = float(np.median(levels)) if len(levels) else 0.0
+    before = int(lengths.sum())
+    after = 0
+    for k, i in enumerate(indices):
+        if voiced[k] == 0:
+            continue
+        begin = max(0, int(first[k]) * frame - int(head * sample_rate))
+        end = min(int(lengths[k]), (int(last[k]) + 1) * frame + int(tail * sample_rate))
+        gain_db = float(np.clip(reference - 10 * np.log10(max(energy[k], 1e-12)), -max_correction, max_correction))
+        speech = arrays[i][begin:end]
+        results[i] = speech * np.float32(10 ** (gain_db / 20)) if abs(gain_db) > 0.1 else speech
+        after += end - begin
+    print(f"语音片段: {len(indices)} 段, 裁掉首尾静音 {(before - after) / sample_rate:.1f} 秒, 响度统一到 {reference:.1f} dB")
+    return results
+
+
+def duck_envelope(placements, count, depth_db, block_seconds=DUCK_BLOCK, attack=DUCK_ATTACK, release=DUCK_RELEASE):
+    """
+    由配音的位置生成原音轨的闪避包络：语音期间压低depth_db，之前attack秒线性压下，之后release秒线性恢复，
+    两段语音之间的短空隙保持压低
+    按块计算，距离最近语音的前后距离用累积最大/最小值一次求出
+    :param placements: Placement列表（秒）
+    :param count: 包络的块数
+    :param depth_db: 压低的分贝数（负数）
+    :param block_seconds: 每块的时长（秒）
+    :param attack: 压下时间（秒）
+    :param release: 恢复时间（秒）
+    :return: 每块的线性增益
+    """
+    marks = np.zeros(count + 1, dtype=np.int32)
+    for placement in placements:
+        first = min(count, max(0, int(placement.start / block_seconds)))
+        last = min(count, max(first, int(np.ceil(placement.end / block_seconds))))
+        marks[first] += 1
+        marks[last] -= 1
+    active = np.cumsum(marks[:-1]) > 0
+    index = np.arange(count, dtype=np.float64)
+    # 距离上一段语音结束、下一段语音开始的块数
+    since = index - np.maximum.accumulate(np.where(active, index, -np.inf))
+    until = np.minimum.accumulate(np.where(active, index, np.inf)[::-1])[::-1] - index
+    amount = np.maximum(
+        np.clip(1 - until * block_seconds / max(attack, 1e-6), 0, 1),
+        np.clip(1 - since * block_seconds / max(release, 1e-6), 0, 1),
+    )
+    # 两段语音之间的空隙短于恢复加压下的时间时保持压低，避免原音轨忽大忽小
+    amount[(since + until) * block_seconds < attack + release] = 1.0
+    return (10 ** (depth_db * amount / 20)).astype(np.float32)
+
+
+class AudioMixer:
+    """
+    在一个float32缓冲区上混音：原音轨作为底，语音片段按采样偏移直接相加
+    """
+    def __init__(self, base=None, duration=0.0, sample_rate=MIX_SAMPLE_RATE, channels=2):
+        """
+        :param base: 原音轨数组(采样数, 声道数)，直接在其上混音
+        :param duration: 没有原音轨时的缓冲区时长（秒）
+        :param sample_rate: 混音采样率
+        :param channels: 没有原音轨时的声道数
+        """
+        self.sample_rate = sample_rate
+        if base is not None:
+            self.buffer = np.ascontiguousarray(base, dtype=np.float32)
+        else:
+            self.buffer = np.zeros((int(duration * sample_rate), channels), dtype=np.float32)
+        self.channels = self.buffer.shape[1]
+        self.clips = 0
+
+    @property
+    def duration(self):
+        return len(self.buffer) / self.sample_rate
+
+    def add(self, samples, start, gain=1.0, speed=1.0, source_rate=SPEECH_SAMPLE_RATE):
+        """
+        把一段单声道语音加到指定时间
+        :param samples: 一维float32数组
+        :param start: 开始时间（秒）
+        :param gain: 增益倍数
+        :param speed: 变速倍数（大于1加快）
+        :param source_rate: 语音数组的采样率
+        """
+        samples = stretch(samples, speed * source_rate / self.sample_rate)
+        offset = max(0, int(round(start * self.sample_rate)))
+        end = offset + len(samples)
+        if end > len(self.buffer):
+            extra = np.zeros((end - len(self.buffer), self.channels), dtype=np.float32)
+            self.buffer = np.concatenate([self.buffer, extra])
+        if gain != 1.0:
+            samples = samples * np.float32(gain)
+        self.buffer[offset:end] += samples[:, None]
+        self.clips += 1
+
+    def apply_envelope(self, block_gain, block_seconds=DUCK_BLOCK, chunk_seconds=10):
+        """
+        把按块计算的增益插值到每个采样并乘到缓冲区上，分段处理避免生成整条增益数组
+        :param block_gain: 每块的线性增益
+        :param block_seconds: 每块的时长（秒）
+        :param chunk_seconds: 每次处理的时长（秒）
+        """
+        centers = (np.arange(len(block_gain)) + 0.5) * block_seconds * self.sample_rate
+        chunk = int(chunk_seconds * self.sample_rate)
+        for start in range(0, len(self.buffer), chunk):
+            stop = min(len(self.buffer), start + chunk)
+            gain = np.interp(np.arange(start, stop), centers, block_gain).astype(np.float32)
+            self.buffer[start:stop] *= gain[:, None]
+
+    def limit(self, ceiling=0.98, window=0.01):
+        """
+        峰值限幅：按短窗口计算增益，取相邻窗口的最小值后平滑插值，避免削波产生的破音
+        :param ceiling: 输出峰值上限
+        :param window: 窗口长度（秒）
+        :return: 最大增益衰减（dB）
+        """
+        n = len(self.buffer)
+        if n == 0:
+            return 0.0
+        peak = np.abs(self.buffer).max(axis=1)
+        if peak.max() <= ceiling:
+            return 0.0
+        block = max(1, int(window * self.sample_rate))
+        n_blocks = -(-n // block)
+        padded = np.zeros(n_blocks * block, dtype=np.float32)
+        padded[:n] = peak
+        block_gain = np.minimum(1.0, ceiling / np.maximum(padded.reshape(n_blocks, block).max(axis=1), 1e-9))
+        # 与前后窗口取最小值，插值后每个采样的增益都不大于所在窗口需要的增益
+        neighbor_gain = block_gain.copy()
+        neighbor_gain[1:] = np.minimum(neighbor_gain[1:], block_gain[:-1])
+        neighbor_gain[:-1] = np.minimum(neighbor_gain[:-1], block_gain[1:])
+        centers = np.arange(n_blocks) * block + block / 2
+        gain = np.interp(np.arange(n), centers, neighbor_gain).astype(np.float32)
+        self.buffer *= gain[:, None]
+        np.clip(self.buffer, -1.0, 1.0, out=self.buffer)
+        return float(-20 * np.log10(max(block_gain.min(), 1e-9)))
+
+    def write(self, output_path, codec_args=None, chunk_seconds=10):
+        """
+        把混音结果通过管道直接交给FFmpeg编码
+        :param output_path: 输出音频路径
+        :param codec_args: 编码参数，默认按扩展名选择
+        :param chunk_seconds: 每次写入管道的时长（秒）
+        :return: 输出音频路径
+        """
+        if codec_args is None:
+            codec_args = _AUDIO_CODECS.get(os.path.splitext(output_path)[1].lower(), ['-c:a', 'aac', '-b:a', '192k'])
+        cmd = [
+            'ffmpeg', '-v', 'error',
+            '-f', 'f32le',
+            '-ar', str(self.sample_rate),
+            '-ac', str(self.channels),
+            '-i', 'pipe:0',
+            *codec_args,
+            '-y',
+            output_path
+        ]
+        try:
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+        chunk = int(chunk_seconds * self.sample_rate)
+        try:
+            for start in range(0, len(self.buffer), chunk):
+                process.stdin.write(self.buffer[start:start + chunk].tobytes())
+        finally:
+            process.stdin.close()
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"FFmpeg编码音频失败: {stderr.decode('utf-8', errors='ignore')}")
+        return output_path
+
+
+def mix_dub(video_path, speech_arrays, timestamps, durations, output_path, balance=2.0, original_audio_path=None, source_rate=SPEECH_SAMPLE_RATE, target_loudness=TARGET_LOUDNESS):
+    """
+    把语音片段混入原音轨并编码输出，片段位置由dub_timeline.solve_timeline统一安排
+    配音和原音轨先各自校正到目标响度，原音轨在配音期间按包络压低，不再对配音做固定倍数放大
+    :param video_path: 原视频路径
+    :param speech_arrays: 语音数组列表，按时间排序
+    :param timestamps: 每条字幕的开始时间（秒）
+    :param durations: 每条字幕的时长（秒）
+    :param output_path: 输出音频路径
+    :param balance: 配音期间配音比原音轨响的倍数（即原来的volume_factor），决定闪避深度
+    :param original_audio_path: 替代原视频音轨的音频文件
+    :param source_rate: 语音数组的采样率
+    :param target_loudness: 目标响度（dB）
+    :return: 输出音频路径
+    """
+    started = time.perf_counter()
+    duration = probe_video(video_path)['duration']
+    base = decode_audio_track(original_audio_path or video_path, duration=duration)
+    mixer = AudioMixer(base=base, duration=duration)
+    lengths = [len(speech) / source_rate for speech in speech_arrays]
+    placements = solve_timeline(timestamps, durations, lengths, total=duration)
+    speeches = []
+    for speech, placement in zip(speech_arrays, placements):
+        if len(speech) and placement.speed > 1.0:
+            speech = time_stretch(speech, placement.speed, source_rate)
+        speeches.append(speech)
+
+    # 配音整体校正到目标响度
+    speech_level = loudness(np.concatenate(speeches), source_rate) if speeches else None
+    speech_gain = 10 ** ((target_loudness - speech_level) / 20) if speech_level is not None else 1.0
+    depth_db = -20 * np.log10(balance) if balance > 1 else 0.0
+    if base is not None:
+        # 原音轨的响度校正和闪避包络在同一次乘法中完成
+        bed_level = loudness(base, mixer.sample_rate)
+        bed_db = float(np.clip(target_loudness - bed_level, -MAX_BED_CORRECTION, MAX_BED_CORRECTION)) if bed_level is not None else 0.0
+        count = int(np.ceil(mixer.duration / DUCK_BLOCK))
+        envelope = duck_envelope(placements, count, depth_db) * np.float32(10 ** (bed_db / 20))
+        mixer.apply_envelope(envelope)
+        print(f"原音轨: 响度 {bed_level if bed_level is not None else float('-inf'):.1f} dB, 校正 {bed_db:+.1f} dB, 配音期间压低 {-depth_db:.1f} dB")
+    for speech, placement in zip(speeches, placements):
+        if len(speech):
+            mixer.add(speech, placement.start, gain=speech_gain, source_rate=source_rate)
+    shifted, compressed, max_offset = timeline_report(timestamps, placements)
+    reduction = mixer.limit()
+    mixer.write(output_path)
+    if speech_level is not None:
+        print(f"配音: 响度 {speech_level:.1f} dB, 校正到 {target_loudness:.1f} dB")
+    print(f"时间轴: {shifted} 段调整了开始时间（最多 {max_offset:.2f} 秒）, {compressed} 段压缩了语速")
+    print(f"混音完成: {mixer.clips} 段语音, 时长 {mixer.duration:.1f} 秒, 限幅 {reduction:.1f} dB, 用时 {time.perf_counter() - started:.1f} 秒")
+    return output_path
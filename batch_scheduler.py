@@ -0,0 +1,495 @@
+import os
+import json
+import time
+import queue
+import asyncio
+import threading
+
+# 处理阶段，按顺序执行；每个阶段有自己的队列和工作线程
+STAGES = ("transcribe", "translate", "tts", "mix", "render", "mux")
+STAGE_NAMES = {"transcribe": "转录", "translate": "翻译", "tts": "语音合成", "mix": "混音", "render": "渲染", "mux": "封装"}
+# 每个阶段的默认工作线程数，可以在settings.json的pipeline_workers中覆盖
+# 转录和渲染占满CPU/GPU，翻译和语音合成主要在等网络
+STAGE_WORKERS = {"transcribe": 1, "translate": 2, "tts": 2, "mix": 1, "render": 1, "mux": 1}
+# 每个阶段的队列最多积压 工作线程数×这个倍数 个任务，上游阶段会等待，避免语音数据堆积在内存中
+QUEUE_FACTOR = 2
+# 运行中打印进度统计的间隔（秒）
+REPORT_INTERVAL = 30
+
+_STOP = object()
+
+
+def load_stage_workers(path="settings.json"):
+    """
+    读取settings.json中的pipeline_workers，缺少的阶段使用默认值
+    :return: {阶段: 工作线程数}
+    """
+    workers = dict(STAGE_WORKERS)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            workers.update(json.load(f).get("pipeline_workers") or {})
+    except (OSError, ValueError):
+        pass
+    return {stage: max(1, int(count)) for stage, count in workers.items()}
+
+
+class BatchJob:
+    """
+    批量处理中的一个视频，各阶段的中间结果挂在这个对象上依次传递
+    已完成阶段的产物记录在输出目录的 <视频名>.job.json 中，重新提交时从第一个未完成的阶段继续
+    """
+    def __init__(self, video_path, output_dir):
+        from job_manifest import JobManifest
+        self.video_path = video_path
+        self.output_dir = output_dir
+        self.name = os.path.splitext(os.path.basename(video_path))[0]
+        self.manifest = JobManifest.for_video(video_path, output_dir)
+        self.video_digest = None
+        self.segments = None
+        self.subtitle_path = None
+        self.speech = None
+        self.dub_audio_path = None
+        self.rendered_path = None
+        self.output_path = None
+        self.error = None
+        self.failed_stage = None
+        self.stage_seconds = {}
+        self.submitted = time.perf_counter()
+        self.finished = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.finished is not None
+
+
+class StageStats:
+    """
+    单个阶段的统计：忙碌时间、完成数、队列深度（当前、峰值、按时间加权的平均值）
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.busy = 0.0
+        self.done = 0
+        self.failed = 0
+        self.depth = 0
+        self.peak_depth = 0
+        self._depth_area = 0.0
+        self._changed = time.perf_counter()
+        self._started = self._changed
+        self._lock = threading.Lock()
+
+    def _move(self, delta):
+        with self._lock:
+            now = time.perf_counter()
+            self._depth_area += self.depth * (now - self._changed)
+            self._changed = now
+            self.depth += delta
+            self.peak_depth = max(self.peak_depth, self.depth)
+
+    def enqueued(self):
+        self._move(1)
+
+    def dequeued(self):
+        self._move(-1)
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.busy += seconds
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def utilization(self, elapsed):
+        """
+        :return: 工作线程忙碌时间占比（0~1）
+        """
+        return self.busy / (elapsed * self.workers) if elapsed > 0 else 0.0
+
+    def average_depth(self):
+        with self._lock:
+            now = time.perf_counter()
+            elapsed = now - self._started
+            area = self._depth_area + self.depth * (now - self._changed)
+        return area / elapsed if elapsed > 0 else 0.0
+
+
+class StagePipeline:
+    """
+    按阶段流水线处理任务：每个阶段一个队列和若干工作线程，任务完成一个阶段后进入下一个阶段的队列
+    第N+1个任务可以在第N个任务等待网络或编码时开始转录，不同资源同时工作
+    某个阶段出错的任务跳过后续阶段，不影响其他任务
+    """
+    def __init__(self, stages, workers=None, queue_factor=QUEUE_FACTOR, report_interval=REPORT_INTERVAL, on_done=None, on_stage=None):
+        """
+        :param stages: [(阶段名, 处理函数 func(job)), ...]，按执行顺序
+        :param workers: {阶段名: 工作线程数}，默认读取settings.json
+        :param queue_factor: 阶段队列容量为工作线程数的倍数（第一个阶段不限）
+        :param report_interval: 运行中打印统计的间隔（秒），None表示不打印
+        :param on_done: 任务结束（成功或失败）时的回调 on_done(job)，在工作线程中调用
+        :param on_stage: 阶段开始和结束时的回调 on_stage(job, 阶段名, 状态, 秒数)，状态为"start"、"done"或"failed"
+        """
+        workers = workers or load_stage_workers()
+        self.stages = [(name, func) for name, func in stages]
+        self.workers = [max(1, int(workers.get(name, 1))) for name, _ in self.stages]
+        self.queues = [queue.Queue() if k == 0 else queue.Queue(maxsize=count * queue_factor) for k, count in enumerate(self.workers)]
+        self.stats = [StageStats(count) for count in self.workers]
+        self.report_interval = report_interval
+        self.on_done = on_done
+        self.on_stage = on_stage
+        self.jobs = []
+        self._running = [count for count in self.workers]
+        self._lock = threading.Lock()
+        self._threads = []
+        self._finished = threading.Event()
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        for index, count in enumerate(self.workers):
+            for _ in range(count):
+                thread = threading.Thread(target=self._work, args=(index,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        if self.report_interval:
+            threading.Thread(target=self._report_loop, daemon=True).start()
+        return self
+
+    def submit(self, job):
+        """
+        提交任务，进入第一个阶段的队列
+        """
+        self.jobs.append(job)
+        self.stats[0].enqueued()
+        self.queues[0].put(job)
+        return job
+
+    def close(self):
+        """
+        不再提交新任务，各阶段处理完队列中的任务后依次退出
+        """
+        for _ in range(self.workers[0]):
+            self.queues[0].put(_STOP)
+
+    def join(self):
+        """
+        等待所有任务结束
+        :return: 全部任务列表
+        """
+        for thread in self._threads:
+            thread.join()
+        self._finished.set()
+        return self.jobs
+
+    def run(self, jobs):
+        """
+        提交一批任务并等待全部结束
+        :return: 全部任务列表
+        """
+        self.start()
+        for job in jobs:
+            self.submit(job)
+        self.close()
+        self.join()
+        self.report()
+        return self.jobs
+
+    def _work(self, index):
+        name, func = self.stages[index]
+        stats = self.stats[index]
+        while True:
+            job = self.queues[index].get()
+            if job is _STOP:
+                break
+            stats.dequeued()
+            self._notify(job, name, "start", 0.0)
+            started = time.perf_counter()
+            try:
+                func(job)
+                ok = True
+            except Exception as e:
+                job.error = e
+                job.failed_stage = name
+                ok = False
+                print(f"[{job.name}] {STAGE_NAMES.get(name, name)}阶段出错: {e}")
+            elapsed = time.perf_counter() - started
+            job.stage_seconds[name] = elapsed
+            stats.record(elapsed, ok)
+            self._notify(job, name, "done" if ok else "failed", elapsed)
+            if ok and index + 1 < len(self.stages):
+                self.stats[index + 1].enqueued()
+                self.queues[index + 1].put(job)
+            else:
+                self._finish(job)
+        # 本阶段最后一个线程退出时通知下一阶段
+        with self._lock:
+            self._running[index] -= 1
+            last = self._running[index] == 0
+        if last and index + 1 < len(self.stages):
+            for _ in range(self.workers[index + 1]):
+                self.queues[index + 1].put(_STOP)
+
+    def _notify(self, job, name, state, seconds):
+        if self.on_stage:
+            try:
+                self.on_stage(job, name, state, seconds)
+            except Exception as e:
+                print(f"[{job.name}] 阶段回调出错: {e}")
+
+    def _finish(self, job):
+        job.finished = time.perf_counter()
+        # 中间结果不再需要，及时释放
+        job.segments = None
+        job.speech = None
+        if self.on_done:
+            try:
+                self.on_done(job)
+            except Exception as e:
+                print(f"[{job.name}] 完成回调出错: {e}")
+
+    def _report_loop(self):
+        # 长期运行（如监视文件夹）时，没有新任务也没有任务在处理就不重复打印
+        last = None
+        while not self._finished.wait(self.report_interval):
+            finished = sum(1 for job in self.jobs if job.finished is not None)
+            state = (len(self.jobs), finished)
+            if state != last or finished < len(self.jobs):
+                self.report()
+            last = state
+
+    def report(self):
+        """
+        打印各阶段的利用率和队列深度
+        :return: [(阶段名, 利用率, 完成数, 失败数, 当前队列深度, 峰值, 平均深度), ...]
+        """
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        rows = []
+        for (name, _), stats in zip(self.stages, self.stats):
+            rows.append((name, stats.utilization(elapsed), stats.done, stats.failed, stats.depth, stats.peak_depth, stats.average_depth()))
+        finished = sum(1 for job in self.jobs if job.finished is not None)
+        print(f"批量处理: {finished}/{len(self.jobs)} 个任务结束, 用时 {elapsed:.0f} 秒")
+        for name, utilization, done, failed, depth, peak, average in rows:
+            print(f"  {STAGE_NAMES.get(name, name)}: 利用率 {utilization:.0%}, 完成 {done}, 失败 {failed}, 队列 {depth} (峰值 {peak}, 平均 {average:.1f})")
+        return rows
+
+
+def video_pipeline(output_dir, model_size="medium", add_translation=True, burn_subtitles=False, replace_audio=False,
+                   volume_factor=2.0, shards=None, smart_render=False, renderer="libass", soft_subtitles=False, container="mp4",
+                   tts_provider=None, workers=None, on_done=None, report_interval=REPORT_INTERVAL, resume=True, on_stage=None, shared_model=False,
+                   processor=None, skip_subtitle_generation=False):
+    """
+    创建处理视频的流水线（未启动），参数含义与video_processor_pro.simple_process一致
+    用BatchJob(视频路径, output_dir)提交任务；长期运行的调用方（如监视文件夹）可以一直提交
+    每个阶段的输出先写临时文件再替换，完成后记入任务清单；输入和产物都没有变化的阶段直接跳过
+    :param output_dir: 输出目录
+    :param workers: {阶段名: 工作线程数}，默认读取settings.json的pipeline_workers
+    :param on_done: 每个视频结束时的回调 on_done(job)，job.ok表示是否成功，job.output_path为输出路径
+    :param resume: 是否跳过任务清单中已完成的阶段，False表示清空清单全部重新处理
+    :param on_stage: 阶段开始和结束时的回调，见StagePipeline
+    :param shared_model: 是否使用进程内共享的Whisper模型（常驻进程中多条流水线共用已加载的模型）
+    :param processor: 已创建的VideoProcessor（如单个视频处理时已加载模型的处理器），None表示新建
+    :param skip_subtitle_generation: 不转录和翻译，使用输出目录中已有的 <视频名>_en-zh.srt（不翻译时为 <视频名>_en.srt），没有时该任务失败
+    :return: StagePipeline
+    """
+    from video_processor_pro import VideoProcessor
+    from segment_store import segment_store_path
+    from combine import fast_merge_av, mux_dual_audio, split_audio_track, has_audio_stream
+    from tts_providers import get_provider
+    from job_manifest import file_digest, inputs_key, partial_path, commit_output
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or load_stage_workers()
+    processor = processor or VideoProcessor(model_size=model_size, shared_model=shared_model)
+    processor.tts_provider = tts_provider
+    provider_name = get_provider(tts_provider).name
+    # 每个转录线程使用自己的Whisper模型，第一个线程直接使用共享的处理器
+    local = threading.local()
+    spare = [processor]
+    spare_lock = threading.Lock()
+
+    def transcriber():
+        if not hasattr(local, "processor"):
+            with spare_lock:
+                local.processor = spare.pop() if spare else VideoProcessor(model_size=model_size)
+        return local.processor
+
+    def source_digest(job):
+        if job.video_digest is None:
+            job.video_digest = file_digest(job.video_path)
+        return job.video_digest
+
+    def resumed(job, stage, inputs):
+        artifacts = job.manifest.completed(stage, inputs)
+        if artifacts is not None:
+            print(f"[{job.name}] {STAGE_NAMES[stage]}阶段已完成，跳过")
+        return artifacts
+
+    def transcribe(job):
+        if not resume:
+            job.manifest.clear()
+        if skip_subtitle_generation:
+            # 使用已有的字幕文件，不加载Whisper
+            subtitle_path = os.path.join(output_dir, f"{job.name}_en-zh.srt" if add_translation else f"{job.name}_en.srt")
+            if not os.path.exists(subtitle_path):
+                raise FileNotFoundError(f"跳过字幕生成时需要已有的字幕文件: {subtitle_path}")
+            job.subtitle_path = subtitle_path
+            return
+        inputs = inputs_key("transcribe", source_digest(job), model_size)
+        artifacts = resumed(job, "transcribe", inputs)
+        if artifacts:
+            job.subtitle_path = artifacts["subtitle"]
+            return
+        edited = job.manifest.edited("transcribe", inputs, "subtitle")
+        segments_path = job.manifest.artifact("transcribe", "segments")
+        if edited and file_digest(segments_path) == job.manifest.digest("transcribe", "segments"):
+            # 手动修改过的英文字幕不再覆盖
+            print(f"[{job.name}] 字幕已被修改，使用修改后的字幕: {edited}")
+            job.subtitle_path = edited
+            job.manifest.complete("transcribe", inputs, subtitle=edited, segments=segments_path)
+            return
+        result = transcriber().transcribe_audio(job.video_path)
+        job.segments = [{"start": float(segment["start"]), "end": float(segment["end"]), "text": segment["text"]} for segment in result["segments"]]
+        # 转录结果单独保存，翻译阶段中断后不需要重新转录
+        segments_path = os.path.join(output_dir, f"{job.name}_segments.json")
+        temp_path = partial_path(segments_path)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(job.segments, f, ensure_ascii=False)
+        commit_output(temp_path, segments_path)
+        english_subtitle_path = os.path.join(output_dir, f"{job.name}_en.srt")
+        temp_path = partial_path(english_subtitle_path)
+        processor.create_subtitle_file(job.segments, temp_path, False)
+        job.subtitle_path = commit_output(temp_path, english_subtitle_path)
+        job.manifest.complete("transcribe", inputs, subtitle=english_subtitle_path, segments=segments_path)
+
+    def translate(job):
+        if skip_subtitle_generation:
+            # 记录已有字幕的摘要，后续阶段按字幕内容判断是否需要重新处理
+            job.manifest.complete("translate", inputs_key("translate", file_digest(job.subtitle_path), "existing"), subtitle=job.subtitle_path)
+            return
+        inputs = inputs_key("translate", job.manifest.digest("transcribe", "segments"), add_translation)
+        artifacts = resumed(job, "translate", inputs)
+        if artifacts:
+            job.subtitle_path = artifacts["subtitle"]
+            job.segments = None
+            return
+        edited = job.manifest.edited("translate", inputs, "subtitle")
+        if edited:
+            # 手动修改过的字幕不再覆盖，后续阶段按修改后的字幕增量处理
+            print(f"[{job.name}] 字幕已被修改，使用修改后的字幕: {edited}")
+            job.subtitle_path = edited
+            job.segments = None
+            job.manifest.complete("translate", inputs, subtitle=edited)
+            return
+        if add_translation:
+            if job.segments is None:
+                # 转录阶段是从清单恢复的，读取保存的转录结果
+                with open(job.manifest.artifact("transcribe", "segments"), "r", encoding="utf-8") as f:
+                    job.segments = json.load(f)
+            bilingual_subtitle_path = os.path.join(output_dir, f"{job.name}_en-zh.srt")
+            temp_path = partial_path(bilingual_subtitle_path)
+            processor.create_subtitle_file(job.segments, temp_path, True)
+            job.subtitle_path = commit_output(temp_path, bilingual_subtitle_path)
+        job.segments = None
+        job.manifest.complete("translate", inputs, subtitle=job.subtitle_path)
+
+    def tts(job):
+        if not replace_audio:
+            return
+        inputs = inputs_key("tts", job.manifest.digest("translate", "subtitle"), provider_name)
+        if resumed(job, "tts", inputs):
+            return
+        store_path = segment_store_path(job.subtitle_path)
+        job.speech = asyncio.run(processor.synthesize_speech(job.subtitle_path, store_path=store_path))
+        job.manifest.complete("tts", inputs, store=store_path)
+
+    def mix(job):
+        if not replace_audio:
+            return
+        inputs = inputs_key("mix", job.manifest.digest("tts", "store"), source_digest(job), volume_factor)
+        artifacts = resumed(job, "mix", inputs)
+        if artifacts:
+            job.dub_audio_path = artifacts["dub_audio"]
+            job.speech = None
+            return
+        if job.speech is None:
+            # 语音合成阶段是从清单恢复的，直接读取片段仓库
+            job.speech = asyncio.run(processor.synthesize_speech(job.subtitle_path, soundfiles_path=segment_store_path(job.subtitle_path)))
+        dub_audio_path = os.path.join(output_dir, f"{job.name}_dub_audio.m4a")
+        temp_path = partial_path(dub_audio_path)
+        processor.mix_generated_speech(job.video_path, job.subtitle_path, temp_path, volume_factor, speech=job.speech)
+        job.dub_audio_path = commit_output(temp_path, dub_audio_path)
+        job.speech = None
+        job.manifest.complete("mix", inputs, dub_audio=dub_audio_path)
+
+    def render(job):
+        # 渲染只处理字幕，保留原音轨；配音在封装阶段加入，配音变化时不需要重新渲染
+        if burn_subtitles and not soft_subtitles:
+            # 烧录字幕按清单增量处理：字幕没有变化时跳过，修改过时只重新烧录修改的部分
+            rendered_path = os.path.join(output_dir, f"{job.name}_with_subtitles.mp4")
+            processor.burn_subtitles_to_video(job.video_path, job.subtitle_path, rendered_path, shards=shards, smart_render=smart_render, renderer=renderer, manifest=job.manifest)
+            job.rendered_path = job.output_path = rendered_path
+            return
+        if not soft_subtitles:
+            job.output_path = job.subtitle_path
+            return
+        rendered_path = os.path.join(output_dir, f"{job.name}_with_subtitles.{container}")
+        language = "chi" if add_translation else "eng"
+        inputs = inputs_key("render", source_digest(job), job.manifest.digest("translate", "subtitle"), container, language)
+        artifacts = resumed(job, "render", inputs)
+        if artifacts:
+            job.rendered_path = job.output_path = artifacts["video"]
+            return
+        temp_path = partial_path(rendered_path)
+        processor.mux_subtitles_to_video(job.video_path, job.subtitle_path, temp_path, language=language)
+        job.rendered_path = job.output_path = commit_output(temp_path, rendered_path)
+        job.manifest.complete("render", inputs, video=rendered_path)
+
+    def mux(job):
+        if not job.dub_audio_path:
+            return
+        if job.rendered_path:
+            root, ext = os.path.splitext(job.rendered_path)
+            final_path = root + "_final" + ext
+            inputs = inputs_key("mux", job.manifest.digest("render", "video"), job.manifest.digest("mix", "dub_audio"))
+        else:
+            final_path = os.path.join(output_dir, f"{job.name}_with_audio.mp4")
+            inputs = inputs_key("mux", source_digest(job), job.manifest.digest("mix", "dub_audio"))
+        artifacts = resumed(job, "mux", inputs)
+        if artifacts:
+            job.output_path = artifacts["video"]
+            return
+        temp_path = partial_path(final_path)
+        artifacts = {"video": final_path}
+        if job.rendered_path:
+            # 配音和原声两条音轨，另存一个只有原声的版本
+            mux_dual_audio(job.rendered_path, job.dub_audio_path, job.video_path, temp_path, dub_language="chi", original_language="eng")
+            commit_output(temp_path, final_path)
+            if has_audio_stream(job.video_path):
+                original_path = root + "_original_audio" + ext
+                temp_path = partial_path(original_path)
+                split_audio_track(final_path, temp_path, 1)
+                artifacts["original_audio"] = commit_output(temp_path, original_path)
+        else:
+            if fast_merge_av(job.video_path, job.dub_audio_path, temp_path) is None:
+                raise RuntimeError("合并配音失败")
+            commit_output(temp_path, final_path)
+        job.output_path = final_path
+        job.manifest.complete("mux", inputs, **artifacts)
+
+    stages = [("transcribe", transcribe), ("translate", translate), ("tts", tts), ("mix", mix), ("render", render), ("mux", mux)]
+    return StagePipeline(stages, workers=workers, report_interval=report_interval, on_done=on_done, on_stage=on_stage)
+
+
+def process_batch(video_paths, output_dir, on_done=None, **options):
+    """
+    流水线批量处理多个视频：转录、翻译、语音合成、混音、渲染、封装各自排队，不同视频的不同阶段同时进行
+    :param video_paths: 视频文件路径列表
+    :param output_dir: 输出目录
+    :param on_done: 每个视频结束时的回调 on_done(job)，job.ok表示是否成功，job.output_path为输出路径
+    :param options: 传给video_pipeline的处理参数
+    :return: BatchJob列表
+    """
+    pipeline = video_pipeline(output_dir, on_done=on_done, **options)
+    jobs = pipeline.run(BatchJob(video_path, output_dir) for video_path in video_paths)
+    failed = [job for job in jobs if not job.ok]
+    print(f"批量处理完成: 成功 {len(jobs) - len(failed)} 个, 失败 {len(failed)} 个")
+    return jobs
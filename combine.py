@@ -1,6 +1,7 @@
 import subprocess
 from pathlib import Path
 import os
+import json
 
 def fast_merge_av(video_path, audio_path, output_path=None):
     """
@@ -19,6 +20,8 @@ def fast_merge_av(video_path, audio_path, output_path=None):
         '-c:a', 'aac',         # 音频编码为AAC（兼容性好）
         '-map', '0:v:0',       # 选择第一个视频流
         '-map', '1:a:0',       # 选择第二个音频流
+        '-map', '0:s?',        # 保留软字幕轨道（如果有）
+        '-c:s', 'copy',
         '-shortest',
         '-y',
         output_path
@@ -52,6 +55,321 @@ def batch_merge_av(file_pairs):
             success_count += 1
     
     print(f"批量处理完成: {success_count}/{len(file_pairs)} 成功")
+
+def probe_video(video_path):
+    """
+    使用ffprobe读取视频流信息
+    :param video_path: 视频文件路径
+    :return: 包含fps、width、height、codec、pix_fmt、duration、start_time的字典
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,profile,pix_fmt,width,height,avg_frame_rate,r_frame_rate,start_time,duration,bit_rate',
+        '-show_entries', 'format=duration',
+        '-of', 'json',
+        video_path
+    ]
+    result = subprocess.run(cmd, check=True, capture_output=True)
+    info = json.loads(result.stdout.decode('utf-8', errors='ignore'))
+    stream = info['streams'][0]
+    rate = stream.get('avg_frame_rate') or stream.get('r_frame_rate') or '0/1'
+    if rate in ('0/0', '0/1'):
+        rate = stream.get('r_frame_rate', '0/1')
+    num, den = rate.split('/')
+    duration = stream.get('duration') or info.get('format', {}).get('duration') or 0
+    return {
+        'codec': stream.get('codec_name'),
+        'profile': stream.get('profile'),
+        'pix_fmt': stream.get('pix_fmt'),
+        'width': int(stream.get('width', 0)),
+        'height': int(stream.get('height', 0)),
+        'fps': float(num) / float(den) if float(den) else 0.0,
+        'bit_rate': int(stream['bit_rate']) if stream.get('bit_rate', 'N/A') != 'N/A' else None,
+        'start_time': float(stream.get('start_time') or 0),
+        'duration': float(duration),
+    }
+
+def probe_keyframes(video_path):
+    """
+    读取视频流所有数据包的时间戳和关键帧标记（只解析封装，不解码）
+    :param video_path: 视频文件路径
+    :return: (关键帧帧序号列表, 关键帧时间列表, 总帧数)，时间相对第一帧
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        video_path
+    ]
+    result = subprocess.run(cmd, check=True, capture_output=True)
+    packets = []
+    for line in result.stdout.decode('utf-8', errors='ignore').splitlines():
+        parts = line.strip().split(',')
+        if len(parts) < 2 or parts[0] in ('', 'N/A'):
+            continue
+        packets.append((float(parts[0]), 'K' in parts[1]))
+    # 数据包按解码顺序排列，按显示时间排序后的位置才是帧序号
+    packets.sort(key=lambda packet: packet[0])
+    if not packets:
+        return [], [], 0
+    first_pts = packets[0][0]
+    keyframe_indices = []
+    keyframe_times = []
+    for index, (pts, is_key) in enumerate(packets):
+        if is_key:
+            keyframe_indices.append(index)
+            keyframe_times.append(pts - first_pts)
+    return keyframe_indices, keyframe_times, len(packets)
+
+def concat_segments(segment_paths, output_path):
+    """
+    使用concat demuxer无损拼接多个编码参数一致的视频片段
+    :param segment_paths: 片段文件路径列表（按时间顺序）
+    :param output_path: 输出文件路径
+    :return: 输出文件路径
+    """
+    list_path = output_path + ".concat.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace('\\', '/').replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = [
+        'ffmpeg',
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_path,
+        '-c', 'copy',           # 不重新编码
+        '-y',
+        output_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"FFmpeg拼接失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+    return output_path
+
+def cut_segment_copy(video_path, output_path, start_time, n_frames):
+    """
+    从关键帧处无损截取视频片段（只含视频流，不重新编码）
+    :param video_path: 输入视频路径
+    :param output_path: 输出文件路径（建议使用.ts以保留流内参数集）
+    :param start_time: 起始关键帧时间（秒，相对第一帧）
+    :param n_frames: 截取的帧数
+    :return: 输出文件路径
+    """
+    # 往前留0.5毫秒的余量，避免浮点误差跳到下一个关键帧
+    seek = max(0.0, start_time - 0.0005)
+    cmd = [
+        'ffmpeg',
+        '-ss', f"{seek:.6f}",
+        '-i', video_path,
+        '-map', '0:v:0',
+        '-frames:v', str(n_frames),
+        '-c', 'copy',
+        '-an',
+        '-y',
+        output_path
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg截取失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    return output_path
+
+def has_audio_stream(path):
+    """
+    检查文件是否包含音频流
+    :param path: 媒体文件路径
+    :return: 是否包含音频流
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'a',
+        '-show_entries', 'stream=index',
+        '-of', 'csv=p=0',
+        path
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    return result.returncode == 0 and bool(result.stdout.strip())
+
+def mux_soft_subtitles(video_path, subtitle_path, output_path, language="chi"):
+    """
+    把字幕作为软字幕轨道封装进视频，视频和音频直接复制不重新编码
+    MP4/MOV使用mov_text，MKV使用ASS
+    :param video_path: 输入视频路径
+    :param subtitle_path: 字幕文件路径（UTF-8编码的SRT）
+    :param output_path: 输出文件路径，扩展名决定封装格式
+    :param language: 字幕轨道的语言标记（ISO 639-2）
+    :return: 输出文件路径
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    subtitle_codec = 'ass' if ext == '.mkv' else 'mov_text'
+
+    def build_cmd(audio_codec):
+        return [
+            'ffmpeg',
+            '-i', video_path,
+            '-i', subtitle_path,
+            '-map', '0:v:0',
+            '-map', '0:a?',
+            '-map', '1:s:0',
+            '-c:v', 'copy',
+            '-c:a', audio_codec,
+            '-c:s', subtitle_codec,
+            '-metadata:s:s:0', f'language={language}',
+            '-disposition:s:0', 'default',
+            '-y',
+            output_path
+        ]
+
+    try:
+        result = subprocess.run(build_cmd('copy'), capture_output=True)
+        if result.returncode != 0:
+            # 原音频编码不能放进目标封装格式时（如WebM的Opus放入旧版MP4），只转码音频
+            print("音频流无法直接复制，改为转码为AAC")
+            result = subprocess.run(build_cmd('aac'), capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg封装字幕失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    return output_path
+
+def audio_codec_name(path, index=0):
+    """
+    查询音频流的编码名称
+    :param path: 媒体文件路径
+    :param index: 第几条音频流
+    :return: 编码名称（如aac），没有该音频流时返回None
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', f'a:{index}',
+        '-show_entries', 'stream=codec_name',
+        '-of', 'csv=p=0',
+        path
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    name = result.stdout.decode('utf-8', errors='ignore').strip()
+    return name if result.returncode == 0 and name else None
+
+def mux_dual_audio(video_path, dub_audio_path, original_path, output_path, dub_language="chi", original_language="eng"):
+    """
+    一次封装出带两条AAC音轨的视频：第一条为配音（默认播放），第二条为原声
+    视频流和软字幕直接复制；已经是AAC的音频也直接复制
+    :param video_path: 视频流来源（如烧录字幕后的视频）
+    :param dub_audio_path: 配音音频
+    :param original_path: 原声来源（原视频），没有音频流时只封装配音
+    :param output_path: 输出文件路径
+    :param dub_language: 配音音轨的语言标记（ISO 639-2）
+    :param original_language: 原声音轨的语言标记
+    :return: 输出文件路径
+    """
+    original_codec = audio_codec_name(original_path)
+    cmd = ['ffmpeg', '-i', video_path, '-i', dub_audio_path]
+    if original_codec:
+        cmd += ['-i', original_path]
+    cmd += ['-map', '0:v:0', '-map', '1:a:0']
+    if original_codec:
+        cmd += ['-map', '2:a:0']
+    cmd += [
+        '-map', '0:s?',
+        '-c:v', 'copy',
+        '-c:s', 'copy',
+        '-c:a:0', 'copy' if audio_codec_name(dub_audio_path) == 'aac' else 'aac',
+        '-metadata:s:a:0', f'language={dub_language}',
+        '-metadata:s:a:0', 'title=配音',
+        '-disposition:a:0', 'default',
+    ]
+    if original_codec:
+        cmd += [
+            '-c:a:1', 'copy' if original_codec == 'aac' else 'aac',
+            '-metadata:s:a:1', f'language={original_language}',
+            '-metadata:s:a:1', 'title=原声',
+            '-disposition:a:1', '0',
+        ]
+    cmd += ['-movflags', '+faststart', '-y', output_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg封装音轨失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    return output_path
+
+def split_audio_track(input_path, output_path, audio_index):
+    """
+    从多音轨视频中拆出只带一条音轨的版本，全部流直接复制
+    :param input_path: 多音轨视频
+    :param output_path: 输出文件路径
+    :param audio_index: 保留第几条音频流
+    :return: 输出文件路径
+    """
+    cmd = [
+        'ffmpeg',
+        '-i', input_path,
+        '-map', '0:v:0',
+        '-map', f'0:a:{audio_index}',
+        '-map', '0:s?',
+        '-c', 'copy',
+        '-disposition:a:0', 'default',
+        '-movflags', '+faststart',
+        '-y',
+        output_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg拆分音轨失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    return output_path
+
+def mux_original_audio(video_path, source_path, output_path):
+    """
+    把原视频的音轨放回处理后的视频，视频流直接复制，原音频是AAC时也直接复制
+    :param video_path: 处理后的视频（通常没有音频）
+    :param source_path: 原视频
+    :param output_path: 输出文件路径，可以与video_path相同
+    :return: 输出文件路径
+    """
+    codec = audio_codec_name(source_path)
+    if codec is None:
+        print("原视频没有音频流，跳过合并原始音频")
+        return video_path
+    temp_output = None
+    if os.path.abspath(video_path) == os.path.abspath(output_path):
+        root, ext = os.path.splitext(output_path)
+        temp_output = f"{root}_temp{ext}"
+    cmd = [
+        'ffmpeg',
+        '-i', video_path,
+        '-i', source_path,
+        '-map', '0:v:0',
+        '-map', '1:a:0',
+        '-map', '0:s?',
+        '-c:v', 'copy',
+        '-c:s', 'copy',
+        '-c:a', 'copy' if codec == 'aac' else 'aac',
+        '-movflags', '+faststart',
+        '-y',
+        temp_output or output_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+    if result.returncode != 0:
+        if temp_output and os.path.exists(temp_output):
+            os.remove(temp_output)
+        raise RuntimeError(f"FFmpeg合并原始音频失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    if temp_output:
+        os.replace(temp_output, output_path)
+    return output_path
+
 # Example usage
 if __name__ == "__main__":
     base_path = "pre_combine_videos"
@@ -0,0 +1,207 @@
+import re
+from audio_codec import SPEECH_SAMPLE_RATE, decode_clips, read_boundaries
+from duration_planner import speech_units, plan_rates, learn_speaking_rate
+from dub_timeline import available_windows
+from audio_mix import trim_and_normalize
+
+# 发音单位数不超过这个值的字幕算作短字幕，可以和相邻的短字幕合并
+SHORT_CUE_UNITS = 10
+# 合并后的请求最多包含的发音单位数和字幕条数
+MAX_GROUP_UNITS = 40
+MAX_GROUP_CUES = 6
+# 相邻字幕之间的空白超过这个秒数时不合并（说话人停顿，合成时也应该断开）
+MAX_GROUP_GAP = 0.6
+# 静音检测的帧长和搜索范围（相对于预计片段长度的比例）
+_SILENCE_FRAME = 0.01
+_SILENCE_SEARCH = 0.35
+
+_ENDING = re.compile(r'[，。！？；：,.!?;:、…]$')
+_CJK = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+
+
+def group_cues(texts, starts, slots, short_units=SHORT_CUE_UNITS, max_units=MAX_GROUP_UNITS, max_cues=MAX_GROUP_CUES, max_gap=MAX_GROUP_GAP):
+    """
+    把相邻的短字幕合并为一组，每组作为一个合成请求
+    :param texts: 文本列表，按时间排序
+    :param starts: 每条字幕的开始时间（秒）
+    :param slots: 每条字幕的时长（秒）
+    :return: 分组列表，每组为字幕下标列表
+    """
+    groups = []
+    units = [speech_units(text) for text in texts]
+    for i in range(len(texts)):
+        if groups:
+            group = groups[-1]
+            last = group[-1]
+            gap = starts[i] - (starts[last] + slots[last])
+            if (units[last] <= short_units and units[i] <= short_units and gap <= max_gap
+                    and len(group) < max_cues and sum(units[j] for j in group) + units[i] <= max_units):
+                group.append(i)
+                continue
+        groups.append([i])
+    return groups
+
+
+def join_texts(texts):
+    """
+    拼接一组字幕文本，没有结尾标点的补一个逗号，让合成结果在字幕边界处有自然的停顿
+    :return: (拼接后的文本, 每条字幕在拼接文本中的 (开始, 结束) 位置)
+    """
+    parts = []
+    spans = []
+    position = 0
+    for k, text in enumerate(texts):
+        if k + 1 < len(texts) and not _ENDING.search(text):
+            text += "，" if _CJK.search(text) else ","
+        if k > 0 and not _CJK.search(text[:1]):
+            parts.append(" ")
+            position += 1
+        parts.append(text)
+        spans.append((position, position + len(text)))
+        position += len(text)
+    return "".join(parts), spans
+
+
+def cuts_from_boundaries(joined, spans, boundaries, length):
+    """
+    用逐词时间确定切分点：取前一条字幕最后一个词的结束和后一条字幕第一个词的开始之间的中点
+    :param joined: 拼接后的文本
+    :param spans: join_texts返回的位置
+    :param boundaries: [(开始秒数, 时长秒数, 文本), ...]
+    :param length: 音频时长（秒）
+    :return: 切分时间列表（秒，比字幕条数少一个），词无法对应到每条字幕时返回None
+    """
+    first = [None] * len(spans)
+    last = [None] * len(spans)
+    cursor = 0
+    cue = 0
+    for offset, duration, word in boundaries:
+        position = joined.find(word, cursor) if word else -1
+        if position < 0:
+            continue
+        cursor = position + len(word)
+        while cue + 1 < len(spans) and position >= spans[cue][1]:
+            cue += 1
+        if first[cue] is None:
+            first[cue] = offset
+        last[cue] = offset + duration
+    if any(value is None for value in first):
+        return None
+    cuts = []
+    for k in range(len(spans) - 1):
+        cut = (last[k] + first[k + 1]) / 2
+        if not (0 < cut < length) or (cuts and cut <= cuts[-1]):
+            return None
+        cuts.append(cut)
+    return cuts
+
+
+def cuts_from_silence(speech, sample_rate, weights):
+    """
+    没有逐词时间时按静音切分：按每条字幕的发音单位数估计切分位置，在附近找能量最低的位置
+    :param speech: float32单声道数组
+    :param sample_rate: 采样率
+    :param weights: 每条字幕的发音单位数
+    :return: 切分时间列表（秒）
+    """
+    import numpy as np
+    frame = max(1, int(_SILENCE_FRAME * sample_rate))
+    count = len(speech) // frame
+    if count < len(weights) * 2:
+        total = len(speech) / sample_rate
+        return list(np.cumsum(weights)[:-1] / max(sum(weights), 1e-9) * total)
+    energy = np.square(speech[:count * frame].astype(np.float32)).reshape(count, frame).mean(axis=1)
+    # 平滑到约50毫秒，避开词内的短暂能量低谷
+    energy = np.convolve(energy, np.ones(5, dtype=np.float32) / 5, mode='same')
+    total_weight = max(sum(weights), 1e-9)
+    cumulative = np.cumsum(weights)[:-1] / total_weight * count
+    cuts = []
+    previous = 0
+    for k, expected in enumerate(cumulative):
+        reach = max(1, int(_SILENCE_SEARCH * weights[k] / total_weight * count))
+        low = max(previous + 1, int(expected) - reach)
+        high = min(count - (len(weights) - 1 - k), int(expected) + reach + 1)
+        if high <= low:
+            index = min(max(previous + 1, int(expected)), count - 1)
+        else:
+            # 取能量最低的一段静音的中点，两边的片段各留一半停顿
+            window = energy[low:high]
+            quiet = window <= window.min() * 1.5 + 1e-9
+            center = int(np.argmin(window))
+            begin = center
+            while begin > 0 and quiet[begin - 1]:
+                begin -= 1
+            end = center
+            while end + 1 < len(window) and quiet[end + 1]:
+                end += 1
+            index = low + (begin + end) // 2
+        cuts.append((index + 0.5) * frame / sample_rate)
+        previous = index
+    return cuts
+
+
+def split_group(speech, sample_rate, texts, clip=None):
+    """
+    把一组字幕合成的音频切回每条字幕，优先使用逐词时间，否则按静音切分
+    :param speech: 整组的float32单声道数组
+    :param sample_rate: 采样率
+    :param texts: 组内每条字幕的文本
+    :param clip: 合成引擎返回的原始数据，用于读取逐词时间
+    :return: 与texts顺序一致的数组列表（原数组的视图）
+    """
+    if len(texts) == 1:
+        return [speech]
+    joined, spans = join_texts(texts)
+    length = len(speech) / sample_rate
+    boundaries = read_boundaries(clip) if clip else None
+    cuts = cuts_from_boundaries(joined, spans, boundaries, length) if boundaries else None
+    if cuts is None:
+        cuts = cuts_from_silence(speech, sample_rate, [max(speech_units(text), 1.0) for text in texts])
+    edges = [0] + [int(round(cut * sample_rate)) for cut in cuts] + [len(speech)]
+    return [speech[edges[k]:edges[k + 1]] for k in range(len(texts))]
+
+
+async def synthesize_cues(texts, starts, slots, voice, provider=None, concurrency=None, sample_rate=SPEECH_SAMPLE_RATE, group=True):
+    """
+    为一组字幕合成语音：相邻短字幕合并为一个请求，合成后按字幕边界切回，每段仍放在自己的字幕时间上
+    切回的片段统一裁掉首尾静音、拉齐响度；语速按每组的可用时长规划，裁剪后的实际时长用于更新语速模型
+    :param texts: 文本列表，按时间排序
+    :param starts: 每条字幕的开始时间（秒）
+    :param slots: 每条字幕的时长（秒）
+    :param voice: 音色
+    :param provider: 合成引擎名称或实例，默认读取settings.json
+    :param concurrency: 同时进行的合成请求数，默认读取settings.json
+    :param sample_rate: 解码采样率
+    :param group: 是否合并短字幕
+    :return: 与texts顺序一致的float32数组列表，失败的为None
+    """
+    from tts_providers import get_provider
+    from voice import synthesize_clips
+    engine = get_provider(provider)
+    rate_key = f"{engine.name}:{voice}"
+    windows = available_windows(starts, slots)
+    groups = group_cues(texts, starts, slots) if group else [[i] for i in range(len(texts))]
+    requests = [join_texts([texts[i] for i in members])[0] for members in groups]
+    # 一组的可用时长为第一条字幕开始到最后一条字幕可用时长结束
+    group_windows = [starts[members[-1]] + windows[members[-1]] - starts[members[0]] for members in groups]
+    rates = plan_rates(requests, group_windows, rate_key)
+    if len(groups) < len(texts):
+        print(f"合并短字幕: {len(texts)} 条字幕合并为 {len(groups)} 个合成请求")
+    clips, _ = await synthesize_clips(requests, concurrency=concurrency, provider=engine, voice=voice, rates=rates, boundaries=True)
+    # 所有片段拼成一个码流，只解码一次
+    arrays = decode_clips(clips, sample_rate)
+
+    results = [None] * len(texts)
+    for members, speech, clip in zip(groups, arrays, clips):
+        if speech is None or not len(speech):
+            continue
+        for i, piece in zip(members, split_group(speech, sample_rate, [texts[i] for i in members], clip)):
+            results[i] = piece
+    # 裁掉首尾静音后片段才是真正需要的时长，语速模型也按裁剪后的时长学习
+    results = trim_and_normalize(results, sample_rate)
+    seconds = []
+    for members in groups:
+        pieces = [results[i] for i in members if results[i] is not None]
+        seconds.append(sum(len(piece) for piece in pieces) / sample_rate if pieces else None)
+    learn_speaking_rate(rate_key, requests, rates, sample_rate=sample_rate, seconds=seconds)
+    return results
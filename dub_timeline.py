@@ -0,0 +1,110 @@
+import math
+
+# 配音片段之间至少保留的间隔（秒）
+MIN_GAP = 0.05
+# 开始时间允许提前/推迟的上限（秒）
+MAX_LEAD = 0.2
+MAX_LAG = 0.3
+# 借用间隔和移动开始时间都不够时，最多压缩到的倍数（保持音高）
+MAX_SPEED = 1.6
+
+
+class Placement:
+    """
+    一段配音在时间轴上的位置：开始时间、变速倍数和结束时间（秒）
+    """
+    __slots__ = ("start", "speed", "end")
+
+    def __init__(self, start, speed, end):
+        self.start = start
+        self.speed = speed
+        self.end = end
+
+    def __repr__(self):
+        return f"Placement(start={self.start:.3f}, speed={self.speed:.3f}, end={self.end:.3f})"
+
+
+def available_windows(starts, slots, total=None, min_gap=MIN_GAP):
+    """
+    每段配音在不挤占下一条字幕的前提下可用的时长：到下一条字幕开始为止（包含字幕后面的空白）
+    :param starts: 每条字幕的开始时间（秒），按时间排序
+    :param slots: 每条字幕的时长（秒）
+    :param total: 视频总时长，用于最后一条字幕
+    :param min_gap: 与下一段之间保留的间隔
+    :return: 可用时长列表
+    """
+    windows = []
+    for i, (start, slot) in enumerate(zip(starts, slots)):
+        if i + 1 < len(starts):
+            limit = starts[i + 1] - min_gap
+        else:
+            limit = total if total is not None else start + slot
+        windows.append(max(slot, limit - start))
+    return windows
+
+
+def solve_timeline(starts, slots, lengths, total=None, min_gap=MIN_GAP, max_lead=MAX_LEAD, max_lag=MAX_LAG, max_speed=MAX_SPEED):
+    """
+    一次遍历为所有配音片段安排位置，按代价从低到高依次尝试：
+    1. 在字幕开始时播放，超出字幕时长的部分延伸到后面的空白中
+    2. 提前开始（不超过max_lead，不与上一段重叠）
+    3. 允许下一段推迟开始（不超过max_lag）
+    4. 以上都不够时才压缩语音，倍数不超过max_speed
+    每段只依赖上一段的结束时间，时间复杂度为O(n)
+    :param starts: 每条字幕的开始时间（秒），按时间排序
+    :param slots: 每条字幕的时长（秒）
+    :param lengths: 每段配音的实际时长（秒）
+    :param total: 视频总时长，最后一段不超过这个时间
+    :param min_gap: 相邻两段之间保留的间隔
+    :param max_lead: 开始时间最多提前的秒数
+    :param max_lag: 开始时间最多推迟的秒数
+    :param max_speed: 最大压缩倍数
+    :return: 与输入顺序一致的Placement列表
+    """
+    placements = []
+    previous_end = -math.inf
+    count = len(starts)
+    for i in range(count):
+        start, slot, length = starts[i], slots[i], lengths[i]
+        earliest = max(start - max_lead, previous_end + min_gap, 0.0)
+        # 上一段被压缩到极限后仍然超出时，这一段只能顺延
+        desired = max(start, earliest)
+        if i + 1 < count:
+            strict_end = starts[i + 1] - min_gap
+            relaxed_end = starts[i + 1] + max_lag - min_gap
+        else:
+            strict_end = relaxed_end = total if total is not None else math.inf
+
+        placement = None
+        for end_limit in (strict_end, relaxed_end):
+            # 尽量不提前：只提前到刚好能在end_limit前结束的位置
+            begin = min(desired, max(earliest, end_limit - length))
+            if begin + length <= end_limit + 1e-6:
+                placement = Placement(begin, 1.0, begin + length)
+                break
+        if placement is None:
+            available = relaxed_end - earliest
+            speed = min(max_speed, length / available) if available > 0 else max_speed
+            speed = max(1.0, speed)
+            placement = Placement(earliest, speed, earliest + length / speed)
+        placements.append(placement)
+        previous_end = placement.end
+    return placements
+
+
+def timeline_report(starts, placements):
+    """
+    统计时间轴调整情况
+    :return: (提前或推迟的段数, 压缩的段数, 最大偏移秒数)
+    """
+    shifted = 0
+    compressed = 0
+    max_offset = 0.0
+    for start, placement in zip(starts, placements):
+        offset = abs(placement.start - start)
+        if offset > 1e-3:
+            shifted += 1
+            max_offset = max(max_offset, offset)
+        if placement.speed > 1.0:
+            compressed += 1
+    return shifted, compressed, max_offset
@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import math
+import threading
+from audio_codec import SPEECH_SAMPLE_RATE
+
+# 语速测量结果与语音缓存放在同一目录下
+VOICE_RATES_PATH = os.path.join(os.path.expanduser("~"), ".youtube_mover", "voice_rates.json")
+# 没有测量数据时使用的默认值（+0%语速下每秒的发音单位数、每段固定的首尾静音秒数）
+DEFAULT_UNITS_PER_SECOND = {"zh": 4.2, "en": 2.7}
+DEFAULT_LEAD_SECONDS = 0.25
+# 可以请求的语速范围（百分比），按步长取整以提高语音缓存的命中率
+MIN_RATE = 0
+MAX_RATE = 100
+RATE_STEP = 5
+# 预测时给可用时长留出的余量
+FIT_MARGIN = 0.95
+# 测量数据超过这个条数后整体衰减一半，语速模型能跟上音色的变化
+_MAX_SAMPLES = 2000
+_MIN_SAMPLES = 20
+
+_CJK = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+_WORD = re.compile(r"[A-Za-z0-9]+(?:'[A-Za-z]+)?")
+_PAUSE = re.compile(r'[，。！？；：,.!?;:、…]')
+
+
+def speech_units(text):
+    """
+    估计一段文本的发音单位数：每个汉字、每个英文单词或数字记1，标点停顿记0.5
+    :param text: 文本
+    :return: 发音单位数
+    """
+    return len(_CJK.findall(text)) + len(_WORD.findall(text)) + 0.5 * len(_PAUSE.findall(text.rstrip('，。！？；：,.!?;:、… ')))
+
+
+def rate_to_speed(rate):
+    """
+    把edge-tts的语速/音量字符串（如"+30%"）转换为倍数
+    """
+    try:
+        return max(0.01, 1 + float(str(rate).strip().rstrip('%')) / 100)
+    except ValueError:
+        return 1.0
+
+
+def speed_to_rate(speed, min_rate=MIN_RATE, max_rate=MAX_RATE, step=RATE_STEP):
+    """
+    把速度倍数转换为edge-tts的语速字符串，向上取整到步长并限制在范围内
+    """
+    percent = math.ceil(round((speed - 1) * 100, 6) / step) * step
+    percent = int(min(max_rate, max(min_rate, percent)))
+    return f"{percent:+d}%"
+
+
+class SpeakingRateProfile:
+    """
+    每个音色的语速模型：时长 = 固定静音 + 发音单位数 × 每单位秒数 / 速度倍数
+    用最小二乘拟合已合成片段的实际时长，只保存累计和，更新和预测都是常数时间
+    """
+    def __init__(self, path=None):
+        """
+        :param path: 测量数据文件，默认 ~/.youtube_mover/voice_rates.json
+        """
+        self.path = path or VOICE_RATES_PATH
+        self._voices = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._voices is not None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._voices = json.load(f)
+        except (OSError, ValueError):
+            self._voices = {}
+
+    def save(self):
+        with self._lock:
+            if self._voices is None:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self._voices, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+
+    def model(self, voice):
+        """
+        返回音色的 (固定静音秒数, 每单位秒数)，测量数据不足时使用按语言的默认值
+        :param voice: 音色，或"引擎:音色"形式的键（不同引擎的语速分开测量）
+        """
+        with self._lock:
+            self._load()
+            sums = self._voices.get(voice)
+        if sums and sums["n"] >= _MIN_SAMPLES:
+            n, sx, sy, sxx, sxy = sums["n"], sums["x"], sums["y"], sums["xx"], sums["xy"]
+            det = n * sxx - sx * sx
+            if det > 1e-9:
+                slope = (n * sxy - sx * sy) / det
+                lead = (sy - slope * sx) / n
+                if slope > 0:
+                    return max(0.0, lead), slope
+        # 键可以带引擎前缀（如"pyttsx3:zh-CN-YunxiNeural"），语言取音色名的第一段
+        language = voice.rsplit(":", 1)[-1].split("-")[0].lower()
+        return DEFAULT_LEAD_SECONDS, 1.0 / DEFAULT_UNITS_PER_SECOND.get(language, 3.5)
+
+    def predict(self, voice, text, speed=1.0):
+        """
+        预测文本在指定速度倍数下的合成时长（秒）
+        """
+        lead, per_unit = self.model(voice)
+        return lead + speech_units(text) * per_unit / speed
+
+    def observe(self, voice, texts, rates, seconds):
+        """
+        记录实际合成时长
+        :param voice: 音色
+        :param texts: 文本列表
+        :param rates: 每条文本请求的语速字符串
+        :param seconds: 每条的实际时长（秒），None表示合成失败
+        """
+        with self._lock:
+            self._load()
+            sums = self._voices.setdefault(voice, {"n": 0, "x": 0.0, "y": 0.0, "xx": 0.0, "xy": 0.0})
+            for text, rate, duration in zip(texts, rates, seconds):
+                if not duration:
+                    continue
+                x = speech_units(text) / rate_to_speed(rate)
+                sums["n"] += 1
+                sums["x"] += x
+                sums["y"] += duration
+                sums["xx"] += x * x
+                sums["xy"] += x * duration
+            if sums["n"] > _MAX_SAMPLES:
+                for key in sums:
+                    sums[key] /= 2
+
+
+_default_profile = None
+
+
+def get_rate_profile():
+    global _default_profile
+    if _default_profile is None:
+        _default_profile = SpeakingRateProfile()
+    return _default_profile
+
+
+def plan_rates(texts, slots, voice, profile=None, min_rate=MIN_RATE, max_rate=MAX_RATE):
+    """
+    为每条字幕预测所需语速，让合成时长直接落在可用时长内
+    :param texts: 文本列表
+    :param slots: 每条字幕的可用时长（秒），见dub_timeline.available_windows
+    :param voice: 音色
+    :param profile: SpeakingRateProfile，默认使用共享实例
+    :param min_rate: 最慢语速（百分比）
+    :param max_rate: 最快语速（百分比）
+    :return: 与texts顺序一致的语速字符串列表
+    """
+    profile = profile or get_rate_profile()
+    lead, per_unit = profile.model(voice)
+    rates = []
+    for text, slot in zip(texts, slots):
+        spoken = speech_units(text) * per_unit
+        budget = slot * FIT_MARGIN - lead
+        speed = spoken / budget if budget > 0 else float('inf')
+        rates.append(speed_to_rate(speed if math.isfinite(speed) else 1 + max_rate / 100, min_rate, max_rate))
+    return rates
+
+
+def learn_speaking_rate(voice, texts, rates, arrays=None, sample_rate=SPEECH_SAMPLE_RATE, seconds=None):
+    """
+    用本批的实际时长更新语速模型
+    :param voice: 音色
+    :param texts: 文本列表
+    :param rates: 合成时使用的语速列表
+    :param arrays: 解码后的语音数组列表（None表示合成失败）
+    :param sample_rate: 采样率
+    :param seconds: 每条的实际时长（秒），提供时不再由arrays计算（如裁剪静音后的时长）
+    """
+    profile = get_rate_profile()
+    if seconds is None:
+        seconds = [len(speech) / sample_rate if speech is not None else None for speech in arrays]
+    profile.observe(voice, texts, rates, seconds)
+    try:
+        profile.save()
+    except OSError as e:
+        print(f"保存语速测量数据失败: {e}")
@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from uuid import uuid4
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+# 处理记录放在用户目录下，按监视目录分别保存
+WATCH_STATE_DIR = os.path.join(os.path.expanduser("~"), ".youtube_mover", "watch")
+# 文件大小和修改时间保持不变这么多秒后才认为上传/复制已经完成
+STABLE_SECONDS = 1.0
+# 检查文件是否稳定的间隔（秒）
+TICK_SECONDS = 0.25
+# 没有watchdog时轮询目录的间隔（秒）
+POLL_INTERVAL = 1.0
+# 同一个文件失败这么多次后移入隔离目录，不再重试
+MAX_ATTEMPTS = 3
+# 失败后重试前的等待时间（秒），之后按指数增长
+RETRY_DELAY = 30.0
+
+
+def file_fingerprint(path, stat=None):
+    """
+    文件的身份：路径 + 大小 + 修改时间，同名文件被替换后会得到新的身份
+    """
+    stat = stat or os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+class WatchLedger:
+    """
+    持久化的处理记录：每个文件身份的状态（active/done/failed/poison）和失败次数
+    每次变化都写临时文件再替换，进程中途退出后记录仍然完整；重启后active的文件视为失败一次后重试
+    """
+    def __init__(self, folder, path=None):
+        """
+        :param folder: 监视的目录
+        :param path: 记录文件，默认 ~/.youtube_mover/watch/<目录哈希>.json
+        """
+        digest = hashlib.sha1(os.path.abspath(folder).encode('utf-8')).hexdigest()[:16]
+        self.path = path or os.path.join(WATCH_STATE_DIR, f"{digest}.json")
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        for entry in self.entries.values():
+            if entry.get("status") == "active":
+                entry["status"] = "failed"
+                entry["attempts"] = entry.get("attempts", 0) + 1
+                entry["error"] = "处理过程中程序退出"
+
+    def get(self, key):
+        with self._lock:
+            return dict(self.entries.get(key) or {})
+
+    def update(self, key, **fields):
+        with self._lock:
+            entry = self.entries.setdefault(key, {"attempts": 0})
+            entry.update(fields, updated=time.time())
+            self._save()
+            return dict(entry)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+
+class FolderWatcher:
+    """
+    监视目录中新出现的视频：文件系统事件（watchdog，Linux下为inotify）触发检查，没有watchdog时退回轮询
+    文件大小和修改时间稳定后才交给处理函数；处理过的文件按身份去重，多次失败的文件移入隔离目录
+    """
+    def __init__(self, folder, submit, extensions=VIDEO_EXTENSIONS, ledger=None, stable_seconds=STABLE_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY, poison_dir=None, archive_dir=None, poll_interval=POLL_INTERVAL):
+        """
+        :param folder: 监视的目录
+        :param submit: 处理函数 submit(path)，应尽快返回；处理结束后调用complete报告结果
+        :param extensions: 需要处理的文件扩展名
+        :param ledger: WatchLedger，默认按目录创建
+        :param stable_seconds: 文件大小和修改时间保持不变的秒数
+        :param max_attempts: 最多尝试次数
+        :param retry_delay: 第一次重试前的等待时间（秒）
+        :param poison_dir: 多次失败的文件移到这个目录，默认 <folder>/poison
+        :param archive_dir: 处理成功的文件移到这个目录（None表示留在原处，靠处理记录去重）
+        :param poll_interval: 没有watchdog时轮询目录的间隔（秒）
+        """
+        self.folder = os.path.abspath(folder)
+        self.submit = submit
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.ledger = ledger or WatchLedger(self.folder)
+        self.stable_seconds = stable_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poison_dir = poison_dir or os.path.join(self.folder, "poison")
+        self.archive_dir = archive_dir
+        self.poll_interval = poll_interval
+        # 等待稳定的文件：路径 → (大小, 修改时间, 最近一次变化的时间)
+        self._pending = {}
+        # 正在处理的文件：路径 → 身份
+        self._active = {}
+        # 等待重试的文件：路径 → 重试时间
+        self._retry = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self._observer = self._start_observer()
+        if self._observer is None:
+            print(f"未安装watchdog，每 {self.poll_interval} 秒轮询一次: {self.folder}")
+        else:
+            print(f"正在监视目录: {self.folder}")
+        # 启动前已经存在的文件
+        self.scan()
+        threading.Thread(target=self._loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+    def wait(self):
+        try:
+            while not self._stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def _start_observer(self):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return None
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # 只关心新建、写入、移动和写入后关闭；自己读取文件产生的打开事件不处理
+                if event.is_directory or event.event_type not in ("created", "modified", "moved", "closed"):
+                    return
+                # 移动事件的目标路径才是新文件
+                watcher.notice(getattr(event, "dest_path", None) or event.src_path)
+
+        observer = Observer()
+        observer.schedule(Handler(), self.folder, recursive=False)
+        observer.start()
+        return observer
+
+    def _wanted(self, path):
+        name = os.path.basename(path)
+        return (os.path.dirname(os.path.abspath(path)) == self.folder and not name.startswith(".")
+                and name.lower().endswith(self.extensions))
+
+    def notice(self, path):
+        """
+        文件出现或发生变化：重新开始稳定计时
+        """
+        if not self._wanted(path):
+            return
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._pending.pop(path, None)
+            return
+        with self._lock:
+            if path in self._active or path in self._retry:
+                return
+            previous = self._pending.get(path)
+            if previous is None or previous[:2] != (stat.st_size, stat.st_mtime_ns):
+                self._pending[path] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+
+    def scan(self):
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        for name in names:
+            self.notice(os.path.join(self.folder, name))
+
+    def _loop(self):
+        last_scan = time.monotonic()
+        while not self._stop.wait(TICK_SECONDS):
+            now = time.monotonic()
+            if self._observer is None and now - last_scan >= self.poll_interval:
+                self.scan()
+                last_scan = now
+            with self._lock:
+                candidates = [path for path, (_, _, changed) in self._pending.items() if now - changed >= self.stable_seconds]
+                due = [path for path, when in self._retry.items() if now >= when]
+                for path in due:
+                    del self._retry[path]
+            for path in due:
+                self.notice(path)
+            for path in candidates:
+                self._check(path)
+
+    def _check(self, path):
+        """
+        再看一次大小和修改时间，稳定且能打开时交给处理函数
+        """
+        try:
+            stat = os.stat(path)
+            # 其他程序仍以独占方式写入时（Windows复制中）打开会失败
+            with open(path, 'rb'):
+                pass
+        except OSError:
+            with self._lock:
+                self._pending.pop(path, None)
+            return
+        with self._lock:
+            size, mtime, _ = self._pending.get(path, (None, None, None))
+            if (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+                self._pending[path] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+                return
+            del self._pending[path]
+            if path in self._active or stat.st_size == 0:
+                return
+        key = file_fingerprint(path, stat)
+        entry = self.ledger.get(key)
+        if entry.get("status") in ("done", "poison", "active"):
+            return
+        if entry.get("attempts", 0) >= self.max_attempts:
+            self._quarantine(path, key, entry.get("error"))
+            return
+        with self._lock:
+            self._active[path] = key
+        self.ledger.update(key, status="active", path=path)
+        print(f"发现新视频: {path}")
+        try:
+            self.submit(path)
+        except Exception as e:
+            self.complete(path, False, e)
+
+    def complete(self, path, ok, error=None):
+        """
+        处理函数报告结果：成功的记为done（并归档），失败的稍后重试，达到次数上限后隔离
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            key = self._active.pop(path, None)
+        if key is None:
+            return
+        if ok:
+            self.ledger.update(key, status="done", error=None)
+            if self.archive_dir and os.path.exists(path):
+                os.makedirs(self.archive_dir, exist_ok=True)
+                shutil.move(path, os.path.join(self.archive_dir, f"{uuid4()}{os.path.splitext(path)[1]}"))
+            return
+        attempts = self.ledger.get(key).get("attempts", 0) + 1
+        self.ledger.update(key, status="failed", attempts=attempts, error=str(error))
+        if attempts >= self.max_attempts:
+            self._quarantine(path, key, error)
+        else:
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            print(f"处理失败（第 {attempts} 次），{delay:.0f} 秒后重试: {path}")
+            with self._lock:
+                self._retry[path] = time.monotonic() + delay
+
+    def _quarantine(self, path, key, error):
+        os.makedirs(self.poison_dir, exist_ok=True)
+        target = os.path.join(self.poison_dir, os.path.basename(path))
+        if os.path.exists(target):
+            root, ext = os.path.splitext(target)
+            target = f"{root}_{uuid4().hex[:8]}{ext}"
+        try:
+            shutil.move(path, target)
+        except OSError as e:
+            print(f"移动到隔离目录失败: {e}")
+            target = path
+        self.ledger.update(key, status="poison", poison_path=target)
+        print(f"多次处理失败，已移入隔离目录: {target}（{error}）")
+
+
+def watch_folder(folder, output_dir, archive_dir=None, poison_dir=None, daemon=None, **options):
+    """
+    监视目录并把新视频交给流水线处理，直到按Ctrl+C退出
+    :param folder: 监视的目录
+    :param output_dir: 输出目录
+    :param archive_dir: 处理成功的视频移到这个目录（None表示留在原处）
+    :param poison_dir: 多次失败的视频移到这个目录，默认 <folder>/poison
+    :param daemon: 是否交给常驻进程处理（worker_daemon），None表示按settings.json的worker_daemon；常驻进程不可用时在本进程中处理
+    :param options: 传给batch_scheduler.video_pipeline的处理参数
+    """
+    from worker_daemon import connect, use_daemon
+    client = connect(preload=options.get("model_size")) if (use_daemon() if daemon is None else daemon) else None
+    watcher = None
+
+    if client is not None:
+        # 只负责发现文件和记录结果，模型常驻在后台进程中
+        def run(path):
+            try:
+                result = client.submit(path, output_dir, **options)
+                ok, error = result.get("ok", False), result.get("error")
+                if ok:
+                    print(f"处理完成: {path} -> {result.get('output')}")
+            except Exception as e:
+                ok, error = False, e
+            watcher.complete(path, ok, error)
+
+        submit = lambda path: threading.Thread(target=run, args=(path,), daemon=True).start()
+    else:
+        from batch_scheduler import BatchJob, video_pipeline
+
+        def on_done(job):
+            if job.ok:
+                print(f"处理完成: {job.video_path} -> {job.output_path}")
+            watcher.complete(job.video_path, job.ok, job.error)
+
+        pipeline = video_pipeline(output_dir, on_done=on_done, **options).start()
+        submit = lambda path: pipeline.submit(BatchJob(path, output_dir))
+    watcher = FolderWatcher(folder, submit, archive_dir=archive_dir, poison_dir=poison_dir).start()
+    watcher.wait()
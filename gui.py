@@ -2,7 +2,8 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
 import os
-from video_processor_pro import simple_process
+from batch_scheduler import STAGE_NAMES
+from worker_daemon import connect, use_daemon
 
 
 class VideoProcessorGUI:
@@ -182,30 +183,34 @@ class VideoProcessorGUI:
                 self.log_message(f"开始批量处理目录: {self.batch_directory.get()}")
                 self.log_message(f"找到 {len(video_files)} 个视频文件")
                 
-                # 处理每个视频文件
-                for i, video_file in enumerate(video_files, 1):
-                    video_path = os.path.join(self.batch_directory.get(), video_file)
-                    self.log_message(f"\n正在处理 ({i}/{len(video_files)}): {video_file}")
-                    
-                    try:
-                        output_path = simple_process(
-                            video_path=video_path,
-                            output_dir=self.output_dir.get(),
-                            add_translation=self.add_translation.get(),
-                            model_size=self.model_size.get(),
-                            burn_subtitles=self.burn_subtitles.get(),
-                            replace_audio=self.replace_audio.get(),
-                            skip_subtitle_generation=self.skip_subtitle_generation.get(),
-                            volume_factor=self.volume_factor.get()
-                        )
-                        
-                        if output_path:
-                            self.log_message(f"  完成: {video_file} -> {output_path}")
+                video_paths = [os.path.join(self.batch_directory.get(), video_file) for video_file in video_files]
+                options = dict(
+                    model_size=self.model_size.get(),
+                    add_translation=self.add_translation.get(),
+                    burn_subtitles=self.burn_subtitles.get(),
+                    replace_audio=self.replace_audio.get(),
+                    skip_subtitle_generation=self.skip_subtitle_generation.get(),
+                    volume_factor=self.volume_factor.get()
+                )
+                client = self.daemon_client()
+                if client is not None:
+                    # 交给常驻进程的流水线，GUI只负责提交和显示进度
+                    for video_path, result in zip(video_paths, client.run_many(video_paths, self.output_dir.get(), on_event=self.log_event, **options)):
+                        if result and result.get("ok"):
+                            self.log_message(f"  完成: {os.path.basename(video_path)} -> {result['output']}")
+                        else:
+                            self.log_message(f"  错误: {os.path.basename(video_path)} - {(result or {}).get('error')}")
+                else:
+                    from batch_scheduler import process_batch
+
+                    # 转录、翻译、语音合成、混音、渲染分阶段流水线处理，多个视频的不同阶段同时进行
+                    def on_done(job):
+                        if job.ok and job.output_path:
+                            self.log_message(f"  完成: {os.path.basename(job.video_path)} -> {job.output_path}")
                         else:
-                            self.log_message(f"  失败: {video_file}")
-                            
-                    except Exception as e:
-                        self.log_message(f"  错误: {video_file} - {str(e)}")
+                            self.log_message(f"  错误: {os.path.basename(job.video_path)} - {job.failed_stage}: {job.error}")
+
+                    process_batch(video_paths, output_dir=self.output_dir.get(), on_done=on_done, **options)
                         
                 self.log_message(f"\n批量处理完成! 共处理 {len(video_files)} 个文件")
                 self.show_info(f"批量处理完成! 共处理 {len(video_files)} 个文件")
@@ -224,9 +229,7 @@ class VideoProcessorGUI:
                 self.log_message(f"开始处理视频: {self.video_path.get()}")
                 
                 # Call the processing function
-                output_path = simple_process(
-                    video_path=self.video_path.get(),
-                    output_dir=self.output_dir.get(),
+                options = dict(
                     add_translation=self.add_translation.get(),
                     model_size=self.model_size.get(),
                     burn_subtitles=self.burn_subtitles.get(),
@@ -234,6 +237,14 @@ class VideoProcessorGUI:
                     skip_subtitle_generation=self.skip_subtitle_generation.get(),
                     volume_factor=self.volume_factor.get()
                 )
+                client = self.daemon_client()
+                if client is not None:
+                    # 常驻进程中模型已经加载，提交后立即开始处理
+                    result = client.submit(self.video_path.get(), self.output_dir.get(), on_event=self.log_event, mode="process", **options)
+                    output_path = result.get("output") if result.get("ok") else None
+                else:
+                    from video_processor_pro import simple_process
+                    output_path = simple_process(video_path=self.video_path.get(), output_dir=self.output_dir.get(), **options)
                 
                 if output_path:
                     self.log_message(f"处理完成! 输出文件: {output_path}")
@@ -249,6 +260,27 @@ class VideoProcessorGUI:
             # Re-enable the process button
             self.root.after(0, lambda: self.process_button.config(state=tk.NORMAL))
             
+    def daemon_client(self):
+        """
+        :return: 常驻进程的客户端（没有运行时启动一个），未开启或无法启动时返回None，在本进程中处理
+        """
+        if not use_daemon():
+            return None
+        client = connect(preload=self.model_size.get())
+        if client is None:
+            self.log_message("常驻进程不可用，在本进程中处理")
+        return client
+
+    def log_event(self, event):
+        """
+        显示常驻进程推送的进度事件
+        """
+        if event.get("event") == "stage" and event.get("state") in ("done", "failed"):
+            state = "完成" if event["state"] == "done" else "出错"
+            self.log_message(f"  [{event['job']}] {STAGE_NAMES.get(event['stage'], event['stage'])}{state}，用时 {event['seconds']:.1f} 秒")
+        elif event.get("event") == "accepted":
+            self.log_message(f"  已提交任务 {event['job']}")
+
     def log_message(self, message):
         self.root.after(0, lambda: self._log_message_thread_safe(message))
         
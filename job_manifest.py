@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# 不超过这个大小的文件计算完整哈希，更大的文件（视频、片段仓库）只读开头和结尾
+FULL_HASH_BYTES = 64 * 1024 * 1024
+SAMPLE_BYTES = 1024 * 1024
+MANIFEST_VERSION = 1
+
+
+def file_digest(path):
+    """
+    文件内容的摘要：小文件为完整sha256，大文件为 大小 + 开头和结尾各1MB 的sha256
+    :param path: 文件路径
+    :return: 十六进制字符串，文件不存在时返回None
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    digest = hashlib.sha256(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        if size <= FULL_HASH_BYTES:
+            for block in iter(lambda: f.read(SAMPLE_BYTES), b''):
+                digest.update(block)
+        else:
+            digest.update(f.read(SAMPLE_BYTES))
+            f.seek(size - SAMPLE_BYTES)
+            digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def inputs_key(*parts):
+    """
+    把阶段的输入（上游产物的摘要、影响结果的参数）合成一个键
+    """
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def partial_path(path):
+    """
+    输出的临时路径：扩展名不变（FFmpeg按扩展名选择封装格式），完成后用commit_output换成正式文件
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.partial-{os.getpid()}-{threading.get_ident()}{ext}"
+
+
+def commit_output(temp_path, path):
+    """
+    把写完的临时文件原子地换成正式文件，中途崩溃不会留下写了一半的正式文件
+    """
+    os.replace(temp_path, path)
+    return path
+
+
+class JobManifest:
+    """
+    单个视频任务的清单：每个已完成阶段的输入键、产物路径和产物摘要
+    重新运行时，输入没有变化且产物完好的阶段直接跳过，从第一个未完成的阶段继续
+    清单本身也是先写临时文件再替换
+    """
+    def __init__(self, path, source=None):
+        """
+        :param path: 清单文件路径（通常为 <输出目录>/<视频名>.job.json）
+        :param source: 源视频路径，记录在清单中便于排查
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data.get("version") != MANIFEST_VERSION:
+            data = {"version": MANIFEST_VERSION, "stages": {}}
+        self.data = data
+        if source:
+            self.data["source"] = os.path.abspath(source)
+
+    @classmethod
+    def for_video(cls, video_path, output_dir):
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        return cls(os.path.join(output_dir, f"{name}.job.json"), source=video_path)
+
+    def completed(self, stage, inputs):
+        """
+        :param stage: 阶段名
+        :param inputs: inputs_key计算的输入键
+        :return: 阶段已完成、输入一致且产物完好时返回产物 {名称: 路径}，否则返回None
+        """
+        with self._lock:
+            record = self.data["stages"].get(stage)
+        if not record or record.get("inputs") != inputs:
+            return None
+        for name, path in record["artifacts"].items():
+            if file_digest(path) != record["digests"].get(name):
+                return None
+        return dict(record["artifacts"])
+
+    def edited(self, stage, inputs, name):
+        """
+        产物是否在阶段完成后被手动修改过（如编辑过翻译字幕）：阶段输入一致、文件存在但内容变了
+        :return: 被修改的产物路径，否则返回None
+        """
+        with self._lock:
+            record = self.data["stages"].get(stage)
+        if not record or record.get("inputs") != inputs:
+            return None
+        path = record["artifacts"].get(name)
+        digest = file_digest(path) if path else None
+        return path if digest is not None and digest != record["digests"].get(name) else None
+
+    def complete(self, stage, inputs, details=None, **artifacts):
+        """
+        记录阶段完成，产物必须已经写好（用commit_output换成正式文件之后再调用）
+        :param stage: 阶段名
+        :param inputs: 输入键
+        :param details: 需要随阶段保存的其他信息（如渲染时的字幕，用于下一次增量处理）
+        :param artifacts: 产物 {名称: 路径}
+        """
+        record = {
+            "inputs": inputs,
+            "artifacts": {name: os.path.abspath(path) for name, path in artifacts.items()},
+            "digests": {name: file_digest(path) for name, path in artifacts.items()},
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        if details is not None:
+            record["details"] = details
+        with self._lock:
+            self.data["stages"][stage] = record
+            self._save()
+
+    def clear(self):
+        """
+        清空所有阶段的记录，下一次全部重新处理
+        """
+        with self._lock:
+            self.data["stages"] = {}
+            self._save()
+
+    def details(self, stage):
+        """
+        :return: complete时保存的其他信息，未记录时返回空字典
+        """
+        with self._lock:
+            record = self.data["stages"].get(stage) or {}
+        return record.get("details") or {}
+
+    def artifact(self, stage, name):
+        """
+        :return: 已记录的产物路径，未记录时返回None
+        """
+        with self._lock:
+            record = self.data["stages"].get(stage) or {}
+        return (record.get("artifacts") or {}).get(name)
+
+    def digest(self, stage, name):
+        """
+        :return: 已记录的产物摘要，用作下游阶段的输入
+        """
+        with self._lock:
+            record = self.data["stages"].get(stage) or {}
+        return (record.get("digests") or {}).get(name)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
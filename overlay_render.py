@@ -0,0 +1,133 @@
+import os
+import time
+import shutil
+import subprocess
+import pysrt
+from PIL import Image
+
+# 字幕底部距离画面底部的边距，与逐帧叠加保持一致
+BOTTOM_MARGIN = 36
+
+
+def write_cue_images(layout, subtitles, width, work_dir):
+    """
+    每条不同的字幕只渲染一次，保存为统一尺寸的透明PNG
+    :param layout: 提供字幕排版方法的VideoProcessor
+    :param subtitles: pysrt字幕列表
+    :param width: 视频宽度
+    :param work_dir: PNG输出目录
+    :return: ({字幕文本: PNG路径}, 空白PNG路径)
+    """
+    font_en, font_zh = layout._load_fonts()
+    template = layout._pre_render_universal_template(width, font_en, font_zh)
+    images = {}
+    for sub in subtitles:
+        if sub.text not in images:
+            images[sub.text] = layout._render_subtitle_on_template(template, sub.text, font_en, font_zh)
+
+    # 拼接成图像序列要求尺寸一致，按最高的字幕补齐，图像底部对齐保持原有位置
+    canvas_height = max([image.height for image in images.values()] + [template.height])
+    paths = {}
+    for i, (text, image) in enumerate(images.items()):
+        canvas = Image.new('RGBA', (width, canvas_height), (0, 0, 0, 0))
+        canvas.paste(image, (0, canvas_height - image.height))
+        path = os.path.join(work_dir, f"cue_{i:05d}.png")
+        canvas.save(path, compress_level=1)
+        paths[text] = path
+    blank_path = os.path.join(work_dir, "blank.png")
+    Image.new('RGBA', (width, canvas_height), (0, 0, 0, 0)).save(blank_path)
+    return paths, blank_path
+
+
+def _concat_path(path):
+    return os.path.abspath(path).replace('\\', '/').replace("'", "'\\''")
+
+
+def write_overlay_concat(subtitles, paths, blank_path, duration, list_path):
+    """
+    把字幕时间轴写成concat demuxer的图像序列，空白时段用透明图填充
+    :param subtitles: pysrt字幕列表
+    :param paths: {字幕文本: PNG路径}
+    :param blank_path: 空白PNG路径
+    :param duration: 视频时长（秒）
+    :param list_path: 输出的ffconcat文件路径
+    """
+    entries = []
+
+    def add(path, seconds):
+        if seconds > 0:
+            entries.append((path, seconds))
+
+    cursor = 0.0
+    for sub in sorted(subtitles, key=lambda sub: sub.start.ordinal):
+        start = max(sub.start.ordinal / 1000.0, cursor)
+        end = min(sub.end.ordinal / 1000.0, duration)
+        if end <= start:
+            continue
+        add(blank_path, start - cursor)
+        add(paths[sub.text], end - start)
+        cursor = end
+    add(blank_path, max(duration - cursor, 0.001))
+
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write("ffconcat version 1.0\n")
+        for path, seconds in entries:
+            f.write(f"file '{_concat_path(path)}'\n")
+            # 图像默认时间基是1/25秒，提高到毫秒避免字幕时间被取整
+            f.write("option framerate 1000\n")
+            f.write(f"duration {seconds:.3f}\n")
+        # concat demuxer会忽略最后一项的duration，重复一次最后的文件
+        if entries:
+            f.write(f"file '{_concat_path(entries[-1][0])}'\n")
+            f.write("option framerate 1000\n")
+
+
+def render_overlay_track(layout, video_path, subtitle_path, output_path, width, duration, input_args=(), output_args=(), work_dir=None):
+    """
+    预渲染字幕图像序列，再用一次FFmpeg overlay合成到视频上
+    保留自定义双语排版，同时由FFmpeg完成解码、叠加和编码
+    :param layout: 提供字幕排版方法的VideoProcessor
+    :param video_path: 输入视频路径
+    :param subtitle_path: 字幕文件路径
+    :param output_path: 输出视频路径
+    :param width: 视频宽度
+    :param duration: 需要覆盖的时长（秒）
+    :param input_args: 放在视频 -i 之前的额外参数（如 -ss）
+    :param output_args: 放在输出文件之前的额外参数（如 -frames:v）
+    :param work_dir: 临时目录，默认在输出文件旁边
+    :return: 输出视频路径
+    """
+    if work_dir is None:
+        work_dir = os.path.splitext(output_path)[0] + "_overlay"
+    os.makedirs(work_dir, exist_ok=True)
+    started = time.perf_counter()
+    try:
+        subtitles = pysrt.open(subtitle_path, encoding='utf-8')
+        paths, blank_path = write_cue_images(layout, subtitles, width, work_dir)
+        list_path = os.path.join(work_dir, "overlay.ffconcat")
+        write_overlay_concat(subtitles, paths, blank_path, duration, list_path)
+        print(f"字幕图像预渲染完成: {len(paths)} 条, 用时 {time.perf_counter() - started:.1f} 秒")
+
+        ffmpeg_cmd = [
+            'ffmpeg',
+            *input_args,
+            '-i', video_path,
+            '-f', 'concat', '-safe', '0',
+            '-i', list_path,
+            '-filter_complex', f"[1:v]format=rgba[subs];[0:v][subs]overlay=x=(W-w)/2:y=H-h-{BOTTOM_MARGIN}:eof_action=repeat[out]",
+            '-map', '[out]',
+            '-map', '0:a?',
+            *output_args,
+            '-y',
+            output_path
+        ]
+        try:
+            result = subprocess.run(ffmpeg_cmd, capture_output=True)
+        except FileNotFoundError:
+            raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+        if result.returncode != 0:
+            raise RuntimeError(f"FFmpeg执行失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"字幕叠加完成: 用时 {time.perf_counter() - started:.1f} 秒")
+    return output_path
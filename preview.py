@@ -0,0 +1,89 @@
+import os
+import time
+import subprocess
+from combine import has_audio_stream
+
+# 预览视频的编码参数：最快的预设、较高的CRF、低码率单声道音频
+PREVIEW_VIDEO_ARGS = ['-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'fastdecode', '-crf', '30']
+PREVIEW_AUDIO_ARGS = ['-c:a', 'aac', '-b:a', '48k', '-ac', '1']
+
+
+def _filter_path(path):
+    """
+    转义滤镜参数中的文件路径
+    """
+    return os.path.abspath(path).replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+
+
+def write_preview_filter(script_path, subtitle_path, height, original_audio, dub_audio=False):
+    """
+    写出预览使用的滤镜脚本：缩放、烧录字幕，音频使用混好的配音音轨或原音频
+    :param script_path: 滤镜脚本路径
+    :param subtitle_path: 字幕文件路径，None表示不烧录字幕
+    :param height: 预览视频高度
+    :param original_audio: 是否使用原视频音频
+    :param dub_audio: 第二个输入是否为混好的配音音轨（已包含闪避后的原音轨，优先使用）
+    :return: 是否有音频输出
+    """
+    # 缩放放在最前面，后续的字幕渲染和编码都只处理小尺寸画面
+    video_chain = f"[0:v]scale=-2:{height}:flags=fast_bilinear"
+    if subtitle_path:
+        video_chain += f",subtitles='{_filter_path(subtitle_path)}':charenc=utf-8"
+    lines = [video_chain + "[v]"]
+
+    if dub_audio:
+        lines.append("[1:a]anull[a]")
+    elif original_audio:
+        lines.append("[0:a]anull[a]")
+
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write(";\n".join(lines))
+    return bool(dub_audio or original_audio)
+
+
+def render_preview(video_path, subtitle_path, output_path, dub_audio_path=None, height=360, keep_original_audio=True):
+    """
+    用一次FFmpeg生成低分辨率预览：解码后立即缩放，烧录字幕并使用混好的配音音轨，
+    用于在正式渲染前快速检查字幕时间轴和配音对齐
+    :param video_path: 输入视频路径
+    :param subtitle_path: 字幕文件路径，None表示不烧录字幕
+    :param output_path: 预览视频路径
+    :param dub_audio_path: audio_mix.mix_dub输出的配音音轨，None表示不配音
+    :param height: 预览视频高度
+    :param keep_original_audio: 是否保留原视频音频
+    :return: 预览视频路径
+    """
+    script_path = os.path.splitext(output_path)[0] + ".filter.txt"
+    original_audio = keep_original_audio and has_audio_stream(video_path)
+    has_audio = write_preview_filter(script_path, subtitle_path, height, original_audio, dub_audio_path is not None)
+
+    ffmpeg_cmd = [
+        'ffmpeg',
+        # 预览不需要去块滤波，跳过可以明显加快H.264/HEVC解码
+        '-skip_loop_filter', 'all',
+        '-flags2', '+fast',
+        '-i', video_path,
+        *(['-i', dub_audio_path] if dub_audio_path else []),
+        '-filter_complex_script', script_path,
+        '-map', '[v]',
+        *PREVIEW_VIDEO_ARGS,
+    ]
+    if has_audio:
+        ffmpeg_cmd += ['-map', '[a]', *PREVIEW_AUDIO_ARGS, '-shortest']
+    else:
+        ffmpeg_cmd += ['-an']
+    ffmpeg_cmd += ['-movflags', '+faststart', '-y', output_path]
+
+    print(f"正在生成 {height}p 预览...")
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(ffmpeg_cmd, capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+    finally:
+        if os.path.exists(script_path):
+            os.remove(script_path)
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg执行失败: {result.stderr.decode('utf-8', errors='ignore')}")
+    print(f"预览生成完成: {output_path}, 用时 {time.perf_counter() - started:.1f} 秒")
+    return output_path
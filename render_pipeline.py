@@ -0,0 +1,395 @@
+import os
+import time
+import queue
+import bisect
+import threading
+from collections import OrderedDict
+
+
+class CueTimeline:
+    """
+    字幕时间轴索引，按开始时间排序后用二分查找定位当前字幕
+    """
+    def __init__(self, subtitles):
+        """
+        :param subtitles: pysrt字幕列表
+        """
+        cues = sorted(
+            (sub.start.ordinal / 1000.0, sub.end.ordinal / 1000.0, sub.text)
+            for sub in subtitles
+        )
+        self.starts = [cue[0] for cue in cues]
+        self.ends = [cue[1] for cue in cues]
+        self.texts = [cue[2] for cue in cues]
+        # 前缀最大结束时间：max_ends[i]之前（含）的字幕都在这个时间之前结束
+        self.max_ends = []
+        for end in self.ends:
+            self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text_at(self, current_time):
+        """
+        查找指定时间应该显示的字幕
+        :param current_time: 时间（秒）
+        :return: 字幕文本，没有字幕时返回None
+        """
+        i = bisect.bisect_right(self.starts, current_time) - 1
+        # 重叠字幕时向前回溯，找到仍然覆盖当前时间的一条
+        while i >= 0:
+            if self.starts[i] <= current_time <= self.ends[i]:
+                return self.texts[i]
+            if self.max_ends[i] < current_time:
+                break
+            i -= 1
+        return None
+
+    def intervals(self):
+        """
+        :return: [(开始秒, 结束秒, 文本), ...]
+        """
+        return list(zip(self.starts, self.ends, self.texts))
+
+
+class StageStats:
+    """
+    单个流水线阶段的吞吐统计
+    """
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.frames = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, frames=1):
+        with self._lock:
+            self.busy += seconds
+            self.frames += frames
+
+    def fps(self):
+        """
+        :return: 阶段吞吐（帧/秒），工作线程池按并行数折算
+        """
+        if self.busy <= 0:
+            return 0.0
+        return self.frames * self.workers / self.busy
+
+
+class _Abort(Exception):
+    pass
+
+
+class PipelinedFrameRenderer:
+    """
+    解码 → 合成 → 编码 三段式流水线渲染器
+    解码线程把帧读入预分配的缓冲区，合成线程池在缓冲区上原地叠加字幕，
+    编码线程按帧序号重新排序后写出，写完的缓冲区归还给缓冲池复用。
+    各阶段之间用有界队列连接，内存占用与视频长度无关。
+    """
+    def __init__(self, cap, write_frame, composite_frame, num_workers=None, queue_size=None, frame_shape=None, max_frames=None, progress_every=30):
+        """
+        :param cap: 已打开的cv2.VideoCapture
+        :param write_frame: 编码回调 write_frame(frame)
+        :param composite_frame: 合成回调 composite_frame(frame, index)，原地修改并返回帧
+        :param num_workers: 合成线程数，默认CPU核数-2（至少1）
+        :param queue_size: 每个队列的容量，默认合成线程数的2倍
+        :param frame_shape: 帧形状(height, width, 3)，用于预分配缓冲区
+        :param max_frames: 最多处理的帧数（None表示读到视频结尾）
+        :param progress_every: 每隔多少帧打印一次进度
+        """
+        if num_workers is None:
+            num_workers = max(1, (os.cpu_count() or 1) - 2)
+        self.cap = cap
+        self.write_frame = write_frame
+        self.composite_frame = composite_frame
+        self.num_workers = num_workers
+        self.queue_size = queue_size or num_workers * 2
+        self.frame_shape = frame_shape
+        self.max_frames = max_frames
+        self.progress_every = progress_every
+
+        self._abort = threading.Event()
+        self._errors = []
+        self.stats = {
+            "decode": StageStats("解码"),
+            "composite": StageStats("合成", num_workers),
+            "encode": StageStats("编码"),
+        }
+
+    def _put(self, q, item):
+        while True:
+            if self._abort.is_set():
+                raise _Abort()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        while True:
+            if self._abort.is_set():
+                raise _Abort()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _guard(self, target, *args):
+        try:
+            target(*args)
+        except _Abort:
+            pass
+        except BaseException as e:
+            self._errors.append(e)
+            self._abort.set()
+
+    def _decode_loop(self, free_buffers, decoded):
+        index = 0
+        while self.max_frames is None or index < self.max_frames:
+            buffer = self._get(free_buffers)
+            t0 = time.perf_counter()
+            if buffer is None:
+                ret, frame = self.cap.read()
+            else:
+                ret, frame = self.cap.read(buffer)
+            self.stats["decode"].add(time.perf_counter() - t0)
+            if not ret:
+                break
+            self._put(decoded, (index, frame))
+            index += 1
+        for _ in range(self.num_workers):
+            self._put(decoded, None)
+
+    def _composite_loop(self, decoded, composited):
+        while True:
+            item = self._get(decoded)
+            if item is None:
+                self._put(composited, None)
+                return
+            index, frame = item
+            t0 = time.perf_counter()
+            frame = self.composite_frame(frame, index)
+            self.stats["composite"].add(time.perf_counter() - t0)
+            self._put(composited, (index, frame))
+
+    def _encode_loop(self, composited, free_buffers, total_frames):
+        pending = {}
+        next_index = 0
+        finished_workers = 0
+        while finished_workers < self.num_workers:
+            item = self._get(composited)
+            if item is None:
+                finished_workers += 1
+                continue
+            index, frame = item
+            pending[index] = frame
+            # 按帧序号顺序写出，乱序到达的帧暂存等待
+            while next_index in pending:
+                frame = pending.pop(next_index)
+                t0 = time.perf_counter()
+                self.write_frame(frame)
+                self.stats["encode"].add(time.perf_counter() - t0)
+                free_buffers.put(frame)
+                next_index += 1
+                if self.progress_every and next_index % self.progress_every == 0 and total_frames:
+                    progress = (next_index / total_frames) * 100
+                    print(f"处理进度: {progress:.1f}%")
+        if pending:
+            raise RuntimeError(f"流水线结束时仍有 {len(pending)} 帧未写出")
+
+    def run(self, total_frames=None):
+        """
+        运行流水线直到视频读完
+        :param total_frames: 总帧数，仅用于显示进度
+        :return: 实际处理的帧数
+        """
+        import numpy as np
+
+        # 缓冲池大小覆盖所有队列和正在处理的帧，解码线程在缓冲区耗尽时自然阻塞
+        pool_size = self.queue_size * 2 + self.num_workers + 2
+        free_buffers = queue.Queue()
+        for _ in range(pool_size):
+            free_buffers.put(np.empty(self.frame_shape, dtype=np.uint8) if self.frame_shape else None)
+        decoded = queue.Queue(maxsize=self.queue_size)
+        composited = queue.Queue(maxsize=self.queue_size)
+
+        threads = [threading.Thread(target=self._guard, args=(self._decode_loop, free_buffers, decoded), daemon=True)]
+        for _ in range(self.num_workers):
+            threads.append(threading.Thread(target=self._guard, args=(self._composite_loop, decoded, composited), daemon=True))
+        threads.append(threading.Thread(target=self._guard, args=(self._encode_loop, composited, free_buffers, total_frames), daemon=True))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - start
+
+        if self._errors:
+            raise self._errors[0]
+        self.report()
+        return self.stats["encode"].frames
+
+    def report(self):
+        """
+        打印各阶段的帧率
+        """
+        frames = self.stats["encode"].frames
+        overall = frames / self.elapsed if self.elapsed > 0 else 0.0
+        parts = [f"{stage.name}: {stage.fps():.1f} fps" for stage in self.stats.values()]
+        print(f"流水线渲染完成: {frames} 帧, 整体 {overall:.1f} fps ({', '.join(parts)}, 合成线程 {self.num_workers})")
+
+
+class SubtitleImageCache:
+    """
+    按字节数限制大小的LRU字幕图像缓存，线程安全
+    存放裁剪到文字区域的紧凑数组，而不是整帧宽度的PIL图像
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        :param max_bytes: 缓存占用上限（字节）
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """
+        取出缓存项，不存在时调用factory生成并放入缓存
+        :param key: 缓存键
+        :param factory: 生成函数，返回带 nbytes 属性的缓存项
+        :return: 缓存项
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item
+            self.misses += 1
+        # 在锁外渲染，避免阻塞其他合成线程
+        item = factory()
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = item
+                self.bytes += item.nbytes
+                # 至少保留刚放入的一项
+                while self.bytes > self.max_bytes and len(self._items) > 1:
+                    _, evicted = self._items.popitem(last=False)
+                    self.bytes -= evicted.nbytes
+                    self.evictions += 1
+        return item
+
+    def stats(self):
+        """
+        :return: 命中/未命中/淘汰次数和当前占用
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._items),
+                "bytes": self.bytes,
+            }
+
+    def report(self):
+        stats = self.stats()
+        total = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / total * 100 if total else 0.0
+        print(f"字幕缓存: 命中 {stats['hits']}, 未命中 {stats['misses']} (命中率 {hit_rate:.1f}%), "
+              f"淘汰 {stats['evictions']}, 占用 {stats['bytes'] / 1024 / 1024:.1f}/{self.max_bytes / 1024 / 1024:.0f} MB")
+
+
+class CompactSubtitle:
+    """
+    裁剪到不透明区域的字幕图像（BGRA数组）及其在原字幕图像中的位置
+    """
+    __slots__ = ("array", "left", "top", "width", "height")
+
+    def __init__(self, subtitle_image):
+        """
+        :param subtitle_image: RGBA格式的PIL字幕图像
+        """
+        import numpy as np
+        self.width, self.height = subtitle_image.size
+        bbox = subtitle_image.getchannel("A").getbbox()
+        if bbox is None:
+            self.left, self.top = 0, 0
+            self.array = np.zeros((0, 0, 4), dtype=np.uint8)
+            return
+        self.left, self.top = bbox[0], bbox[1]
+        rgba = np.asarray(subtitle_image.crop(bbox))
+        # 预先转换为BGR顺序，叠加时不再逐帧转换
+        self.array = np.ascontiguousarray(rgba[:, :, [2, 1, 0, 3]])
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+
+# 整段渲染的默认编码参数，与libass、overlay后端一致（FFmpeg输出mp4时的默认编码）
+DEFAULT_ENCODER_ARGS = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+
+
+class FFmpegFrameWriter:
+    """
+    通过管道把BGR帧送给FFmpeg编码，接口与cv2.VideoWriter一致，
+    可以指定与源视频一致的编码参数，使输出片段能与原视频片段无损拼接
+    """
+    def __init__(self, output_path, fps, size, encoder_args):
+        """
+        :param output_path: 输出文件路径
+        :param fps: 帧率
+        :param size: (width, height)
+        :param encoder_args: 编码参数列表，如 ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+        """
+        import subprocess
+        import tempfile
+        width, height = size
+        cmd = [
+            'ffmpeg',
+            '-v', 'error',
+            '-nostats',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-s', f'{width}x{height}',
+            '-r', f'{fps}',
+            '-i', 'pipe:0',
+            *encoder_args,
+            '-an',
+            '-y',
+            output_path
+        ]
+        # 编码期间不读取stderr，写到临时文件而不是管道，避免输出填满管道后写帧阻塞
+        self.stderr = tempfile.TemporaryFile()
+        try:
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.stderr)
+        except FileNotFoundError:
+            self.process = None
+            self.stderr.close()
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, frame):
+        self.process.stdin.write(frame.tobytes())
+
+    def release(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        self.process = None
+        self.stderr.seek(0)
+        stderr = self.stderr.read()
+        self.stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"FFmpeg编码失败: {stderr.decode('utf-8', errors='ignore')}")
@@ -0,0 +1,131 @@
+import os
+import time
+import shutil
+import pysrt
+from concurrent.futures import ProcessPoolExecutor
+from combine import probe_keyframes, concat_segments
+
+
+def plan_shards(keyframe_indices, keyframe_times, total_frames, shards):
+    """
+    在关键帧处把视频切成若干段，每段帧数尽量接近
+    :param keyframe_indices: 关键帧帧序号列表
+    :param keyframe_times: 关键帧时间列表（秒）
+    :param total_frames: 总帧数
+    :param shards: 期望的分段数
+    :return: [(起始帧, 起始时间, 帧数), ...]，各段首尾相接、不重叠
+    """
+    if not keyframe_indices or keyframe_indices[0] != 0:
+        keyframe_indices = [0] + list(keyframe_indices)
+        keyframe_times = [0.0] + list(keyframe_times)
+    boundaries = [0]
+    for i in range(1, shards):
+        target = total_frames * i / shards
+        # 选择最接近等分点且在上一个边界之后的关键帧
+        best = min(
+            (k for k in range(len(keyframe_indices)) if keyframe_indices[k] > boundaries[-1]),
+            key=lambda k: abs(keyframe_indices[k] - target),
+            default=None
+        )
+        if best is None:
+            break
+        if keyframe_indices[best] not in boundaries:
+            boundaries.append(keyframe_indices[best])
+    boundaries = sorted(set(boundaries))
+    time_of = dict(zip(keyframe_indices, keyframe_times))
+    plan = []
+    for i, start_frame in enumerate(boundaries):
+        end_frame = boundaries[i + 1] if i + 1 < len(boundaries) else total_frames
+        if end_frame > start_frame:
+            plan.append((start_frame, time_of[start_frame], end_frame - start_frame))
+    return plan
+
+
+def write_shifted_subtitles(subtitle_path, output_path, offset, duration):
+    """
+    截取与时间段重叠的字幕，并把时间平移到从0开始
+    :param subtitle_path: 原字幕文件
+    :param output_path: 输出字幕文件
+    :param offset: 时间段起点（秒）
+    :param duration: 时间段长度（秒）
+    :return: 输出字幕文件路径
+    """
+    subs = pysrt.open(subtitle_path, encoding='utf-8')
+    start_ms = int(round(offset * 1000))
+    end_ms = int(round((offset + duration) * 1000)) if duration != float('inf') else float('inf')
+    shifted = pysrt.SubRipFile()
+    for sub in subs:
+        if sub.end.ordinal < start_ms or sub.start.ordinal > end_ms:
+            continue
+        shifted.append(pysrt.SubRipItem(
+            index=len(shifted) + 1,
+            start=pysrt.SubRipTime.from_ordinal(max(0, sub.start.ordinal - start_ms)),
+            end=pysrt.SubRipTime.from_ordinal(max(0, sub.end.ordinal - start_ms)),
+            text=sub.text
+        ))
+    shifted.save(output_path, encoding='utf-8')
+    return output_path
+
+
+def _run_shard(burn_range, video_path, subtitle_path, output_path, start_frame, start_time, n_frames, fps):
+    """
+    子进程入口：平移字幕后渲染一个分段
+    """
+    shard_subtitle_path = os.path.splitext(output_path)[0] + ".srt"
+    # 多保留1秒的字幕，跨越分段边界的字幕在两段中都能完整显示
+    duration = n_frames / fps + 1.0 if fps else float('inf')
+    write_shifted_subtitles(subtitle_path, shard_subtitle_path, start_time, duration)
+    started = time.perf_counter()
+    burn_range(video_path, shard_subtitle_path, output_path, start_frame, start_time, n_frames)
+    return output_path, n_frames, time.perf_counter() - started
+
+
+def render_sharded(video_path, subtitle_path, output_path, burn_range, shards=None, fps=None, work_dir=None):
+    """
+    按关键帧把视频切成多段，在多个进程中并行烧录字幕，最后无损拼接
+    :param video_path: 输入视频路径
+    :param subtitle_path: 字幕文件路径
+    :param output_path: 输出视频路径（无音频）
+    :param burn_range: 可序列化的分段渲染函数
+                       burn_range(video_path, subtitle_path, output_path, start_frame, start_time, n_frames)
+                       其中subtitle_path已平移到分段起点，输出片段必须使用相同的编码参数
+    :param shards: 分段数，默认等于CPU核数
+    :param fps: 视频帧率
+    :param work_dir: 分段临时目录，默认在输出文件旁边
+    :return: 输出视频路径
+    """
+    shards = shards or os.cpu_count() or 1
+    keyframe_indices, keyframe_times, total_frames = probe_keyframes(video_path)
+    if total_frames <= 0:
+        raise ValueError(f"无法读取视频帧信息: {video_path}")
+    plan = plan_shards(keyframe_indices, keyframe_times, total_frames, shards)
+    print(f"分段渲染: {len(plan)} 段, 共 {total_frames} 帧")
+
+    if work_dir is None:
+        work_dir = os.path.splitext(output_path)[0] + "_shards"
+    os.makedirs(work_dir, exist_ok=True)
+    ext = os.path.splitext(output_path)[1] or ".mp4"
+
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=len(plan)) as executor:
+            futures = [
+                executor.submit(
+                    _run_shard, burn_range, video_path, subtitle_path,
+                    os.path.join(work_dir, f"shard_{i:04d}{ext}"),
+                    start_frame, start_time, n_frames, fps
+                )
+                for i, (start_frame, start_time, n_frames) in enumerate(plan)
+            ]
+            segment_paths = []
+            for i, future in enumerate(futures):
+                path, n_frames, elapsed = future.result()
+                print(f"分段 {i + 1}/{len(plan)} 完成: {n_frames} 帧, {n_frames / elapsed if elapsed > 0 else 0:.1f} fps")
+                segment_paths.append(path)
+        concat_segments(segment_paths, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"分段渲染完成: {total_frames} 帧, 用时 {elapsed:.1f} 秒, 整体 {total_frames / elapsed if elapsed > 0 else 0:.1f} fps")
+    return output_path
@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from functools import lru_cache
+from combine import probe_video
+from render_shards import render_sharded
+from smart_render import render_smart, render_patch
+from overlay_render import render_overlay_track
+from render_pipeline import DEFAULT_ENCODER_ARGS
+
+# 每台机器的渲染后端测速结果缓存
+RENDERER_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".youtube_mover", "renderer_probe.json")
+
+_RENDERERS = {}
+
+
+def register_renderer(cls):
+    """
+    注册字幕渲染后端（类装饰器）
+    """
+    _RENDERERS[cls.name] = cls
+    return cls
+
+
+def get_renderer(name, **kwargs):
+    """
+    :param name: 后端名称
+    :return: 后端实例
+    """
+    if name not in _RENDERERS:
+        raise ValueError(f"未知的渲染后端: {name}，可选: {', '.join(_RENDERERS)}")
+    return _RENDERERS[name](**kwargs)
+
+
+def available_renderers(layout=None):
+    """
+    :param layout: 只返回该排版的后端，None表示全部
+    :return: 当前机器上可用的后端名称列表（按注册顺序）
+    """
+    return [name for name, cls in _RENDERERS.items() if (layout is None or cls.layout == layout) and cls().available()]
+
+
+@lru_cache(maxsize=None)
+def _ffmpeg_filters():
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-filters'], capture_output=True)
+    except FileNotFoundError:
+        return None
+    return result.stdout.decode('utf-8', errors='ignore')
+
+
+def _range_args(start_time, n_frames, encoder_args):
+    # 往前留0.5毫秒的余量，避免浮点误差跳过分段的第一帧；-frames:v 保证帧数精确
+    seek = max(0.0, start_time - 0.0005)
+    input_args = ['-ss', f"{seek:.6f}"]
+    output_args = ['-frames:v', str(n_frames), '-fps_mode', 'passthrough', '-an', *(encoder_args or [])]
+    return input_args, output_args
+
+
+def burn_subtitles_ffmpeg(video_path, subtitle_path, output_path, input_args=(), output_args=()):
+    """
+    使用FFmpeg subtitles滤镜烧录字幕，样式配置失败时回退到默认样式
+    :param video_path: 输入视频路径（绝对路径）
+    :param subtitle_path: 字幕文件路径（绝对路径，UTF-8编码）
+    :param output_path: 输出视频路径
+    :param input_args: 放在 -i 之前的额外参数（如 -ss）
+    :param output_args: 放在输出文件之前的额外参数（如 -frames:v）
+    """
+    # 处理Windows路径中的特殊字符，使用POSIX路径避免转义问题
+    escaped_subtitle_path = subtitle_path.replace('\\', '/').replace(':', '\\:')
+
+    # 构造FFmpeg命令，强制指定UTF-8编码
+    ffmpeg_cmd = [
+        'ffmpeg',
+        *input_args,
+        '-i', video_path,
+        '-vf', f"subtitles='{escaped_subtitle_path}':charenc=utf-8:force_style='PrimaryColour=&H00FFFFFF,Outline=1,Shadow=0,BackColour=&H80000000,FontName=STXINGKA.TTF,FontSize=14'",
+        *output_args,
+        '-y',  # 覆盖输出文件
+        '-strict', '-2',  # 兼容编码
+        output_path
+    ]
+    
+    try:
+        # 执行FFmpeg命令
+        result = subprocess.run(ffmpeg_cmd, capture_output=True)
+        
+        if result.returncode != 0:
+            error_msg = result.stderr.decode('utf-8', errors='ignore')
+            print(f"FFmpeg执行失败: {error_msg}")
+            # 尝试备用方案，使用更简单的样式配置
+            ffmpeg_cmd = [
+                'ffmpeg',
+                *input_args,
+                '-i', video_path,
+                '-vf', f"subtitles='{escaped_subtitle_path}':charenc=utf-8",
+                *output_args,
+                '-y',
+                '-strict', '-2',
+                output_path
+            ]
+            result = subprocess.run(ffmpeg_cmd, capture_output=True)
+            
+            if result.returncode != 0:
+                error_msg = result.stderr.decode('utf-8', errors='ignore')
+                raise RuntimeError(f"FFmpeg执行失败: {error_msg}")
+    except FileNotFoundError:
+        raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
+    except Exception as e:
+        raise RuntimeError(f"烧录字幕时发生错误: {str(e)}")
+    return output_path
+
+
+class SubtitleRenderer:
+    """
+    字幕烧录后端接口
+    render 渲染整段视频，render_range 渲染一段帧范围（供分段并行和智能渲染在子进程中调用），
+    输出都只包含视频流，音频由调用方另外合并；整段渲染统一使用DEFAULT_ENCODER_ARGS编码
+    layout 相同的后端画面一致，可以互相替换
+    """
+    name = None
+    layout = None
+
+    def __init__(self, num_workers=None, cache_budget_mb=64):
+        """
+        :param num_workers: 后端内部的并行线程数（仅部分后端使用）
+        :param cache_budget_mb: 字幕图像缓存的内存上限（MB，仅部分后端使用）
+        """
+        self.num_workers = num_workers
+        self.cache_budget_mb = cache_budget_mb
+
+    def available(self):
+        """
+        :return: 当前机器是否支持该后端
+        """
+        return True
+
+    def render(self, video_path, subtitle_path, output_path):
+        """
+        :return: 渲染的帧数（未知时返回None）
+        """
+        raise NotImplementedError
+
+    def render_range(self, video_path, subtitle_path, output_path, start_frame, start_time, n_frames, encoder_args=None):
+        """
+        :param subtitle_path: 已平移到分段起点的字幕文件
+        :param encoder_args: FFmpeg编码参数（None表示使用后端默认编码）
+        """
+        raise NotImplementedError
+
+
+@register_renderer
+class OverlayRenderer(SubtitleRenderer):
+    """
+    每条字幕预渲染成图像，由FFmpeg overlay一次性叠加，保留自定义双语排版
+    """
+    name = "overlay"
+    layout = "bilingual"
+
+    def available(self):
+        filters = _ffmpeg_filters()
+        return bool(filters) and " overlay " in filters
+
+    def render(self, video_path, subtitle_path, output_path):
+        from video_processor_base import VideoProcessor
+        info = probe_video(video_path)
+        render_overlay_track(VideoProcessor(model_size=None), video_path, subtitle_path, output_path, info['width'], info['duration'], output_args=['-an', *DEFAULT_ENCODER_ARGS])
+        return None
+
+    def render_range(self, video_path, subtitle_path, output_path, start_frame, start_time, n_frames, encoder_args=None):
+        from video_processor_base import VideoProcessor
+        info = probe_video(video_path)
+        input_args, output_args = _range_args(start_time, n_frames, encoder_args)
+        render_overlay_track(
+            VideoProcessor(model_size=None), video_path, subtitle_path, output_path,
+            info['width'], n_frames / info['fps'] + 1.0,
+            input_args=input_args, output_args=output_args
+        )
+
+
+@register_renderer
+class LibassRenderer(SubtitleRenderer):
+    """
+    FFmpeg subtitles滤镜（libass）渲染，使用force_style样式
+    """
+    name = "libass"
+    layout = "force_style"
+
+    def available(self):
+        filters = _ffmpeg_filters()
+        return bool(filters) and " subtitles " in filters
+
+    def render(self, video_path, subtitle_path, output_path):
+        burn_subtitles_ffmpeg(os.path.abspath(video_path), os.path.abspath(subtitle_path), output_path, output_args=['-an', *DEFAULT_ENCODER_ARGS])
+        return None
+
+    def render_range(self, video_path, subtitle_path, output_path, start_frame, start_time, n_frames, encoder_args=None):
+        input_args, output_args = _range_args(start_time, n_frames, encoder_args)
+        burn_subtitles_ffmpeg(os.path.abspath(video_path), os.path.abspath(subtitle_path), output_path, input_args=input_args, output_args=output_args)
+
+
+@register_renderer
+class FrameRenderer(SubtitleRenderer):
+    """
+    OpenCV逐帧叠加，解码/合成/编码多线程流水线，由FFmpeg编码
+    """
+    name = "cv2"
+    layout = "bilingual"
+
+    def available(self):
+        try:
+            import cv2
+            return True
+        except ImportError:
+            return False
+
+    def render(self, video_path, subtitle_path, output_path):
+        from video_processor_base import VideoProcessor
+        return VideoProcessor(model_size=None)._render_frames(video_path, subtitle_path, output_path, num_workers=self.num_workers, cache_budget_mb=self.cache_budget_mb)
+
+    def render_range(self, video_path, subtitle_path, output_path, start_frame, start_time, n_frames, encoder_args=None):
+        from video_processor_base import VideoProcessor
+        VideoProcessor(model_size=None)._render_frames(video_path, subtitle_path, output_path, start_frame=start_frame, max_frames=n_frames, num_workers=self.num_workers, encoder_args=encoder_args, cache_budget_mb=self.cache_budget_mb)
+
+
+def _srt_time(seconds):
+    millis = int(round(seconds * 1000))
+    return f"{millis // 3600000:02d}:{millis // 60000 % 60:02d}:{millis // 1000 % 60:02d},{millis % 1000:03d}"
+
+
+def calibrate_renderers(names, seconds=20, size=(1280, 720), fps=30):
+    """
+    在本机上用一段合成视频试渲染，测量各后端的速度
+    :param names: 需要测试的后端名称
+    :param seconds: 测试视频时长（太短时测到的主要是进程启动时间）
+    :param size: 测试视频分辨率
+    :param fps: 测试视频帧率
+    :return: {后端名称: 帧/秒}
+    """
+    work_dir = tempfile.mkdtemp(prefix="renderer_probe_")
+    try:
+        clip_path = os.path.join(work_dir, "probe.mp4")
+        subprocess.run([
+            'ffmpeg',
+            '-f', 'lavfi',
+            '-i', f"testsrc2=size={size[0]}x{size[1]}:rate={fps}:duration={seconds}",
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            '-y', clip_path
+        ], check=True, capture_output=True)
+        subtitle_path = os.path.join(work_dir, "probe.srt")
+        middle = seconds / 2
+        with open(subtitle_path, 'w', encoding='utf-8') as f:
+            f.write(f"1\n{_srt_time(0)} --> {_srt_time(middle)}\nRenderer calibration line\n渲染测速字幕\n\n")
+            f.write(f"2\n{_srt_time(middle)} --> {_srt_time(seconds)}\nSecond calibration line\n第二行测速字幕\n")
+
+        results = {}
+        for name in names:
+            output_path = os.path.join(work_dir, f"{name}.mp4")
+            started = time.perf_counter()
+            try:
+                get_renderer(name).render(clip_path, subtitle_path, output_path)
+            except Exception as e:
+                print(f"渲染后端 {name} 测速失败: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            results[name] = seconds * fps / elapsed if elapsed > 0 else 0.0
+            print(f"渲染后端 {name} 测速: {results[name]:.1f} fps")
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def select_renderer(layout="bilingual", cache_path=RENDERER_CACHE_PATH, refresh=False):
+    """
+    在排版相同的可用后端中选择本机最快的一个，测速结果按机器和排版缓存，只在首次或refresh时测速
+    :param layout: 后端排版，只在画面一致的后端之间比较
+    :param cache_path: 缓存文件路径
+    :param refresh: 是否忽略缓存重新测速
+    :return: (后端名称, 测速结果字典)
+    """
+    names = available_renderers(layout)
+    if not names:
+        raise RuntimeError(f"没有可用的字幕渲染后端（排版: {layout}），请安装FFmpeg或OpenCV")
+    if len(names) == 1:
+        return names[0], {}
+    machine = platform.node() or "default"
+
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+    entry = (cache.get(machine) or {}).get(layout)
+    if entry and not refresh and entry.get('backend') in names:
+        return entry['backend'], entry.get('fps', {})
+
+    print("正在测试本机的字幕渲染后端...")
+    try:
+        results = calibrate_renderers(names)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"渲染后端测速失败，使用默认后端: {e}")
+        results = {}
+    backend = max(results, key=results.get) if results else names[0]
+
+    machine_cache = cache.get(machine)
+    if not isinstance(machine_cache, dict) or 'backend' in machine_cache:
+        # 旧格式的缓存（不区分排版）直接丢弃
+        machine_cache = cache[machine] = {}
+    machine_cache[layout] = {
+        'backend': backend,
+        'fps': results,
+        'measured_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, cache_path)
+    return backend, results
+
+
+def render_subtitles(video_path, subtitle_path, output_path, renderer="auto", shards=None, smart_render=False, num_workers=None, cache_budget_mb=64, previous=None):
+    """
+    用选定的后端把字幕烧录到视频中（输出不含音频）
+    :param video_path: 输入视频路径
+    :param subtitle_path: 字幕文件路径
+    :param output_path: 输出视频路径
+    :param renderer: 后端名称，"auto"表示在双语排版的后端（cv2、overlay）中按本机测速结果选择
+    :param shards: 分段并行渲染的进程数（None或1表示不分段）
+    :param smart_render: 是否只重新编码包含字幕的片段
+    :param num_workers: 逐帧渲染的合成线程数
+    :param cache_budget_mb: 逐帧渲染时每个渲染进程的字幕缓存上限（MB）
+    :param previous: 上一次的渲染结果 (视频路径, 渲染时的字幕)，提供时只重新烧录修改过的字幕所在的GOP
+    :return: 实际使用的后端名称
+    """
+    if renderer == "auto":
+        renderer, measured = select_renderer()
+        summary = ", ".join(f"{name} {fps:.1f} fps" for name, fps in measured.items())
+        print(f"自动选择渲染后端: {renderer}" + (f"（本机测速: {summary}）" if summary else ""))
+    backend = get_renderer(renderer, num_workers=num_workers, cache_budget_mb=cache_budget_mb)
+
+    started = time.perf_counter()
+    frames = None
+    rendered = None
+    if previous:
+        info = probe_video(video_path)
+        rendered = render_patch(video_path, subtitle_path, output_path, previous[0], previous[1], backend.render_range, fps=info['fps'], max_workers=shards)
+    if rendered is None and (smart_render or (shards and shards > 1)):
+        info = probe_video(video_path)
+        if renderer == "cv2":
+            # 每个进程分到的合成线程数按分段数平摊
+            backend = get_renderer(renderer, num_workers=max(1, (os.cpu_count() or 1) // (shards or os.cpu_count() or 1)), cache_budget_mb=cache_budget_mb)
+        if smart_render:
+            # 只重新编码有字幕的GOP，其余GOP直接复制
+            rendered = render_smart(video_path, subtitle_path, output_path, backend.render_range, fps=info['fps'], max_workers=shards)
+        if rendered is None and shards and shards > 1:
+            # 按关键帧切分，多进程并行渲染后无损拼接
+            rendered = render_sharded(video_path, subtitle_path, output_path, backend.render_range, shards=shards, fps=info['fps'])
+    if rendered is None:
+        frames = backend.render(video_path, subtitle_path, output_path)
+    elapsed = time.perf_counter() - started
+
+    if frames is None:
+        try:
+            info = probe_video(output_path)
+            frames = info['duration'] * info['fps']
+        except Exception:
+            frames = 0
+    fps = frames / elapsed if elapsed > 0 else 0.0
+    print(f"渲染后端: {renderer}, 用时 {elapsed:.1f} 秒, {fps:.1f} fps")
+    return renderer
@@ -0,0 +1,264 @@
+import os
+import re
+import json
+import struct
+import argparse
+from audio_codec import SPEECH_SAMPLE_RATE, decode_clips, load_audio_files, write_wav
+from audio_mix import trim_and_normalize
+
+# 文件头：魔数 + 索引长度（小端uint64），随后是JSON索引，PCM数据按64字节对齐
+_MAGIC = b"YMSEG001"
+_HEADER = struct.Struct("<8sQ")
+_ALIGN = 64
+SEGMENT_STORE_EXT = ".seg"
+
+
+def segment_store_path(subtitle_path):
+    """
+    :param subtitle_path: 字幕文件路径
+    :return: 与字幕对应的片段仓库路径（字幕同目录下的<字幕名>_speech.seg）
+    """
+    return os.path.splitext(subtitle_path)[0] + "_speech" + SEGMENT_STORE_EXT
+
+
+def is_segment_store(path):
+    """
+    :param path: 文件或目录路径
+    :return: 是否为语音片段仓库文件
+    """
+    if not path or not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+def write_segment_store(path, cue_ids, arrays, sample_rate=SPEECH_SAMPLE_RATE, texts=None, voice=None):
+    """
+    把一个任务的全部语音片段写入一个文件：JSON索引（字幕序号、偏移、采样数、时长）+ 连续的float32 PCM
+    先写临时文件再替换，中途失败不会留下不完整的仓库
+    :param path: 输出文件路径
+    :param cue_ids: 每段对应的字幕序号
+    :param arrays: float32单声道语音数组列表（None或空数组表示缺失，不写入）
+    :param sample_rate: 采样率
+    :param texts: 每段的文本，记录在索引中，用于判断字幕修改后片段是否还能复用
+    :param voice: 合成时的 引擎:音色，换了引擎或音色的片段不能复用
+    :return: 写入的片段数
+    """
+    import numpy as np
+    texts = texts if texts is not None else [None] * len(cue_ids)
+    segments = []
+    offset = 0
+    for cue_id, speech, text in zip(cue_ids, arrays, texts):
+        if speech is None or not len(speech):
+            continue
+        entry = {"cue": int(cue_id), "offset": offset, "samples": len(speech), "duration": round(len(speech) / sample_rate, 6)}
+        if text is not None:
+            entry["text"] = text
+        segments.append(entry)
+        offset += len(speech)
+    index = {"sample_rate": sample_rate, "dtype": "float32", "segments": segments}
+    if voice:
+        index["voice"] = voice
+    index = json.dumps(index, ensure_ascii=False).encode('utf-8')
+    data_offset = -(-(_HEADER.size + len(index)) // _ALIGN) * _ALIGN
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(index)))
+            f.write(index)
+            f.write(bytes(data_offset - _HEADER.size - len(index)))
+            for speech in arrays:
+                if speech is not None and len(speech):
+                    f.write(np.ascontiguousarray(speech, dtype=np.float32).tobytes())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return len(segments)
+
+
+class SegmentStore:
+    """
+    只读的语音片段仓库：打开时只读索引，PCM数据通过内存映射按需读取
+    取出的片段是映射数据的视图，混音时不需要逐个打开小文件，也不需要解码
+    """
+    def __init__(self, path):
+        """
+        :param path: write_segment_store写出的文件
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, index_length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"不是语音片段仓库文件: {path}")
+            index = json.loads(f.read(index_length).decode('utf-8'))
+        self.sample_rate = index["sample_rate"]
+        self.voice = index.get("voice")
+        self.data_offset = -(-(_HEADER.size + index_length) // _ALIGN) * _ALIGN
+        self.segments = {entry["cue"]: entry for entry in index["segments"]}
+        self._data = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __contains__(self, cue_id):
+        return cue_id in self.segments
+
+    @property
+    def cue_ids(self):
+        return sorted(self.segments)
+
+    def _map(self):
+        if self._data is None:
+            import numpy as np
+            total = sum(entry["samples"] for entry in self.segments.values())
+            self._data = np.memmap(self.path, dtype=np.float32, mode='r', offset=self.data_offset, shape=(total,)) if total else np.zeros(0, dtype=np.float32)
+        return self._data
+
+    def duration(self, cue_id):
+        """
+        :return: 片段时长（秒），只读索引；不存在时返回None
+        """
+        entry = self.segments.get(cue_id)
+        return entry["duration"] if entry else None
+
+    def text(self, cue_id):
+        """
+        :return: 合成该片段时的文本，不存在或未记录时返回None
+        """
+        entry = self.segments.get(cue_id)
+        return entry.get("text") if entry else None
+
+    def get(self, cue_id, sample_rate=None):
+        """
+        :param cue_id: 字幕序号
+        :param sample_rate: 需要的采样率，与仓库不同时线性插值（会复制数据）
+        :return: float32单声道数组（内存映射视图），不存在时返回None
+        """
+        entry = self.segments.get(cue_id)
+        if entry is None:
+            return None
+        speech = self._map()[entry["offset"]:entry["offset"] + entry["samples"]]
+        if sample_rate and sample_rate != self.sample_rate and len(speech) > 1:
+            import numpy as np
+            positions = np.arange(int(len(speech) * sample_rate / self.sample_rate)) * (self.sample_rate / sample_rate)
+            speech = np.interp(positions, np.arange(len(speech)), speech).astype(np.float32)
+        return speech
+
+    def arrays(self, cue_ids, sample_rate=None):
+        """
+        :return: 与cue_ids顺序一致的语音数组列表，缺失的为None
+        """
+        return [self.get(cue_id, sample_rate) for cue_id in cue_ids]
+
+    def export(self, cue_id, path):
+        """
+        把一个片段写成16位WAV（供需要文件路径的FFmpeg滤镜使用）
+        :return: 文件路径，片段不存在时返回None
+        """
+        speech = self.get(cue_id)
+        if speech is None:
+            return None
+        return write_wav(path, speech, self.sample_rate)
+
+
+def _segment_file(directory, cue_id):
+    """
+    :return: 目录中该字幕的片段文件（segment_XXXX.wav或.mp3），都不存在时返回None
+    """
+    # 当前的合成写WAV，优先于旧版本留下的MP3
+    for ext in ("wav", "mp3"):
+        path = os.path.join(directory, f"segment_{cue_id:04d}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_segments(source, cue_ids, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    读取已有的语音片段：source可以是片段仓库文件，也可以是segment_XXXX.mp3/wav所在的目录
+    :param source: 片段仓库文件或目录
+    :param cue_ids: 字幕序号列表
+    :param sample_rate: 输出采样率
+    :return: 与cue_ids顺序一致的float32数组列表，缺失的为None
+    """
+    if is_segment_store(source):
+        return SegmentStore(source).arrays(cue_ids, sample_rate)
+    # 目录中的片段是合成引擎的原始输出，与新合成的片段一样裁剪静音、拉齐响度
+    return trim_and_normalize(decode_clips(load_audio_files([_segment_file(source, i) for i in cue_ids]), sample_rate), sample_rate)
+
+
+def reuse_segments(path, cue_ids, texts, voice=None, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    字幕修改后复用片段仓库中文本没有变化的片段：优先使用同一序号的片段，序号变化（插入或删除了字幕）时按文本查找
+    :param path: 上一次的片段仓库文件
+    :param cue_ids: 当前的字幕序号列表
+    :param texts: 与cue_ids对应的文本
+    :param voice: 当前的 引擎:音色，与仓库记录的不同时不复用
+    :param sample_rate: 输出采样率
+    :return: (与cue_ids顺序一致的数组列表，需要重新合成的下标列表)；复用的片段复制到内存中，仓库文件随后可以被覆盖
+    """
+    if not is_segment_store(path):
+        return [None] * len(cue_ids), list(range(len(cue_ids)))
+    import numpy as np
+    store = SegmentStore(path)
+    if store.voice != voice:
+        print(f"语音片段仓库的音色（{store.voice}）与当前（{voice}）不同，全部重新合成")
+        return [None] * len(cue_ids), list(range(len(cue_ids)))
+    by_text = {}
+    for cue_id in store.cue_ids:
+        by_text.setdefault(store.text(cue_id), cue_id)
+    arrays = []
+    pending = []
+    for k, (cue_id, text) in enumerate(zip(cue_ids, texts)):
+        source = cue_id if store.text(cue_id) == text else by_text.get(text)
+        if text is None or source is None:
+            arrays.append(None)
+            pending.append(k)
+        else:
+            arrays.append(np.array(store.get(source, sample_rate)))
+    return arrays, pending
+
+
+def segment_files(source, cue_ids, directory):
+    """
+    返回已有片段的文件路径（供预览的FFmpeg滤镜使用）：目录中的片段直接使用，片段仓库中的片段导出为WAV
+    :param source: 片段仓库文件或目录
+    :param cue_ids: 字幕序号列表
+    :param directory: 导出WAV的目录
+    :return: 与cue_ids顺序一致的文件路径列表，缺失的为None
+    """
+    if is_segment_store(source):
+        store = SegmentStore(source)
+        return [store.export(cue_id, os.path.join(directory, f"segment_{cue_id:04d}.wav")) if cue_id in store else None for cue_id in cue_ids]
+    return [_segment_file(source, cue_id) for cue_id in cue_ids]
+
+
+def pack_segment_dir(directory, path=None, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    把目录中的segment_XXXX.mp3/wav打包成一个片段仓库，所有片段只解码一次
+    :param directory: 片段目录
+    :param path: 输出文件，默认为目录旁边的同名.seg文件
+    :param sample_rate: 仓库采样率
+    :return: 输出文件路径
+    """
+    pattern = re.compile(r"segment_(\d+)\.(mp3|wav)$", re.IGNORECASE)
+    files = sorted((int(match.group(1)), os.path.join(directory, name)) for name in os.listdir(directory) for match in [pattern.match(name)] if match)
+    cue_ids = [cue_id for cue_id, _ in files]
+    # 与直接读取目录（load_segments）一样裁剪静音、拉齐响度，打包前后的混音结果一致
+    arrays = trim_and_normalize(decode_clips(load_audio_files([file for _, file in files]), sample_rate), sample_rate)
+    path = path or os.path.normpath(directory) + SEGMENT_STORE_EXT
+    count = write_segment_store(path, cue_ids, arrays, sample_rate)
+    print(f"已打包 {count}/{len(files)} 个语音片段: {path}")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把segment_XXXX.mp3目录打包为一个语音片段仓库文件")
+    parser.add_argument("directory", help="语音片段目录")
+    parser.add_argument("output", nargs="?", default=None, help="输出文件，默认为<目录>.seg")
+    args = parser.parse_args()
+    pack_segment_dir(args.directory, args.output)
@@ -0,0 +1,222 @@
+import os
+import time
+import shutil
+import pysrt
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from combine import probe_video, probe_keyframes, concat_segments, cut_segment_copy
+from render_shards import _run_shard
+
+# 源视频编码 → 可以生成兼容码流的编码器
+_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+}
+
+# ffprobe报告的profile → 编码器的 -profile:v 参数
+_PROFILES = {
+    'libx264': {
+        'constrained baseline': 'baseline',
+        'baseline': 'baseline',
+        'main': 'main',
+        'high': 'high',
+        'high 10': 'high10',
+        'high 4:2:2': 'high422',
+        'high 4:4:4 predictive': 'high444',
+    },
+    'libx265': {
+        'main': 'main',
+        'main 10': 'main10',
+    },
+}
+
+
+def source_encoder_args(info, crf=18):
+    """
+    生成与源视频参数一致的编码参数，使重新编码的片段能与原片段直接拼接
+    :param info: probe_video返回的视频信息
+    :param crf: 重新编码片段的质量
+    :return: 编码参数列表，源编码不支持时返回None
+    """
+    encoder = _ENCODERS.get(info.get('codec'))
+    if encoder is None:
+        return None
+    args = ['-c:v', encoder, '-pix_fmt', info.get('pix_fmt') or 'yuv420p', '-crf', str(crf)]
+    profile = _PROFILES[encoder].get((info.get('profile') or '').lower())
+    if profile:
+        args += ['-profile:v', profile]
+    # 使用MPEG-TS中间文件，每个关键帧都带参数集，拼接后解码器可以正确切换
+    args += ['-f', 'mpegts']
+    return args
+
+
+def plan_smart_segments(intervals, keyframe_indices, keyframe_times, total_frames):
+    """
+    把字幕时间段向外扩展到GOP边界，合并相邻GOP
+    :param intervals: [(开始秒, 结束秒), ...]
+    :param keyframe_indices: 关键帧帧序号列表
+    :param keyframe_times: 关键帧时间列表（秒）
+    :param total_frames: 总帧数
+    :return: [(起始帧, 起始时间, 帧数, 是否需要烧录), ...]
+    """
+    if not keyframe_indices or keyframe_indices[0] != 0:
+        keyframe_indices = [0] + list(keyframe_indices)
+        keyframe_times = [0.0] + list(keyframe_times)
+    intervals = sorted(intervals)
+
+    segments = []
+    cue = 0
+    for i, (start_frame, start_time) in enumerate(zip(keyframe_indices, keyframe_times)):
+        end_frame = keyframe_indices[i + 1] if i + 1 < len(keyframe_indices) else total_frames
+        end_time = keyframe_times[i + 1] if i + 1 < len(keyframe_times) else float('inf')
+        if end_frame <= start_frame:
+            continue
+        # 字幕和GOP都按时间排序，跳过已经结束的字幕即可线性扫描
+        while cue < len(intervals) and intervals[cue][1] < start_time:
+            cue += 1
+        burn = cue < len(intervals) and intervals[cue][0] < end_time
+        if segments and segments[-1][3] == burn:
+            first_frame, first_time, n_frames, _ = segments[-1]
+            segments[-1] = (first_frame, first_time, n_frames + end_frame - start_frame, burn)
+        else:
+            segments.append((start_frame, start_time, end_frame - start_frame, burn))
+    return segments
+
+
+def render_smart(video_path, subtitle_path, output_path, burn_range, fps, work_dir=None, max_workers=None):
+    """
+    只重新编码包含字幕的GOP，其余GOP直接复制码流，最后无损拼接
+    :param video_path: 输入视频路径
+    :param subtitle_path: 字幕文件路径
+    :param output_path: 输出视频路径（无音频）
+    :param burn_range: 可序列化的分段渲染函数，需要接受encoder_args关键字参数
+    :param fps: 视频帧率
+    :param work_dir: 片段临时目录，默认在输出文件旁边
+    :param max_workers: 并行渲染的进程数，默认等于CPU核数
+    :return: 输出视频路径；源视频编码不支持智能渲染时返回None
+    """
+    encoder_args = source_encoder_args(probe_video(video_path))
+    if encoder_args is None:
+        print("源视频编码不支持智能渲染，将完整重新编码")
+        return None
+
+    keyframe_indices, keyframe_times, total_frames = probe_keyframes(video_path)
+    if total_frames <= 0:
+        raise ValueError(f"无法读取视频帧信息: {video_path}")
+    subtitles = pysrt.open(subtitle_path, encoding='utf-8')
+    intervals = [(sub.start.ordinal / 1000.0, sub.end.ordinal / 1000.0) for sub in subtitles]
+    segments = plan_smart_segments(intervals, keyframe_indices, keyframe_times, total_frames)
+    burn_frames = sum(n_frames for _, _, n_frames, burn in segments if burn)
+    print(f"智能渲染: {len(segments)} 段, 需要重新编码 {burn_frames}/{total_frames} 帧 ({burn_frames / total_frames * 100:.1f}%)")
+
+    if work_dir is None:
+        work_dir = os.path.splitext(output_path)[0] + "_smart"
+    os.makedirs(work_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    try:
+        segment_paths = [os.path.join(work_dir, f"segment_{i:04d}.ts") for i in range(len(segments))]
+        burn_range = partial(burn_range, encoder_args=encoder_args)
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            futures = [
+                executor.submit(_run_shard, burn_range, video_path, subtitle_path, path, start_frame, start_time, n_frames, fps)
+                for path, (start_frame, start_time, n_frames, burn) in zip(segment_paths, segments)
+                if burn
+            ]
+            # 重新编码的片段在子进程中进行，同时在主进程中复制其余片段
+            for path, (start_frame, start_time, n_frames, burn) in zip(segment_paths, segments):
+                if not burn:
+                    cut_segment_copy(video_path, path, start_time, n_frames)
+            for future in futures:
+                future.result()
+        concat_segments(segment_paths, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"智能渲染完成: 用时 {elapsed:.1f} 秒")
+    return output_path
+
+
+def subtitle_cues(subtitle_path):
+    """
+    :param subtitle_path: 字幕文件路径
+    :return: [[开始秒, 结束秒, 文本], ...]，用于记录渲染时的字幕和比较修改
+    """
+    subtitles = pysrt.open(subtitle_path, encoding='utf-8')
+    return [[sub.start.ordinal / 1000.0, sub.end.ordinal / 1000.0, sub.text] for sub in subtitles]
+
+
+def changed_intervals(previous_cues, current_cues):
+    """
+    比较两个版本的字幕：文本或时间发生变化、新增或删除的字幕，旧位置和新位置都需要重新烧录
+    :return: [(开始秒, 结束秒), ...]，按开始时间排序
+    """
+    previous = {tuple(cue) for cue in previous_cues}
+    current = {tuple(cue) for cue in current_cues}
+    return sorted((start, end) for start, end, _ in previous ^ current)
+
+
+def render_patch(video_path, subtitle_path, output_path, previous_path, previous_cues, burn_range, fps, work_dir=None, max_workers=None):
+    """
+    字幕修改后增量渲染：只重新烧录包含修改过的字幕的GOP，其余GOP从上一次的渲染结果直接复制
+    :param video_path: 源视频路径
+    :param subtitle_path: 修改后的字幕文件路径
+    :param output_path: 输出视频路径（无音频），可以与previous_path相同
+    :param previous_path: 上一次烧录字幕的输出视频
+    :param previous_cues: 上一次渲染时的字幕（subtitle_cues的返回值）
+    :param burn_range: 可序列化的分段渲染函数，需要接受encoder_args关键字参数
+    :param fps: 视频帧率
+    :param work_dir: 片段临时目录，默认在输出文件旁边
+    :param max_workers: 并行渲染的进程数，默认等于CPU核数
+    :return: 输出视频路径；上一次的结果无法复用（编码不支持、帧数不一致）时返回None
+    """
+    intervals = changed_intervals(previous_cues, subtitle_cues(subtitle_path))
+    encoder_args = source_encoder_args(probe_video(previous_path))
+    if encoder_args is None:
+        print("上一次渲染结果的编码不支持增量渲染，将重新渲染")
+        return None
+    keyframe_indices, keyframe_times, total_frames = probe_keyframes(video_path)
+    previous_indices, previous_times, previous_frames = probe_keyframes(previous_path)
+    if total_frames <= 0 or total_frames != previous_frames:
+        print("上一次渲染结果与源视频帧数不一致，将重新渲染")
+        return None
+    # 只能在两个文件都是关键帧的位置切换来源
+    previous_starts = dict(zip(previous_indices, previous_times))
+    common = [(index, time_) for index, time_ in zip(keyframe_indices, keyframe_times) if index in previous_starts]
+    segments = plan_smart_segments(intervals, [index for index, _ in common], [time_ for _, time_ in common], total_frames)
+    burn_frames = sum(n_frames for _, _, n_frames, burn in segments if burn)
+    print(f"增量渲染: {len(intervals)} 处字幕修改, 需要重新编码 {burn_frames}/{total_frames} 帧 ({burn_frames / total_frames * 100:.1f}%)")
+
+    if work_dir is None:
+        work_dir = os.path.splitext(output_path)[0] + "_patch"
+    os.makedirs(work_dir, exist_ok=True)
+    root, ext = os.path.splitext(output_path)
+    temp_output = f"{root}_patch_temp{ext}"
+
+    started = time.perf_counter()
+    try:
+        segment_paths = [os.path.join(work_dir, f"segment_{i:04d}.ts") for i in range(len(segments))]
+        burn_range = partial(burn_range, encoder_args=encoder_args)
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            futures = [
+                executor.submit(_run_shard, burn_range, video_path, subtitle_path, path, start_frame, start_time, n_frames, fps)
+                for path, (start_frame, start_time, n_frames, burn) in zip(segment_paths, segments)
+                if burn
+            ]
+            for path, (start_frame, start_time, n_frames, burn) in zip(segment_paths, segments):
+                if not burn:
+                    cut_segment_copy(previous_path, path, previous_starts.get(start_frame, start_time), n_frames)
+            for future in futures:
+                future.result()
+        # 先拼接到临时文件，输出路径与上一次的结果相同时也不会边读边写
+        concat_segments(segment_paths, temp_output)
+        os.replace(temp_output, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if os.path.exists(temp_output):
+            os.remove(temp_output)
+
+    elapsed = time.perf_counter() - started
+    print(f"增量渲染完成: 用时 {elapsed:.1f} 秒")
+    return output_path
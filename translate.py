@@ -1,16 +1,18 @@
 from openai import OpenAI
 import json
 from retrying import retry
+from functools import lru_cache
+@lru_cache(maxsize=4)
+def _client(api_key, base_url):
+    # 同一配置复用一个客户端，连接池保持连接，常驻进程中不必每句重新握手
+    return OpenAI(api_key=api_key, base_url=base_url)
 @retry(stop_max_attempt_number=200, wait_exponential_multiplier=200, wait_exponential_max=400)
 def chanslater(text):
     '''生成运镜提示词'''
     with open("settings.json", "r", encoding="utf-8") as f:
         config = json.load(f)
-    client = OpenAI(
-    # 请用知识引擎原子能力API Key将下行替换为：api_key="sk-xxx",
-    api_key=config["api_key"], # 如何获取API Key：https://cloud.tencent.com/document/product/1772/115970
-    base_url=config["base_url"],
-)
+    # 请在settings.json中填入api_key，如何获取API Key：https://cloud.tencent.com/document/product/1772/115970
+    client = _client(config["api_key"], config["base_url"])
     completion = client.chat.completions.create(
         model=config['model'],  # 此处以 deepseek-r1 为例，可按需更换模型名称。
         temperature=0,
@@ -25,11 +27,8 @@ def chanslater_z2e(text):
     '''生成运镜提示词'''
     with open("settings.json", "r", encoding="utf-8") as f:
         config = json.load(f)
-    client = OpenAI(
-    # 请用知识引擎原子能力API Key将下行替换为：api_key="sk-xxx",
-    api_key=config["api_key"], # 如何获取API Key：https://cloud.tencent.com/document/product/1772/115970
-    base_url=config["base_url"],
-)
+    # 请在settings.json中填入api_key，如何获取API Key：https://cloud.tencent.com/document/product/1772/115970
+    client = _client(config["api_key"], config["base_url"])
     completion = client.chat.completions.create(
         model=config['model'],  # 此处以 deepseek-r1 为例，可按需更换模型名称。
         temperature=0.7,
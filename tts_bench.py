@@ -0,0 +1,202 @@
+import time
+import random
+import asyncio
+import argparse
+from functools import partial
+from voice import synthesize_clips
+
+# 24kHz、48kbps、单声道的MPEG2 Layer III帧头（与edge-tts默认输出格式一致）
+_FRAME_HEADER = bytes([0xFF, 0xF3, 0x64, 0xC0])
+_FRAME_LENGTH = 144     # 72 * 48000 / 24000
+_FRAME_SECONDS = 576 / 24000
+
+
+def silent_mp3(seconds):
+    """
+    生成指定时长的静音MP3（帧内容全零，解码结果为静音）
+    :param seconds: 时长（秒）
+    :return: MP3数据
+    """
+    frames = max(1, int(round(seconds / _FRAME_SECONDS)))
+    frame = _FRAME_HEADER + bytes(_FRAME_LENGTH - len(_FRAME_HEADER))
+    return frame * frames
+
+
+class FakeTTSServer:
+    """
+    本地模拟的语音合成服务，用于离线测量并发合成的吞吐
+    POST请求体为UTF-8文本，按设定的延迟返回与文本长度成比例的静音MP3
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.4, jitter=0.2, error_rate=0.0, max_concurrency=None, chars_per_second=5.0):
+        """
+        :param host: 监听地址
+        :param port: 监听端口，0表示自动分配
+        :param latency: 每个请求的基础延迟（秒）
+        :param jitter: 额外的随机延迟上限（秒）
+        :param error_rate: 随机返回503的概率，用于检验重试
+        :param max_concurrency: 服务端同时处理的请求上限，模拟限流（None表示不限）
+        :param chars_per_second: 模拟的语速，决定返回音频的时长
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chars_per_second = chars_per_second
+        self._limit = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self._server = None
+        self.requests = 0
+        self.active = 0
+        self.peak_active = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/tts"
+
+    async def _handle(self, reader, writer):
+        try:
+            headers = {}
+            await reader.readline()
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            text = (await reader.readexactly(int(headers.get('content-length', 0)))).decode('utf-8')
+            if self._limit:
+                async with self._limit:
+                    status, body = await self._synthesize(text)
+            else:
+                status, body = await self._synthesize(text)
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: audio/mpeg\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _synthesize(self, text):
+        self.requests += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+            if random.random() < self.error_rate:
+                return "503 Service Unavailable", b""
+            return "200 OK", silent_mp3(len(text) / self.chars_per_second)
+        finally:
+            self.active -= 1
+
+
+async def text_to_speech_fake(text, url, filename=None, **kwargs):
+    """
+    向FakeTTSServer请求合成，接口与text_to_speech_edge_bytes一致
+    :param text: 文本
+    :param url: FakeTTSServer.url
+    :param filename: 可选，同时保存为MP3文件
+    :return: MP3数据
+    """
+    host_port = url.split("://", 1)[1].split("/", 1)[0]
+    host, port = host_port.rsplit(":", 1)
+    body = text.encode('utf-8')
+    reader, writer = await asyncio.open_connection(host, int(port))
+    try:
+        writer.write(f"POST /tts HTTP/1.0\r\nHost: {host_port}\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, audio = response.partition(b"\r\n\r\n")
+    status = head.split(b"\r\n", 1)[0].decode('latin-1')
+    if " 200 " not in status:
+        raise RuntimeError(f"Fake TTS failed: {status}")
+    if filename:
+        with open(filename, 'wb') as f:
+            f.write(audio)
+    return audio
+
+
+async def bench(cues=200, levels=(1, 4, 8, 16, 32), latency=0.4, jitter=0.2, error_rate=0.0, server_limit=None):
+    """
+    在本地模拟服务上测量不同并发数下的合成吞吐
+    :param cues: 每轮合成的条数
+    :param levels: 要测试的并发数
+    :return: [(并发数, 条/秒), ...]
+    """
+    server = await FakeTTSServer(latency=latency, jitter=jitter, error_rate=error_rate, max_concurrency=server_limit).start()
+    texts = [f"第{i}条测试字幕，" + "语音合成吞吐测试" * random.randint(1, 4) for i in range(cues)]
+    results = []
+    try:
+        for concurrency in levels:
+            started = time.perf_counter()
+            clips, stats = await synthesize_clips(
+                texts,
+                synthesize=partial(text_to_speech_fake, url=server.url),
+                concurrency=concurrency,
+                backoff=0.1,
+                cache=False,
+            )
+            elapsed = time.perf_counter() - started
+            ok = sum(1 for clip in clips if clip)
+            results.append((concurrency, ok / elapsed if elapsed > 0 else 0.0))
+            print(f"并发 {concurrency:>3}: {ok}/{cues} 条, {elapsed:.2f} 秒, {results[-1][1]:.1f} 条/秒, P95 延迟 {stats.percentile(95):.2f}s")
+    finally:
+        await server.stop()
+    return results
+
+
+async def bench_providers(providers=None, cues=200, concurrency=None):
+    """
+    用真实引擎合成同一批文本，比较各引擎的吞吐（不使用缓存）
+    :param providers: 引擎名称列表，默认测试当前机器上可用的全部引擎
+    :param cues: 合成的条数
+    :param concurrency: 并发数，默认读取settings.json
+    :return: [(引擎名称, 条/秒, 音频总时长/合成耗时), ...]
+    """
+    from tts_providers import get_provider, available_providers
+    from audio_codec import mp3_duration
+    providers = providers or available_providers()
+    texts = [f"第{i}条测试字幕，" + "语音合成吞吐测试" * random.randint(1, 4) for i in range(cues)]
+    results = []
+    for name in providers:
+        engine = get_provider(name)
+        if not engine.available():
+            print(f"{name}: 当前机器不可用，跳过")
+            continue
+        started = time.perf_counter()
+        clips, stats = await synthesize_clips(texts, provider=engine, concurrency=concurrency, cache=False)
+        elapsed = time.perf_counter() - started
+        ok = [clip for clip in clips if clip]
+        audio_seconds = sum(mp3_duration(clip) for clip in ok)
+        results.append((name, len(ok) / elapsed if elapsed > 0 else 0.0, audio_seconds / elapsed if elapsed > 0 else 0.0))
+        print(f"{name:>8}: {len(ok)}/{cues} 条, {elapsed:.2f} 秒, {results[-1][1]:.1f} 条/秒, 实时倍数 {results[-1][2]:.1f}x, P95 延迟 {stats.percentile(95):.2f}s")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线测量并发语音合成的吞吐")
+    parser.add_argument("--cues", type=int, default=200, help="每轮合成的条数")
+    parser.add_argument("--levels", type=str, default="1,4,8,16,32", help="要测试的并发数，逗号分隔")
+    parser.add_argument("--latency", type=float, default=0.4, help="模拟服务的基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="模拟服务的随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务随机失败的概率")
+    parser.add_argument("--server-limit", type=int, default=None, help="模拟服务端的并发上限")
+    parser.add_argument("--providers", type=str, default=None, help="改为比较真实引擎的吞吐，逗号分隔（如edge,pyttsx3），all表示全部可用引擎")
+    args = parser.parse_args()
+    if args.providers:
+        names = None if args.providers == "all" else [name.strip() for name in args.providers.split(",") if name.strip()]
+        asyncio.run(bench_providers(names, args.cues))
+        raise SystemExit
+    levels = tuple(int(level) for level in args.levels.split(",") if level.strip())
+    asyncio.run(bench(args.cues, levels, args.latency, args.jitter, args.error_rate, args.server_limit))
@@ -0,0 +1,171 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 缓存放在用户目录下，不随输出目录中的audio_segments一起被删除
+TTS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".youtube_mover", "tts_cache")
+TTS_CACHE_MB = 2048
+
+
+def tts_cache_key(text, voice, rate, volume, provider="edge"):
+    """
+    计算语音片段的内容地址，相同的文本和合成参数得到相同的键
+    :param text: 文本
+    :param voice: 音色
+    :param rate: 语速
+    :param volume: 音量
+    :param provider: 合成引擎名称
+    :return: sha256十六进制字符串
+    """
+    payload = json.dumps([provider, voice, rate, volume, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """
+    按内容寻址的语音片段缓存，总大小超过上限时淘汰最久未使用的片段
+    使用时间记录在文件的修改时间上，多个进程共用同一个缓存目录也能保持LRU顺序
+    """
+    def __init__(self, root=None, max_bytes=None, suffix=".mp3"):
+        """
+        :param root: 缓存目录，默认 ~/.youtube_mover/tts_cache
+        :param max_bytes: 缓存大小上限（字节），默认2GB
+        :param suffix: 缓存文件扩展名
+        """
+        self.root = root or TTS_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else TTS_CACHE_MB * 1024 * 1024
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = None
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key + self.suffix)
+
+    def _load(self):
+        """
+        第一次使用时扫描缓存目录，按修改时间建立LRU顺序
+        """
+        if self._entries is not None:
+            return
+        found = []
+        if os.path.isdir(self.root):
+            for folder in os.listdir(self.root):
+                folder_path = os.path.join(self.root, folder)
+                if not os.path.isdir(folder_path):
+                    continue
+                for name in os.listdir(folder_path):
+                    if not name.endswith(self.suffix):
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(folder_path, name))
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in found)
+        self.bytes = sum(self._entries.values())
+
+    def lookup(self, key):
+        """
+        查找缓存片段，命中时更新使用时间
+        :param key: tts_cache_key返回的键
+        :return: 缓存文件路径，未命中时返回None
+        """
+        path = self.path_for(key)
+        with self._lock:
+            self._load()
+            if key in self._entries and os.path.exists(path):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)
+            self.misses += 1
+            return None
+
+    def get(self, key):
+        """
+        读取缓存片段
+        :param key: 缓存键
+        :return: 音频数据，未命中时返回None
+        """
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        """
+        把合成好的音频放入缓存
+        :param key: 缓存键
+        :param data: 音频数据
+        :return: 缓存文件路径
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，其他进程不会读到写了一半的文件
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._load()
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self.bytes += len(data)
+            self._evict()
+        return path
+
+    def _evict(self):
+        # 至少保留刚放入的一项
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        print(f"语音缓存: 命中 {self.hits}, 未命中 {self.misses} (命中率 {hit_rate:.1f}%), "
+              f"淘汰 {self.evictions}, 占用 {self.bytes / 1024 / 1024:.1f}/{self.max_bytes / 1024 / 1024:.0f} MB")
+
+
+_default_cache = None
+
+
+def get_tts_cache(path="settings.json"):
+    """
+    返回按settings.json配置的共享缓存（tts_cache_dir、tts_cache_mb）
+    :param path: 配置文件路径
+    :return: TTSCache
+    """
+    global _default_cache
+    if _default_cache is None:
+        config = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            pass
+        max_mb = config.get("tts_cache_mb", TTS_CACHE_MB)
+        _default_cache = TTSCache(config.get("tts_cache_dir") or TTS_CACHE_DIR, int(max_mb * 1024 * 1024))
+    return _default_cache
@@ -0,0 +1,202 @@
+import os
+import json
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from voice import text_to_speech_edge_bytes, DEFAULT_VOICE, DEFAULT_RATE, DEFAULT_VOLUME
+from duration_planner import rate_to_speed
+
+DEFAULT_PROVIDER = "edge"
+
+_PROVIDERS = {}
+
+
+def register_provider(cls):
+    """
+    注册语音合成引擎（类装饰器）
+    """
+    _PROVIDERS[cls.name] = cls
+    return cls
+
+
+def get_provider(name=None, **kwargs):
+    """
+    :param name: 引擎名称，None表示使用settings.json中的tts_provider（默认edge）
+    :return: 引擎实例
+    """
+    if isinstance(name, TTSProvider):
+        return name
+    name = name or _configured_provider()
+    if name not in _PROVIDERS:
+        raise ValueError(f"未知的语音合成引擎: {name}，可选: {', '.join(_PROVIDERS)}")
+    return _PROVIDERS[name](**kwargs)
+
+
+def available_providers():
+    """
+    :return: 当前机器上可用的引擎名称列表（按注册顺序）
+    """
+    return [name for name, cls in _PROVIDERS.items() if cls().available()]
+
+
+def _configured_provider(path="settings.json"):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("tts_provider") or DEFAULT_PROVIDER
+    except (OSError, ValueError):
+        return DEFAULT_PROVIDER
+
+
+class TTSProvider:
+    """
+    语音合成引擎接口
+    voice、rate、volume沿用edge-tts的写法（如"zh-CN-YunxiNeural"、"+30%"），由各引擎换算成自己的参数；
+    synthesize合成一条，synthesize_many一次合成多条（batch_size大于1的引擎按批调用）
+    返回的音频为MP3或WAV数据，由audio_codec.decode_clips统一解码
+    synthesize收到boundaries=True时，支持逐词时间的引擎把时间写入MP3标签，其余引擎忽略
+    """
+    name = None
+    # synthesize_clips每次交给synthesize_many的条数，1表示逐条并发调用synthesize
+    batch_size = 1
+
+    def available(self):
+        """
+        :return: 当前机器是否支持该引擎
+        """
+        return True
+
+    async def synthesize(self, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE, volume=DEFAULT_VOLUME, **kwargs):
+        """
+        :return: 音频数据
+        """
+        results = await self.synthesize_many([text], voice=voice, rates=[rate], volume=volume)
+        if not results[0]:
+            raise RuntimeError(f"{self.name} 没有返回音频数据")
+        return results[0]
+
+    async def synthesize_many(self, texts, voice=DEFAULT_VOICE, rates=None, volume=DEFAULT_VOLUME):
+        """
+        :param rates: 每条文本的语速，None表示都使用默认语速
+        :return: 与texts顺序一致的音频数据列表，失败为None
+        """
+        rates = rates or [DEFAULT_RATE] * len(texts)
+        results = await asyncio.gather(
+            *(self.synthesize(text, voice=voice, rate=rate, volume=volume) for text, rate in zip(texts, rates)),
+            return_exceptions=True
+        )
+        return [None if isinstance(result, Exception) else result for result in results]
+
+
+@register_provider
+class EdgeTTSProvider(TTSProvider):
+    """
+    在线的edge-tts（微软神经网络音色），每条字幕一个请求，靠并发提高吞吐
+    """
+    name = "edge"
+
+    def available(self):
+        try:
+            import edge_tts
+        except ImportError:
+            return False
+        return True
+
+    async def synthesize(self, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE, volume=DEFAULT_VOLUME, boundaries=False, **kwargs):
+        return await text_to_speech_edge_bytes(text, voice=voice, rate=rate, volume=volume, boundaries=boundaries)
+
+
+@register_provider
+class Pyttsx3Provider(TTSProvider):
+    """
+    离线的系统语音引擎（Windows SAPI5 / Linux eSpeak），不需要网络
+    一批字幕排进同一个引擎队列，只调用一次runAndWait，避免每条都初始化引擎
+    pyttsx3.init()对同一驱动返回同一个缓存的引擎，runAndWait不能并发调用，
+    所以所有批次都交给一个专用线程串行执行，引擎只在该线程中创建和使用
+    """
+    name = "pyttsx3"
+    batch_size = 64
+    # +0%语速对应的每分钟词数（pyttsx3默认值）
+    BASE_WORDS_PER_MINUTE = 200
+    # 所有实例共用的引擎线程及其引擎
+    _executor = None
+    _executor_lock = threading.Lock()
+    _engine = None
+
+    def available(self):
+        try:
+            import pyttsx3
+        except ImportError:
+            return False
+        return True
+
+    @classmethod
+    def _engine_thread(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyttsx3", initializer=cls._init_thread)
+            return cls._executor
+
+    @staticmethod
+    def _init_thread():
+        # SAPI5是COM组件，在非主线程中使用前需要先初始化COM
+        try:
+            import pythoncom
+        except ImportError:
+            return
+        pythoncom.CoInitialize()
+
+    async def synthesize_many(self, texts, voice=DEFAULT_VOICE, rates=None, volume=DEFAULT_VOLUME):
+        rates = rates or [DEFAULT_RATE] * len(texts)
+        # 引擎调用是阻塞的，放到引擎线程中执行，不阻塞事件循环；
+        # 并发提交的批次（包括超时后的逐条重试）在该线程中排队，不会同时调用runAndWait
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._engine_thread(), self._synthesize_blocking, list(texts), voice, list(rates), volume
+        )
+
+    def _synthesize_blocking(self, texts, voice, rates, volume):
+        # 只在引擎线程中调用
+        cls = type(self)
+        if cls._engine is None:
+            import pyttsx3
+            cls._engine = pyttsx3.init()
+        engine = cls._engine
+        local_voice = self.voice_for(engine, voice)
+        if local_voice:
+            engine.setProperty('voice', local_voice)
+        engine.setProperty('volume', min(1.0, max(0.0, rate_to_speed(volume))))
+        with tempfile.TemporaryDirectory(prefix="pyttsx3_") as temp_dir:
+            paths = []
+            # 语速是引擎属性，相同语速的文本连续排队，减少属性切换
+            for index in sorted(range(len(texts)), key=lambda i: rates[i]):
+                path = os.path.join(temp_dir, f"{index:05d}.wav")
+                engine.setProperty('rate', int(self.BASE_WORDS_PER_MINUTE * rate_to_speed(rates[index])))
+                engine.save_to_file(texts[index], path)
+                paths.append((index, path))
+            engine.runAndWait()
+            results = [None] * len(texts)
+            for index, path in paths:
+                if os.path.exists(path) and os.path.getsize(path) > 44:
+                    with open(path, 'rb') as f:
+                        results[index] = f.read()
+        return results
+
+    @staticmethod
+    def voice_for(engine, voice):
+        """
+        把edge-tts音色名换成本机的音色：按语言前缀（如zh、en）匹配
+        :return: 本机音色ID，找不到时返回None（使用引擎默认音色）
+        """
+        language = (voice or "").split("-")[0].lower()
+        if not language:
+            return None
+        for local in engine.getProperty('voices'):
+            names = [local.id, local.name or ""] + [
+                item.decode('utf-8', errors='ignore') if isinstance(item, bytes) else str(item)
+                for item in (getattr(local, 'languages', None) or [])
+            ]
+            if any(language in name.lower() for name in names):
+                return local.id
+        return None
+
@@ -1,23 +1,16 @@
-from video_processor_pro import simple_process
+from folder_watcher import watch_folder
 import os
-import time
-from uuid import uuid4
 def videos_processor(videos_path):
+    """
+    监视videos_path，复制/上传完成的视频自动进入流水线处理
+    处理成功的视频移到temp目录，多次失败的视频移到videos_path/poison，不再反复重试
+    """
     if not os.path.exists(videos_path):
         os.mkdir(videos_path)
     if not os.path.exists("temp"):
         os.mkdir("temp")
-    while True:
-        time.sleep(4)
-        try:
-            videos=os.listdir(videos_path)
-            for video in videos:
-                video_path=os.path.join(videos_path,video)
-                simple_process(video_path=video_path, output_dir="D:/AI/油管视频汉化/subtitles",add_translation=True, model_size="medium", burn_subtitles=True,replace_audio=True,skip_subtitle_generation=False,volume_factor=3)
-                os.rename(video_path,f"D:/AI/油管视频汉化/temp/{uuid4()}.mp4")
-                #os.remove(video_path)
-        except Exception as e:
-            print(e)
+    watch_folder(videos_path, output_dir="D:/AI/油管视频汉化/subtitles", archive_dir="D:/AI/油管视频汉化/temp",
+                 add_translation=True, model_size="medium", burn_subtitles=True, replace_audio=True, volume_factor=3)
 if __name__ == '__main__':
     videos_path="temp_videos"
     videos_processor(videos_path)
\ No newline at end of file
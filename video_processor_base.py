@@ -2,26 +2,37 @@ import os
 import argparse
 import whisper
 import pysrt
-from voice import index_tts
-from moviepy import VideoFileClip,CompositeAudioClip,AudioFileClip
-from voice import text_to_speech_edge
+from voice import DEFAULT_VOICE
 import cv2
-import time
 import re
 from PIL import Image, ImageDraw, ImageFont
 import asyncio
 from moviepy import vfx
 from translate import chanslater
 from collections import defaultdict
+from render_pipeline import CueTimeline, PipelinedFrameRenderer, FFmpegFrameWriter, DEFAULT_ENCODER_ARGS, SubtitleImageCache, CompactSubtitle
+from renderers import render_subtitles
+from combine import fast_merge_av, mux_soft_subtitles, mux_dual_audio, mux_original_audio
+from preview import render_preview
+from audio_codec import write_wav, SPEECH_SAMPLE_RATE
+from audio_mix import mix_dub
+from cue_groups import synthesize_cues
+from segment_store import load_segments, segment_files, segment_store_path, write_segment_store
+import numpy as np
 
 class VideoProcessor:
     def __init__(self, model_size="base"):
         """
         初始化视频处理器
-        :param model_size: Whisper模型大小 ("tiny", "base", "small", "medium", "large")
+        :param model_size: Whisper模型大小 ("tiny", "base", "small", "medium", "large")，
+                           为None时不加载模型，只用于渲染
         """
-        print(f"正在加载Whisper {model_size} 模型...")
-        self.model = whisper.load_model(model_size)
+        # 语音合成引擎，None表示使用settings.json中的tts_provider；process_video按任务设置
+        self.tts_provider = None
+        self.model = None
+        if model_size:
+            print(f"正在加载Whisper {model_size} 模型...")
+            self.model = whisper.load_model(model_size)
         
     def transcribe_audio(self, video_path, language="en"):
         """
@@ -89,13 +100,18 @@ class VideoProcessor:
         millisecs = int((seconds - int(seconds)) * 1000)
         return pysrt.SubRipTime(hours=hours, minutes=minutes, seconds=secs, milliseconds=millisecs)
     
-    def burn_subtitles_to_video(self, video_path, subtitle_path, output_path, replace_audio=False,volume_factor=2,sounds_files=None):
+    def burn_subtitles_to_video(self, video_path, subtitle_path, output_path, replace_audio=False,volume_factor=2,sounds_files=None,num_workers=None,shards=None,smart_render=False,renderer="cv2",cache_budget_mb=64):
         """
         将字幕烧录到视频中，带有字符动画效果
         :param video_path: 输入视频路径
         :param subtitle_path: 字文件路径
         :param output_path: 输出视频路径
         :param replace_audio: 是否用生成的语音替换原音频
+        :param num_workers: 字幕合成线程数（默认按CPU核数自动选择）
+        :param shards: 分段并行渲染的进程数（None或1表示不分段）
+        :param smart_render: 是否只重新编码包含字幕的片段，其余片段直接复制
+        :param renderer: 渲染后端（"cv2"、"overlay"、"libass"、"auto"），"auto"在与cv2排版相同的后端中按本机测速结果选择
+        :param cache_budget_mb: 逐帧渲染时每个渲染进程的字幕缓存上限（MB）
         """
         print("正在将字幕烧录到视频中...")
 
@@ -104,6 +120,31 @@ class VideoProcessor:
         if not os.path.exists(video_path):
             raise ValueError(f"视频文件不存在: {video_path}")
         
+        # 按选定的后端渲染
+        render_subtitles(video_path, subtitle_path, output_path, renderer=renderer, shards=shards, smart_render=smart_render, num_workers=num_workers, cache_budget_mb=cache_budget_mb)
+        
+        # 处理音频替换
+        if replace_audio:
+            self._replace_audio_with_generated_speech(video_path, subtitle_path, output_path, volume_factor, sounds_files)
+        else:
+            # 流复制保留原始音频
+            self._merge_original_audio(video_path, output_path)
+        
+        print(f"已生成带字幕的视频: {output_path}")
+
+    def _render_frames(self, video_path, subtitle_path, output_path, start_frame=0, max_frames=None, num_workers=None, encoder_args=None, cache_budget_mb=64):
+        """
+        逐帧叠加字幕并写出无音频视频
+        :param video_path: 输入视频路径
+        :param subtitle_path: 字幕文件路径（时间相对start_frame）
+        :param output_path: 输出视频路径
+        :param start_frame: 起始帧序号
+        :param max_frames: 最多渲染的帧数（None表示到视频结尾）
+        :param num_workers: 字幕合成线程数
+        :param encoder_args: FFmpeg编码参数（None表示使用与其他后端一致的libx264编码）
+        :param cache_budget_mb: 字幕图像缓存的内存上限（MB），每个渲染进程独立计算
+        :return: 渲染的帧数
+        """
         # 打开视频
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
@@ -116,34 +157,19 @@ class VideoProcessor:
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
-        # 检查CUDA支持
-        use_cuda = False
-        try:
-            if cv2.cuda.getCudaEnabledDeviceCount() > 0:
-                use_cuda = True
-                gpu_frame = cv2.cuda_GpuMat()
-                print("检测到CUDA支持，将使用GPU加速渲染")
-        except:
-            print("未检测到CUDA支持，将使用CPU渲染")
-        
-        # 定义视频写入器
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            total_frames -= start_frame
+        if max_frames is not None:
+            total_frames = max_frames
+        
+        # 定义视频写入器，分段渲染时使用与源视频一致的编码参数，便于与未重新编码的片段拼接
+        out = FFmpegFrameWriter(output_path, fps, (width, height), encoder_args or DEFAULT_ENCODER_ARGS)
         if not out.isOpened():
             raise ValueError(f"无法创建输出视频文件: {output_path}")
         
         # 加载字体
-        try:
-            font_en = ImageFont.truetype('arial.ttf', 36)  # 英文字体使用Arial
-            font_zh = ImageFont.truetype('STXINGKA.TTF', 36)  # 中文字体使用黑体
-        except:
-            try:
-                font_en = ImageFont.truetype('DejaVuSans.ttf', 36)  # 备选英文字体
-                font_zh = ImageFont.truetype('uming.ttc', 36)      # 备选中文字体
-            except:
-                font_en = ImageFont.load_default()  # 默认字体
-                font_zh = ImageFont.load_default()
+        font_en, font_zh = self._load_fonts()
         
         # 加载字幕
         subtitles = pysrt.open(subtitle_path)
@@ -153,126 +179,72 @@ class VideoProcessor:
         # 修改为预渲染通用模板而不是每个字幕单独渲染
         universal_template = self._pre_render_universal_template(width, font_en, font_zh)
         
-        # 缓存最近使用的字幕图像以避免重复渲染
-        subtitle_cache = {}
-        cache_limit = 100  # 限制缓存大小
+        # 按字节数限制的LRU缓存，存放裁剪后的字幕数组以避免重复渲染
+        subtitle_cache = SubtitleImageCache(max_bytes=int(cache_budget_mb * 1024 * 1024))
+        timeline = CueTimeline(subtitles)
         
-        frame_count = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
+        def render_compact(text):
+            # 使用通用模板动态渲染当前字幕文本，只保留文字区域
+            return CompactSubtitle(self._render_subtitle_on_template(universal_template, text, font_en, font_zh))
+        
+        def composite_frame(frame, frame_index):
             # 计算当前时间
-            current_time = frame_count / fps
+            current_time = frame_index / fps
             
             # 查找当前应该显示的字幕
-            current_subtitle_text = None
-            for subtitle in subtitles:
-                start_time = subtitle.start.ordinal / 1000.0
-                end_time = subtitle.end.ordinal / 1000.0
-                if start_time <= current_time <= end_time:
-                    current_subtitle_text = subtitle.text
-                    break
+            current_subtitle_text = timeline.text_at(current_time)
             
             # 在帧上绘制字幕
             if current_subtitle_text:
-                # 检查缓存中是否有该字幕
-                if current_subtitle_text in subtitle_cache:
-                    subtitle_image = subtitle_cache[current_subtitle_text]
-                else:
-                    # 使用通用模板动态渲染当前字幕文本
-                    subtitle_image = self._render_subtitle_on_template(universal_template, current_subtitle_text, font_en, font_zh)
-                    # 更新缓存
-                    if len(subtitle_cache) >= cache_limit:
-                        # 删除最旧的条目
-                        oldest_key = next(iter(subtitle_cache))
-                        del subtitle_cache[oldest_key]
-                    subtitle_cache[current_subtitle_text] = subtitle_image
-                
-                frame = self._overlay_subtitle_image(frame, subtitle_image)
-            
-            # 使用CUDA加速写入帧（如果可用）
-            if use_cuda:
-                gpu_frame.upload(frame)
-                out.write(gpu_frame.download())
-            else:
-                out.write(frame)
-                
-            frame_count += 1
-            
-            # 显示进度
-            if frame_count % 30 == 0:
-                progress = (frame_count / total_frames) * 100
-                print(f"处理进度: {progress:.1f}%")
+                subtitle = subtitle_cache.get(current_subtitle_text, lambda: render_compact(current_subtitle_text))
+                frame = self._overlay_subtitle_image(frame, subtitle)
+            return frame
+        
+        # 解码、合成、编码分别在独立线程中并行执行
+        pipeline = PipelinedFrameRenderer(cap, out.write, composite_frame, num_workers=num_workers, frame_shape=(height, width, 3), max_frames=max_frames)
+        frames = pipeline.run(total_frames)
+        subtitle_cache.report()
         
         # 释放资源
         cap.release()
         out.release()
         cv2.destroyAllWindows()
-        
-        # 处理音频替换
+        return frames
+
+    def mux_subtitles_to_video(self, video_path, subtitle_path, output_path, replace_audio=False,volume_factor=2,sounds_files=None,language="chi"):
+        """
+        以软字幕轨道输出，视频流直接复制不重新编码
+        :param video_path: 输入视频路径
+        :param subtitle_path: 字幕文件路径
+        :param output_path: 输出视频路径（.mp4使用mov_text，.mkv使用ASS）
+        :param replace_audio: 是否用生成的语音替换原音频
+        :param language: 字幕轨道的语言标记
+        """
+        print("正在封装软字幕...")
+        # 原音频随视频一起复制，不需要再单独合并
+        mux_soft_subtitles(video_path, subtitle_path, output_path, language)
         if replace_audio:
             self._replace_audio_with_generated_speech(video_path, subtitle_path, output_path, volume_factor, sounds_files)
-        else:
-            # 使用moviepy保留原始音频
-            self._merge_original_audio(video_path, output_path)
-        
-        print(f"已生成带字幕的视频: {output_path}")
+        print(f"已生成带软字幕的视频: {output_path}")
 
     def _replace_audio_with_generated_speech(self, video_path, subtitle_path, output_path, volume_factor, sounds_files):
         """
-        用生成的语音替换原音频
+        用生成的语音替换原音频，原声作为第二条音轨保留
         """
         print("正在生成并合并语音...")
         try:
             # 生成语音片段
             output_dir = os.path.dirname(output_path)
-            audio_files, timestamps,durations = asyncio.run(self.generate_speech_for_subtitles(subtitle_path, output_dir,soundfiles_path=sounds_files))
-            
-            # 使用moviepy合并音频
-            original_video = VideoFileClip(video_path)
-            subtitled_video = VideoFileClip(output_path)
-            
-            # 创建新的音频轨道 - 保留原始音频，并添加生成的语音
-            new_audio_tracks = [original_video.audio]  # 保留原始音频
+            speech_arrays, timestamps,durations = asyncio.run(self.synthesize_speech(subtitle_path, soundfiles_path=sounds_files, store_path=segment_store_path(subtitle_path)))
             
-            # 添加生成的语音片段
-            for audio_file, timestamp,duration in zip(audio_files, timestamps,durations):
-                if audio_file and os.path.exists(audio_file):
-                    speech_clip = AudioFileClip(audio_file)
-                    speech_clip = speech_clip.with_speed_scaled(factor=(speech_clip.duration/duration))
-                    speech_clip = speech_clip.with_volume_scaled(factor=volume_factor)
-                    speech_clip = speech_clip.with_start(timestamp)
-                    new_audio_tracks.append(speech_clip)
-            
-            # 合并音频轨道
-            if new_audio_tracks:
-                final_audio = CompositeAudioClip(new_audio_tracks)
-                final_video = subtitled_video.with_audio(final_audio)
-            else:
-                final_video = subtitled_video
-                
-            final_output_path = output_path.replace(".mp4", "_final.mp4")
-            final_video.write_videofile(final_output_path, codec="libx264", audio_codec="aac")
-            
-            # 显式关闭视频剪辑以释放资源
-            original_video.close()
-            subtitled_video.close()
-            final_video.close()
-            if 'final_audio' in locals():
-                final_audio.close()
-            
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-            
-            # 删除临时无音频视频文件
-            import time
-            time.sleep(1)  # 等待文件句柄释放
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            os.rename(final_output_path, output_path)
+            # 在NumPy缓冲区中混音，直接编码为AAC；一次封装配音和原声两条音轨，视频流（以及软字幕轨道）直接复制
+            output_root, output_ext = os.path.splitext(output_path)
+            final_output_path = output_root + "_final" + output_ext
+            dub_audio_path = output_root + "_dub_audio.m4a"
+            mix_dub(video_path, speech_arrays, timestamps, durations, dub_audio_path, balance=volume_factor)
+            mux_dual_audio(output_path, dub_audio_path, video_path, final_output_path, dub_language="chi", original_language="eng")
+            os.remove(dub_audio_path)
+            os.replace(final_output_path, output_path)
             
             # 清理临时音频文件
             audio_dir = os.path.join(output_dir, "audio_segments")
@@ -286,36 +258,69 @@ class VideoProcessor:
 
     def _merge_original_audio(self, video_path, output_path):
         """
-        合并原始音频到视频
+        合并原始音频到视频，视频流直接复制不重新编码
         """
         print("正在合并原始音频...")
         try:
-            original_video = VideoFileClip(video_path)
-            subtitled_video = VideoFileClip(output_path)
-            final_video = subtitled_video.with_audio(original_video.audio)
-            final_output_path = output_path.replace(".mp4", "_final.mp4")
-            final_video.write_videofile(final_output_path, codec="libx264", audio_codec="aac")
-            
-            # 显式关闭视频剪辑以释放资源
-            original_video.close()
-            subtitled_video.close()
-            final_video.close()
-            
-            # 删除临时无音频视频文件
-            import time
-            time.sleep(1)  # 等待文件句柄释放
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            os.rename(final_output_path, output_path)
+            mux_original_audio(output_path, video_path, output_path)
         except Exception as e:
             print(f"警告: 合并音频时出现问题: {e}")
             print("将继续使用无音频版本")
 
-    async def generate_speech_for_subtitles(self, subtitle_path, output_dir,soundfiles_path=None):
+    async def synthesize_speech(self, subtitle_path, sample_rate=SPEECH_SAMPLE_RATE, soundfiles_path=None, concurrency=None, store_path=None, voice=DEFAULT_VOICE):
+        """
+        为字幕合成语音并直接解码为float32数组，音频只在内存中流转，不写中间文件
+        :param subtitle_path: 字幕文件路径
+        :param sample_rate: 解码采样率，混音时再转换到输出采样率
+        :param soundfiles_path: 已有语音片段：片段仓库文件（.seg）或segment_XXXX.mp3所在目录，提供时不再合成
+        :param concurrency: 同时进行的合成请求数，默认读取settings.json
+        :param store_path: 合成后把全部片段写入这个片段仓库文件，重新混音时可作为soundfiles_path使用
+        :param voice: 音色
+        :return: (语音数组列表, 时间戳列表, 时长列表)
+        """
+        print("正在为中文字幕生成语音...")
+        subtitles = pysrt.open(subtitle_path, encoding='utf-8')
+        texts = []
+        cues = []
+        for i, subtitle in enumerate(subtitles):
+            # 提取中文字幕（假设在第二行）并清理文本
+            lines = subtitle.text.split('\n')
+            chinese_text = lines[1] if len(lines) >= 2 else lines[0]
+            chinese_text = re.sub(r'<[^>]+>', '', chinese_text).strip()
+            if chinese_text:
+                texts.append(chinese_text)
+                cues.append((i, subtitle.start.ordinal / 1000.0, round((subtitle.end.ordinal - subtitle.start.ordinal) / 1000.0, 3)))
+
+        slots = [duration for _, _, duration in cues]
+        if soundfiles_path:
+            # 按字幕序号对应已有片段，片段仓库直接内存映射，不需要解码；缺失的片段跳过
+            arrays = load_segments(soundfiles_path, [i for i, _, _ in cues], sample_rate)
+        else:
+            # 相邻短字幕合并为一个请求，语速按可用时长规划，合成后切回每条字幕
+            arrays = await synthesize_cues(texts, [timestamp for _, timestamp, _ in cues], slots, voice, provider=self.tts_provider, concurrency=concurrency, sample_rate=sample_rate)
+            if store_path:
+                try:
+                    count = write_segment_store(store_path, [i for i, _, _ in cues], arrays, sample_rate, texts)
+                    print(f"已保存 {count} 个语音片段: {store_path}")
+                except OSError as e:
+                    print(f"保存语音片段仓库失败: {e}")
+
+        speech_arrays = []
+        timestamps = []
+        durations = []
+        for (_, timestamp, duration), speech in zip(cues, arrays):
+            if speech is not None and len(speech):
+                speech_arrays.append(speech)
+                timestamps.append(timestamp)
+                durations.append(duration)
+        return speech_arrays, timestamps, durations
+
+    async def generate_speech_for_subtitles(self, subtitle_path, output_dir,soundfiles_path=None,concurrency=None):
         """
-        使用edge_tts为中文字幕生成语音
+        使用edge_tts为中文字幕生成语音，多条字幕并发合成
         :param subtitle_path: 字幕文件路径
         :param output_dir: 音频文件输出目录
+        :param concurrency: 同时进行的合成请求数，默认读取settings.json
         :return: 音频文件路径列表和时间戳列表
         """
         print("正在为中文字幕生成语音...")
@@ -328,7 +333,10 @@ class VideoProcessor:
         # 确保音频输出目录存在
         audio_dir = os.path.join(output_dir, "audio_segments")
         os.makedirs(audio_dir, exist_ok=True)
-        
+        # 按字幕顺序记录片段，文本和合成参数相同的片段直接从语音缓存取出
+        segments = []
+        jobs = []
+        existing = []
         for i, subtitle in enumerate(subtitles):
             # 提取中文字幕（假设在第二行）
             lines = subtitle.text.split('\n')
@@ -336,36 +344,42 @@ class VideoProcessor:
             
             # 清理文本
             chinese_text = re.sub(r'<[^>]+>', '', chinese_text).strip()
-            
-            if chinese_text and not soundfiles_path:
-                # 生成音频文件路径
-                audio_file = os.path.join(audio_dir, f"segment_{i:04d}.mp3")
-                for i in range(100):
-                # 使用edge_tts生成语音
-                    try:
-                        await text_to_speech_edge(text=chinese_text, filename=audio_file)
-
-                        #audio_file=index_tts(chinese_text,refer_voice_path=r"C:\Users\wangxingfeng\Music\cangjiao.wav",infer_mode="批次推理")
-                        
-                        if os.path.exists(audio_file):
-                            audio_files.append(audio_file)
-                            timestamps.append(subtitle.start.ordinal / 1000.0)  # 转换为秒
-                            #保留两位小数
-                            durations.append(round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3))
-                            break                            
-                    except Exception as e:
-                        print(f"生成语音失败 for subtitle {i}: {e}")
-                        time.sleep(5)
-            else:
-                timestamps.append(subtitle.start.ordinal / 1000.0)  # 转换为秒
-                #保留两位小数
-                durations.append(round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3))
+            timestamp = subtitle.start.ordinal / 1000.0  # 转换为秒
+            #保留三位小数
+            duration = round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3)
+            
+            if soundfiles_path:
+                existing.append((i, timestamp, duration))
+                continue
+            if not chinese_text:
+                continue
+            # 生成音频文件路径
+            audio_file = os.path.join(audio_dir, f"segment_{i:04d}.wav")
+            segments.append((audio_file, timestamp, duration))
+            jobs.append((chinese_text, audio_file))
+        
+        if jobs:
+            # 与正式混音相同的合并和切分方式，片段进入语音缓存后正式渲染直接复用
+            arrays = await synthesize_cues([text for text, _ in jobs], [timestamp for _, timestamp, _ in segments], [duration for _, _, duration in segments], DEFAULT_VOICE, provider=self.tts_provider, concurrency=concurrency)
+            results = [write_wav(audio_file, speech) if speech is not None and len(speech) else None for (audio_file, _, _), speech in zip(segments, arrays)]
+            # 合成失败的片段连同时间戳一起跳过，保证三个列表一一对应
+            for (audio_file, timestamp, duration), result in zip(segments, results):
+                if result:
+                    audio_files.append(audio_file)
+                    timestamps.append(timestamp)
+                    durations.append(duration)
         if soundfiles_path:
-            audio_files=os.listdir(soundfiles_path)
+            # 按字幕序号对应已有片段（目录或片段仓库），缺失的片段连同时间戳一起跳过
+            files = segment_files(soundfiles_path, [i for i, _, _ in existing], audio_dir)
+            for (_, timestamp, duration), audio_file in zip(existing, files):
+                if audio_file:
+                    audio_files.append(audio_file)
+                    timestamps.append(timestamp)
+                    durations.append(duration)
         
         return audio_files, timestamps,durations
 
-    def process_video(self, video_path, output_dir, add_translation=False, model_size="base", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2,sounds_files=None):
+    def process_video(self, video_path, output_dir, add_translation=False, model_size="base", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2,sounds_files=None,shards=None,smart_render=False,renderer="cv2",preview=False,soft_subtitles=False,container="mp4",tts_provider=None):
         """
         处理视频的主要方法
         :param video_path: 输入视频路径
@@ -377,17 +391,31 @@ class VideoProcessor:
         :param audio_path: 音频文件路径（可选）
         :param skip_subtitle_generation: 是否跳过字幕生成直接使用现有字幕文件
         :param subtitle_file: 现有的字幕文件路径
+        :param shards: 烧录字幕时分段并行渲染的进程数
+        :param smart_render: 烧录字幕时只重新编码包含字幕的片段
+        :param renderer: 字幕渲染方式（"cv2"、"overlay"、"libass"、"auto"）
+        :param preview: 只生成360p低码率预览（复用已有的字幕和语音），用于正式渲染前检查
+        :param soft_subtitles: 以软字幕轨道输出，视频流直接复制不重新编码（优先于burn_subtitles）
+        :param container: 软字幕输出的封装格式（"mp4"使用mov_text，"mkv"使用ASS）
+        :param tts_provider: 语音合成引擎名称，None表示使用settings.json中的tts_provider
         """
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
+        # 本任务使用的语音合成引擎（None表示settings.json中的tts_provider）
+        self.tts_provider = tts_provider
         
         # 获取视频文件名（不含扩展名）
         video_name = os.path.splitext(os.path.basename(video_path))[0]
         
+        cached_subtitle_path = os.path.join(output_dir, f"{video_name}_en-zh.srt" if add_translation else f"{video_name}_en.srt")
         if skip_subtitle_generation and subtitle_file and os.path.exists(subtitle_file):
             # 直接使用提供的字幕文件
             print(f"跳过字幕生成，直接使用字幕文件: {subtitle_file}")
             bilingual_subtitle_path = subtitle_file
+        elif preview and os.path.exists(cached_subtitle_path):
+            # 预览时复用之前生成的转录和翻译结果
+            print(f"预览模式: 复用已有字幕文件: {cached_subtitle_path}")
+            bilingual_subtitle_path = cached_subtitle_path
         else:
             # 转录音频
             transcription_result = self.transcribe_audio(audio_path if audio_path else video_path)
@@ -404,15 +432,24 @@ class VideoProcessor:
             else:
                 bilingual_subtitle_path = english_subtitle_path
 
+        if preview:
+            preview_path = os.path.join(output_dir, f"{video_name}_preview.mp4")
+            self._render_preview(video_path, output_dir, bilingual_subtitle_path, preview_path, burn_subtitles, replace_audio, volume_factor, sounds_files)
+            return preview_path
+
+        # 软字幕只封装字幕轨道，不需要解码和重新编码视频
+        if soft_subtitles:
+            output_video_path = os.path.join(output_dir, f"{video_name}_with_subtitles.{container}")
+            self.mux_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files,language="chi" if add_translation else "eng")
         # 如果需要将字幕烧录到视频中
-        if burn_subtitles and add_translation:
+        elif burn_subtitles and add_translation:
             output_video_path = os.path.join(output_dir, f"{video_name}_with_subtitles.mp4")
             # 使用双语字幕烧录到视频
-            self.burn_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files)
+            self.burn_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files,shards=shards,smart_render=smart_render,renderer=renderer)
         elif burn_subtitles:
             output_video_path = os.path.join(output_dir, f"{video_name}_with_subtitles.mp4")
             # 使用英文字幕烧录到视频
-            self.burn_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files)
+            self.burn_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files,shards=shards,smart_render=smart_render,renderer=renderer)
         elif replace_audio and not burn_subtitles:
             # 如果只需要替换音频而不需要烧录字幕
             self._process_audio_only(video_path, output_dir, bilingual_subtitle_path, audio_path, volume_factor, sounds_files)
@@ -422,6 +459,22 @@ class VideoProcessor:
         print("视频处理完成！")
         return output_video_path
 
+    def _render_preview(self, video_path, output_dir, subtitle_path, preview_path, burn_subtitles, replace_audio, volume_factor, sounds_files):
+        """
+        生成低分辨率预览，配音使用与正式渲染相同的mix_dub混音（时间轴、闪避和响度校正一致）
+        合成的语音片段写入片段仓库，正式渲染时直接复用
+        """
+        dub_audio_path = None
+        if replace_audio:
+            dub_audio_path = os.path.splitext(preview_path)[0] + "_dub_audio.m4a"
+            speech_arrays, timestamps,durations = asyncio.run(self.synthesize_speech(subtitle_path, soundfiles_path=sounds_files, store_path=segment_store_path(subtitle_path)))
+            mix_dub(video_path, speech_arrays, timestamps, durations, dub_audio_path, balance=volume_factor)
+        try:
+            render_preview(video_path, subtitle_path if burn_subtitles else None, preview_path, dub_audio_path)
+        finally:
+            if dub_audio_path and os.path.exists(dub_audio_path):
+                os.remove(dub_audio_path)
+
     def _process_audio_only(self, video_path, output_dir, subtitle_path, audio_path, volume_factor, sounds_files):
         """
         仅处理音频，不烧录字幕
@@ -429,50 +482,14 @@ class VideoProcessor:
         output_video_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(video_path))[0]}_with_audio.mp4")
         print("正在生成并合并语音...")
         # 生成语音片段
-        audio_files, timestamps,durations = asyncio.run(self.generate_speech_for_subtitles(subtitle_path, output_dir,soundfiles_path=sounds_files))
-        
-        # 使用moviepy合并音频
-        original_video = VideoFileClip(video_path)
-        
-        # 创建新的音频轨道 - 保留原始音频，并添加生成的语音
-        new_audio_tracks = []
-        
-        # 添加原始音频（如果存在）
-        if audio_path:
-            # 如果提供了audio_path，使用该音频文件作为原始音频
-            original_audio = AudioFileClip(audio_path)
-            new_audio_tracks.append(original_audio)
-        elif original_video.audio is not None:
-            # 否则使用视频中的原始音频
-            new_audio_tracks.append(original_video.audio)
-        
-        # 添加生成的语音片段
-        for audio_file, timestamp,duration in zip(audio_files, timestamps,durations):
-            if audio_file and os.path.exists(audio_file):
-                speech_clip = AudioFileClip(audio_file)
-                speech_clip = speech_clip.with_speed_scaled(factor=(speech_clip.duration/duration))  # Speed up by 50%
-                speech_clip = speech_clip.with_volume_scaled(volume_factor)
-                speech_clip = speech_clip.with_start(timestamp)
-                new_audio_tracks.append(speech_clip)
-        
-        # 合并音频轨道
-        if new_audio_tracks:
-            final_audio = CompositeAudioClip(new_audio_tracks)
-            final_video = original_video.with_audio(final_audio)
-        else:
-            final_video = original_video
-            
-        final_video.write_videofile(output_video_path, codec="libx264", audio_codec="aac")
-        
-        # 显式关闭视频剪辑以释放资源
-        original_video.close()
-        final_video.close()
-        if 'final_audio' in locals():
-            final_audio.close()
+        speech_arrays, timestamps,durations = asyncio.run(self.synthesize_speech(subtitle_path, soundfiles_path=sounds_files, store_path=segment_store_path(subtitle_path)))
         
-        for track in new_audio_tracks:
-            if hasattr(track, 'close'):
-                track.close()
+        # 以audio_path（未提供时为视频原音轨）为底混入语音，视频流直接复制，不再重新编码
+        final_audio_path = os.path.splitext(output_video_path)[0] + "_final_audio.mp3"
+        mix_dub(video_path, speech_arrays, timestamps, durations, final_audio_path, balance=volume_factor, original_audio_path=audio_path)
+        if not fast_merge_av(video_path, final_audio_path, output_video_path):
+            raise RuntimeError("合并音频和视频失败")
+        os.remove(final_audio_path)
         
         # 清理临时音频文件
         audio_dir = os.path.join(output_dir, "audio_segments")
@@ -480,6 +497,23 @@ class VideoProcessor:
             import shutil
             shutil.rmtree(audio_dir)
 
+    def _load_fonts(self):
+        """
+        加载字幕字体
+        :return: (英文字体, 中文字体)
+        """
+        try:
+            font_en = ImageFont.truetype('arial.ttf', 36)  # 英文字体使用Arial
+            font_zh = ImageFont.truetype('STXINGKA.TTF', 36)  # 中文字体使用黑体
+        except:
+            try:
+                font_en = ImageFont.truetype('DejaVuSans.ttf', 36)  # 备选英文字体
+                font_zh = ImageFont.truetype('uming.ttc', 36)      # 备选中文字体
+            except:
+                font_en = ImageFont.load_default()  # 默认字体
+                font_zh = ImageFont.load_default()
+        return font_en, font_zh
+
     def _pre_render_universal_template(self, width, font_en, font_zh):
         """
         预渲染通用字幕模板，可以用于所有字幕
@@ -665,65 +699,36 @@ class VideoProcessor:
                 
         return current_y
 
-    def _overlay_subtitle_image(self, frame, subtitle_image):
+    def _overlay_subtitle_image(self, frame, subtitle):
         """
-        将预渲染的字幕图像叠加到视频帧上
+        将裁剪后的字幕数组叠加到视频帧上（底部居中）
+        :param frame: BGR视频帧，原地修改
+        :param subtitle: CompactSubtitle
         """
-        try:
-            import cv2
-            import numpy as np
-        except ImportError:
-            return frame
-            
-        frame_height, frame_width = frame.shape[:2]
-        subtitle_height, subtitle_width = subtitle_image.height, subtitle_image.width
+        import numpy as np
         
-        # 计算字幕图像在帧上的位置（底部居中）
-        y_offset = frame_height - subtitle_height - 36  # 距离底部的边距
-        x_offset = (frame_width - subtitle_width) // 2
+        frame_height, frame_width = frame.shape[:2]
         
-        # 确保偏移量不会导致负索引
-        y_offset = max(0, y_offset)
-        x_offset = max(0, x_offset)
+        # 计算完整字幕图像在帧上的位置（底部居中），再加上文字区域的偏移
+        y_offset = max(0, frame_height - subtitle.height - 36) + subtitle.top  # 距离底部的边距
+        x_offset = max(0, (frame_width - subtitle.width) // 2) + subtitle.left
         
         # 确保字幕图像不会超出帧边界
-        end_y = min(y_offset + subtitle_height, frame_height)
-        end_x = min(x_offset + subtitle_width, frame_width)
-        
-        # 调整字幕图像大小以适应帧边界
-        crop_height = end_y - y_offset
-        crop_width = end_x - x_offset
-        
-        # 检查区域大小是否有效
-        if crop_height <= 0 or crop_width <= 0:
+        end_y = min(y_offset + subtitle.array.shape[0], frame_height)
+        end_x = min(x_offset + subtitle.array.shape[1], frame_width)
+        if end_y <= y_offset or end_x <= x_offset:
             return frame
-            
-        cropped_subtitle = subtitle_image.crop((0, 0, crop_width, crop_height))
         
-        # 将PIL图像转换为OpenCV格式
-        subtitle_array = np.array(cropped_subtitle)
+        subtitle_array = subtitle.array[:end_y - y_offset, :end_x - x_offset]
+        alpha = subtitle_array[:, :, 3:4].astype(np.uint16)
+        roi = frame[y_offset:end_y, x_offset:end_x]
         
-        # 检查是否有Alpha通道
-        has_alpha = subtitle_array.shape[2] == 4 if len(subtitle_array.shape) > 2 else False
-        
-        if has_alpha:
-            # 分离BGR和Alpha通道
-            subtitle_bgr = subtitle_array[:, :, :3]
-            alpha_channel = subtitle_array[:, :, 3] / 255.0
-            
-            # 创建ROI
-            roi = frame[y_offset:end_y, x_offset:end_x]
-            
-            # 应用Alpha混合
-            for c in range(3):  # BGR channels
-                roi[:, :, c] = (1.0 - alpha_channel) * roi[:, :, c] + alpha_channel * subtitle_bgr[:, :, 2-c]
-        else:
-            # 没有Alpha通道，直接复制
-            frame[y_offset:end_y, x_offset:end_x] = subtitle_array
-            
+        # 整数Alpha混合: roi = (roi*(255-a) + sub*a) / 255
+        blended = roi.astype(np.uint16) * (255 - alpha) + subtitle_array[:, :, :3].astype(np.uint16) * alpha
+        roi[:] = ((blended + 127) // 255).astype(np.uint8)
         return frame
 
-def simple_process(video_path, output_dir="./output", add_translation=False, model_size="medium", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2.0,soundfiles_path=None):
+def simple_process(video_path, output_dir="./output", add_translation=False, model_size="medium", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2.0,soundfiles_path=None,shards=None,smart_render=False,renderer="cv2",preview=False,soft_subtitles=False,container="mp4",tts_provider=None):
     """
     简单处理函数，直接使用参数而不通过命令行参数
     :param video_path: 输入视频文件路径
@@ -735,6 +740,9 @@ def simple_process(video_path, output_dir="./output", add_translation=False, mod
     :param audio_path: 音频文件路径（可选）
     :param skip_subtitle_generation: 是否跳过字幕生成直接使用现有字幕文件
     :param subtitle_file: 现有的字幕文件路径
+    :param shards: 烧录字幕时分段并行渲染的进程数
+    :param smart_render: 烧录字幕时只重新编码包含字幕的片段
+    :param renderer: 字幕渲染方式（"cv2"、"overlay"、"libass"、"auto"）
     """
     # 检查输入文件是否存在
     if not os.path.exists(video_path):
@@ -757,7 +765,7 @@ def simple_process(video_path, output_dir="./output", add_translation=False, mod
     
     # 创建处理器并处理视频
     processor = VideoProcessor(model_size=model_size)
-    output_video_path=processor.process_video(video_path, output_dir, add_translation, model_size, burn_subtitles, replace_audio, audio_path, skip_subtitle_generation, subtitle_file,volume_factor,soundfiles_path)
+    output_video_path=processor.process_video(video_path, output_dir, add_translation, model_size, burn_subtitles, replace_audio, audio_path, skip_subtitle_generation, subtitle_file,volume_factor,soundfiles_path,shards=shards,smart_render=smart_render,renderer=renderer,preview=preview,soft_subtitles=soft_subtitles,container=container,tts_provider=tts_provider)
     return output_video_path
 
 if __name__ == "__main__":
@@ -1,8 +1,7 @@
 import os
 import whisper
 import pysrt
-from moviepy import VideoFileClip,CompositeAudioClip,AudioFileClip
-from voice import text_to_speech_edge
+from voice import DEFAULT_VOICE
 import time
 import re
 from PIL import Image, ImageDraw
@@ -11,8 +10,20 @@ from translate import chanslater
 from collections import defaultdict
 import subprocess
 import shutil
+import threading
 import numpy as np
+from audio_codec import write_wav, SPEECH_SAMPLE_RATE
+from audio_mix import mix_dub
+from cue_groups import synthesize_cues
+from segment_store import load_segments, reuse_segments, segment_files, segment_store_path, write_segment_store
 from pathlib import Path
+from renderers import render_subtitles
+from smart_render import subtitle_cues
+from tts_providers import get_provider
+from job_manifest import JobManifest, file_digest, inputs_key, partial_path, commit_output
+from combine import mux_soft_subtitles, mux_dual_audio, split_audio_track, mux_original_audio, has_audio_stream
+from preview import render_preview
+from batch_scheduler import BatchJob, STAGES, video_pipeline
 def fast_merge_av(video_path, audio_path, output_path=None):
     """
     快速合并音频视频的优化版本
@@ -26,7 +37,8 @@ def fast_merge_av(video_path, audio_path, output_path=None):
     final_output_path = output_path
     if os.path.abspath(video_path) == os.path.abspath(output_path):
         # 创建临时输出文件路径
-        temp_output = output_path.replace(".mp4", "_temp.mp4")
+        root, ext = os.path.splitext(output_path)
+        temp_output = f"{root}_temp{ext}"
         output_path = temp_output
     
     # 使用硬件加速（如果可用）
@@ -38,6 +50,8 @@ def fast_merge_av(video_path, audio_path, output_path=None):
         '-c:a', 'aac',         # 音频编码为AAC（兼容性好）
         '-map', '0:v:0',       # 选择第一个视频流
         '-map', '1:a:0',       # 选择第二个音频流
+        '-map', '0:s?',        # 保留软字幕轨道（如果有）
+        '-c:s', 'copy',
         '-shortest',
         '-y',
         output_path
@@ -69,14 +83,32 @@ def fast_merge_av(video_path, audio_path, output_path=None):
         print(f"FFmpeg错误: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else str(e)}")
         return None
 
+# 常驻进程中共享的Whisper模型：模型大小 → (模型, 转录锁)
+_SHARED_MODELS = {}
+_SHARED_MODELS_LOCK = threading.Lock()
+
+
 class VideoProcessor:
-    def __init__(self, model_size="base"):
+    def __init__(self, model_size="base", shared_model=False):
         """
         初始化视频处理器
         :param model_size: Whisper模型大小 ("tiny", "base", "small", "medium", "large")
-        """
-        print(f"正在加载Whisper {model_size} 模型...")
-        self.model = whisper.load_model(model_size)
+        :param shared_model: 是否使用进程内共享的模型（常驻进程中多个处理器只加载一次模型，转录依次进行）
+        """
+        # 语音合成引擎，None表示使用settings.json中的tts_provider；process_video按任务设置
+        self.tts_provider = None
+        # 已有片段仓库时是否只重新合成修改过的字幕；process_video按任务设置
+        self.incremental = True
+        if shared_model:
+            with _SHARED_MODELS_LOCK:
+                if model_size not in _SHARED_MODELS:
+                    print(f"正在加载Whisper {model_size} 模型...")
+                    _SHARED_MODELS[model_size] = (whisper.load_model(model_size), threading.Lock())
+                self.model, self._transcribe_lock = _SHARED_MODELS[model_size]
+        else:
+            print(f"正在加载Whisper {model_size} 模型...")
+            self.model = whisper.load_model(model_size)
+            self._transcribe_lock = threading.Lock()
         
     def transcribe_audio(self, video_path, language="en"):
         """
@@ -86,7 +118,8 @@ class VideoProcessor:
         :return: 转录结果
         """
         print("正在转录音频...")
-        result = self.model.transcribe(video_path,temperature=0.3,language=language, verbose=True)
+        with self._transcribe_lock:
+            result = self.model.transcribe(video_path,temperature=0.3,language=language, verbose=True)
         return result
     
     def translate_text(self, text, target_lang="zh"):
@@ -150,13 +183,18 @@ class VideoProcessor:
         millisecs = int((seconds - int(seconds)) * 1000)
         return pysrt.SubRipTime(hours=hours, minutes=minutes, seconds=secs, milliseconds=millisecs)
     
-    def burn_subtitles_to_video(self, video_path, subtitle_path, output_path, replace_audio=False,volume_factor=2,sounds_files=None):
+    def burn_subtitles_to_video(self, video_path, subtitle_path, output_path, replace_audio=False,volume_factor=2,sounds_files=None,shards=None,smart_render=False,renderer="libass",dub_audio_path=None,manifest=None):
         """
         将字幕烧录到视频中，使用FFmpeg提高效率
         :param video_path: 输入视频路径
         :param subtitle_path: 字文件路径
         :param output_path: 输出视频路径
         :param replace_audio: 是否用生成的语音替换原音频
+        :param shards: 分段并行渲染的进程数（None或1表示不分段）
+        :param smart_render: 是否只重新编码包含字幕的片段，其余片段直接复制
+        :param renderer: 渲染后端（"libass"、"cv2"、"overlay"、"auto"），"auto"在双语排版的后端（cv2、overlay）中按本机测速结果选择
+        :param dub_audio_path: 已混好的配音音轨，提供时直接封装，不再合成语音
+        :param manifest: 任务清单（job_manifest.JobManifest），提供时记录渲染时的字幕：字幕没有变化时跳过渲染，修改过时只重新烧录修改的部分
         """
         print("正在将字幕烧录到视频中...")
         
@@ -168,6 +206,57 @@ class VideoProcessor:
             raise ValueError(f"字幕文件不存在: {subtitle_path}")
         
         # 确保字幕文件使用UTF-8编码并标准化格式
+        self._normalize_subtitle_encoding(subtitle_path)
+        
+        # 转换路径为绝对路径并处理特殊字符
+        video_path = os.path.abspath(video_path)
+        subtitle_path = os.path.abspath(subtitle_path)
+        output_path = os.path.abspath(output_path)
+        
+        if manifest is not None:
+            self._burn_incremental(manifest, video_path, subtitle_path, output_path, shards, smart_render, renderer)
+        else:
+            # 按后端渲染（默认按本机测速结果自动选择最快的后端）
+            render_subtitles(video_path, subtitle_path, output_path, renderer=renderer, shards=shards, smart_render=smart_render)
+            print(f"已生成带字幕的视频: {output_path}")
+            if not (replace_audio or dub_audio_path):
+                # 流复制保留原始音频
+                self._merge_original_audio(video_path, output_path)
+        
+        # 处理音频替换
+        # 传递原始路径给音频处理函数，而不是转义后的路径
+        if replace_audio or dub_audio_path:
+            self._replace_audio_with_generated_speech(video_path, subtitle_path, output_path, volume_factor, sounds_files, dub_audio_path)
+        
+        print(f"已完成视频处理: {output_path}")
+
+    def _burn_incremental(self, manifest, video_path, subtitle_path, output_path, shards, smart_render, renderer):
+        """
+        按任务清单烧录字幕：与上一次渲染时的字幕相同则跳过，有修改时以上一次的结果为底只重新烧录修改过的GOP
+        输出先写临时文件再替换，完成后把这次的字幕记入清单
+        渲染结果总是保留原音轨（配音随后封装进_final），流水线和直接调用记录的是同一条渲染，互相可以增量复用
+        """
+        inputs = inputs_key("render", file_digest(video_path), renderer, smart_render)
+        subtitle_digest = file_digest(subtitle_path)
+        previous = manifest.completed("render", inputs)
+        details = manifest.details("render")
+        if previous and previous["video"] == output_path and details.get("subtitle") == subtitle_digest:
+            print(f"字幕没有变化，跳过渲染: {output_path}")
+            return output_path
+        base = (previous["video"], details["cues"]) if previous and details.get("cues") else None
+        temp_path = partial_path(output_path)
+        render_subtitles(video_path, subtitle_path, temp_path, renderer=renderer, shards=shards, smart_render=smart_render, previous=base)
+        self._merge_original_audio(video_path, temp_path)
+        commit_output(temp_path, output_path)
+        print(f"已生成带字幕的视频: {output_path}")
+        manifest.complete("render", inputs, details={"subtitle": subtitle_digest, "cues": subtitle_cues(subtitle_path)}, video=output_path)
+        return output_path
+
+    def _normalize_subtitle_encoding(self, subtitle_path):
+        """
+        确保字幕文件使用UTF-8编码并标准化格式
+        :param subtitle_path: 字幕文件路径
+        """
         try:
             with open(subtitle_path, 'r', encoding='utf-8') as f:
                 subtitle_content = f.read()
@@ -187,126 +276,68 @@ class VideoProcessor:
                     subtitle_content = f.read()
                 with open(subtitle_path, 'w', encoding='utf-8') as f:
                     f.write(subtitle_content)
-        
-        # 转换路径为绝对路径并处理特殊字符
+
+    def mux_subtitles_to_video(self, video_path, subtitle_path, output_path, replace_audio=False,volume_factor=2,sounds_files=None,language="chi",dub_audio_path=None):
+        """
+        以软字幕轨道输出，视频流直接复制不重新编码
+        :param video_path: 输入视频路径
+        :param subtitle_path: 字幕文件路径
+        :param output_path: 输出视频路径（.mp4使用mov_text，.mkv使用ASS）
+        :param replace_audio: 是否用生成的语音替换原音频
+        :param language: 字幕轨道的语言标记
+        :param dub_audio_path: 已混好的配音音轨，提供时直接封装，不再合成语音
+        """
+        print("正在封装软字幕...")
+        if not os.path.exists(video_path):
+            raise ValueError(f"视频文件不存在: {video_path}")
+        if not os.path.exists(subtitle_path):
+            raise ValueError(f"字幕文件不存在: {subtitle_path}")
+        self._normalize_subtitle_encoding(subtitle_path)
+
         video_path = os.path.abspath(video_path)
         subtitle_path = os.path.abspath(subtitle_path)
         output_path = os.path.abspath(output_path)
-        
-        # 处理Windows路径中的特殊字符，使用POSIX路径避免转义问题
-        escaped_subtitle_path = subtitle_path.replace('\\', '/').replace(':', '\\:')
 
-        # 构造FFmpeg命令，强制指定UTF-8编码
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-vf', f"subtitles='{escaped_subtitle_path}':charenc=utf-8:force_style='PrimaryColour=&H00FFFFFF,Outline=1,Shadow=0,BackColour=&H80000000,FontName=STXINGKA.TTF,FontSize=14'",
-            '-y',  # 覆盖输出文件
-            '-strict', '-2',  # 兼容编码
-            output_path
-        ]
-        
-        try:
-            # 执行FFmpeg命令
-            result = subprocess.run(ffmpeg_cmd, capture_output=True)
-            
-            if result.returncode != 0:
-                error_msg = result.stderr.decode('utf-8', errors='ignore')
-                print(f"FFmpeg执行失败: {error_msg}")
-                # 尝试备用方案，使用更简单的样式配置
-                ffmpeg_cmd = [
-                    'ffmpeg',
-                    '-i', video_path,
-                    '-vf', f"subtitles='{escaped_subtitle_path}':charenc=utf-8",
-                    '-y',
-                    '-strict', '-2',
-                    output_path
-                ]
-                result = subprocess.run(ffmpeg_cmd, capture_output=True)
-                
-                if result.returncode != 0:
-                    error_msg = result.stderr.decode('utf-8', errors='ignore')
-                    raise RuntimeError(f"FFmpeg执行失败: {error_msg}")
-                
-            print(f"已生成带字幕的视频: {output_path}")
-        except FileNotFoundError:
-            raise RuntimeError("未找到FFmpeg，请确保FFmpeg已安装并在系统PATH中")
-        except Exception as e:
-            raise RuntimeError(f"烧录字幕时发生错误: {str(e)}")
-        
-        # 处理音频替换
-        # 传递原始路径给音频处理函数，而不是转义后的路径
-        if replace_audio:
-            self._replace_audio_with_generated_speech(video_path, subtitle_path, output_path, volume_factor, sounds_files)
-        else:
-            # 使用moviepy保留原始音频
-            self._merge_original_audio(video_path, output_path)
-        
+        # 原音频随视频一起复制，不需要再单独合并
+        mux_soft_subtitles(video_path, subtitle_path, output_path, language)
+        print(f"已生成带软字幕的视频: {output_path}")
+        if replace_audio or dub_audio_path:
+            self._replace_audio_with_generated_speech(video_path, subtitle_path, output_path, volume_factor, sounds_files, dub_audio_path)
         print(f"已完成视频处理: {output_path}")
 
-    def _replace_audio_with_generated_speech(self, video_path, subtitle_path, output_path, volume_factor, sounds_files):
+    def mix_generated_speech(self, video_path, subtitle_path, dub_audio_path, volume_factor, sounds_files=None, speech=None):
+        """
+        合成字幕语音并与原音轨混音，输出配音音轨
+        :param dub_audio_path: 输出的配音音轨（.m4a）
+        :param speech: 已合成的 (语音数组列表, 时间戳列表, 时长列表)，None表示现在合成
+        :return: 配音音轨路径
+        """
+        if speech is None:
+            speech = asyncio.run(self.synthesize_speech(subtitle_path, soundfiles_path=sounds_files, store_path=segment_store_path(subtitle_path)))
+        speech_arrays, timestamps, durations = speech
+        mix_dub(video_path, speech_arrays, timestamps, durations, dub_audio_path, balance=volume_factor)
+        return dub_audio_path
+
+    def _replace_audio_with_generated_speech(self, video_path, subtitle_path, output_path, volume_factor, sounds_files, dub_audio_path=None):
         """
-        用生成的语音替换原音频
+        用生成的语音替换原音频：输出带配音和原声两条音轨的视频，以及只有原声的版本
+        :param dub_audio_path: 已混好的配音音轨（批量调度时由混音阶段提前生成），None表示现在合成和混音
         """
         print("正在生成并合并语音...")
-        # 初始化变量以便在异常情况下也能清理
-        original_video = None
-        subtitled_video = None
-        final_video = None
-        final_audio = None
-        new_audio_tracks = []
-        
         try:
-            # 生成语音片段
             output_dir = os.path.dirname(output_path)
-            audio_files, timestamps,durations = asyncio.run(self.generate_speech_for_subtitles(subtitle_path, output_dir,soundfiles_path=sounds_files))
-            
-            # 使用moviepy合并音频
-            original_video = VideoFileClip(video_path)
-            subtitled_video = VideoFileClip(output_path)
-            
-            # 创建新的音频轨道 - 保留原始音频，并添加生成的语音
-            new_audio_tracks = [original_video.audio]  # 保留原始音频
-            
-            # 添加生成的语音片段
-            speech_clips = []  # 保存语音剪辑引用以便清理
-            for audio_file, timestamp,duration in zip(audio_files, timestamps,durations):
-                if audio_file and os.path.exists(audio_file):
-                    speech_clip = AudioFileClip(audio_file)
-                    #speech_clip = speech_clip.with_speed_scaled(factor=(speech_clip.duration/duration))
-                    speech_clip = speech_clip.with_speed_scaled(factor=(1.5))
-                    speech_clip = speech_clip.with_volume_scaled(factor=volume_factor)
-                    speech_clip = speech_clip.with_start(timestamp)
-                    new_audio_tracks.append(speech_clip)
-                    speech_clips.append(speech_clip)  # 保存引用以便稍后清理
-            
-            # 合并音频轨道
-            if new_audio_tracks:
-                final_audio = CompositeAudioClip(new_audio_tracks)
-                final_audio_path=output_path.replace(".mp4", "_final_audio.mp3")
-                final_audio.write_audiofile(final_audio_path)
-                final_video_path=output_path.replace(".mp4", "_final.mp4")
-                fast_merge_av(output_path, final_audio_path, final_video_path)
-                
-                # 添加:保存仅有原声的版本
-                original_audio_video_path = output_path.replace(".mp4", "_original_audio.mp4")
-                self._merge_original_audio(video_path, original_audio_video_path)
-            else:
-                fast_merge_av(output_path, None, output_path)
-            
-            # 显式关闭视频剪辑以释放资源
-            if original_video:
-                original_video.close()
-            if subtitled_video:
-                subtitled_video.close()
-            if final_audio:
-                final_audio.close()
-            
-            # 清理音频轨道
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-
+            output_root, output_ext = os.path.splitext(output_path)
+            if dub_audio_path is None:
+                # 生成语音片段并在NumPy缓冲区中混音，直接编码为AAC，封装时不再转码
+                dub_audio_path = self.mix_generated_speech(video_path, subtitle_path, output_root + "_dub_audio.m4a", volume_factor, sounds_files)
+            # 一次FFmpeg封装：视频流直接复制，配音和原声两条音轨
+            final_video_path=output_root + "_final" + output_ext
+            mux_dual_audio(output_path, dub_audio_path, video_path, final_video_path, dub_language="chi", original_language="eng")
+            os.remove(dub_audio_path)
+            
+            # 添加:保存仅有原声的版本，直接从双音轨文件中拆出
+            if has_audio_stream(video_path):
+                split_audio_track(final_video_path, output_root + "_original_audio" + output_ext, 1)
             
             # 清理临时音频文件
             audio_dir = os.path.join(output_dir, "audio_segments")
@@ -314,72 +345,86 @@ class VideoProcessor:
                 shutil.rmtree(audio_dir)
                 
         except Exception as e:
-            # 确保即使出现异常也释放资源
-            if original_video:
-                original_video.close()
-            if subtitled_video:
-                subtitled_video.close()
-            if final_video:
-                final_video.close()
-            if final_audio:
-                final_audio.close()
-            
-            # 清理音频轨道
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-                    
             print(f"警告: 合并音频时出现问题: {e}")
             print("将继续使用原音频版本")
 
     def _merge_original_audio(self, video_path, output_path):
         """
-        合并原始音频到视频
+        合并原始音频到视频，视频流直接复制不重新编码
         """
         print("正在合并原始音频...")
-        # 初始化变量以便在异常情况下也能清理
-        original_video = None
-        subtitled_video = None
-        final_video = None
-        
         try:
-            original_video = VideoFileClip(video_path)
-            subtitled_video = VideoFileClip(output_path)
-            final_video = subtitled_video.with_audio(original_video.audio)
-            final_output_path = output_path.replace(".mp4", "_final.mp4")
-            final_video.write_videofile(final_output_path, codec="libx264", audio_codec="aac",
-                                       preset="ultrafast", threads=8)
-            
-            # 显式关闭视频剪辑以释放资源
-            if original_video:
-                original_video.close()
-            if subtitled_video:
-                subtitled_video.close()
-            if final_video:
-                final_video.close()
-            
-            # 删除临时无音频视频文件
-            time.sleep(1)  # 等待文件句柄释放
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            os.rename(final_output_path, output_path)
+            mux_original_audio(output_path, video_path, output_path)
         except Exception as e:
-            # 确保即使出现异常也释放资源
-            if original_video:
-                original_video.close()
-            if subtitled_video:
-                subtitled_video.close()
-            if final_video:
-                final_video.close()
-                
             print(f"警告: 合并音频时出现问题: {e}")
             print("将继续使用无音频版本")
 
-    async def generate_speech_for_subtitles(self, subtitle_path, output_dir,soundfiles_path=None):
+    async def synthesize_speech(self, subtitle_path, sample_rate=SPEECH_SAMPLE_RATE, soundfiles_path=None, concurrency=None, store_path=None, voice=DEFAULT_VOICE, incremental=None):
+        """
+        为字幕合成语音并直接解码为float32数组，音频只在内存中流转，不写中间文件
+        :param subtitle_path: 字幕文件路径
+        :param sample_rate: 解码采样率，混音时再转换到输出采样率
+        :param soundfiles_path: 已有语音片段：片段仓库文件（.seg）或segment_XXXX.mp3所在目录，提供时不再合成
+        :param concurrency: 同时进行的合成请求数，默认读取settings.json
+        :param store_path: 合成后把全部片段写入这个片段仓库文件，重新混音时可作为soundfiles_path使用
+        :param voice: 音色
+        :param incremental: store_path已有片段时只重新合成文本有变化的字幕，其余片段直接复用；None表示按self.incremental
+        :return: (语音数组列表, 时间戳列表, 时长列表)
+        """
+        print("正在为中文字幕生成语音...")
+        subtitles = pysrt.open(subtitle_path, encoding='utf-8')
+        texts = []
+        cues = []
+        for i, subtitle in enumerate(subtitles):
+            # 提取中文字幕（假设在第二行）并清理文本
+            lines = subtitle.text.split('\n')
+            chinese_text = lines[1] if len(lines) >= 2 else lines[0]
+            chinese_text = re.sub(r'<[^>]+>', '', chinese_text).strip()
+            if chinese_text:
+                texts.append(chinese_text)
+                cues.append((i, subtitle.start.ordinal / 1000.0, round((subtitle.end.ordinal - subtitle.start.ordinal) / 1000.0, 3)))
+
+        slots = [duration for _, _, duration in cues]
+        if soundfiles_path:
+            # 按字幕序号对应已有片段，片段仓库直接内存映射，不需要解码；缺失的片段跳过
+            arrays = load_segments(soundfiles_path, [i for i, _, _ in cues], sample_rate)
+        else:
+            voice_key = f"{get_provider(self.tts_provider).name}:{voice}"
+            if (self.incremental if incremental is None else incremental) and store_path:
+                # 编辑过字幕后重新运行时，文本没有变化的字幕直接使用上一次的片段
+                arrays, pending = reuse_segments(store_path, [i for i, _, _ in cues], texts, voice_key, sample_rate)
+                if len(pending) < len(cues):
+                    print(f"增量合成: 复用 {len(cues) - len(pending)} 条语音片段，重新合成 {len(pending)} 条")
+            else:
+                arrays, pending = [None] * len(cues), list(range(len(cues)))
+            if pending:
+                # 相邻短字幕合并为一个请求，语速按可用时长规划，合成后切回每条字幕
+                synthesized = await synthesize_cues([texts[k] for k in pending], [cues[k][1] for k in pending], [slots[k] for k in pending], voice, provider=self.tts_provider, concurrency=concurrency, sample_rate=sample_rate)
+                for k, speech in zip(pending, synthesized):
+                    arrays[k] = speech
+            if store_path:
+                try:
+                    count = write_segment_store(store_path, [i for i, _, _ in cues], arrays, sample_rate, texts, voice_key)
+                    print(f"已保存 {count} 个语音片段: {store_path}")
+                except OSError as e:
+                    print(f"保存语音片段仓库失败: {e}")
+
+        speech_arrays = []
+        timestamps = []
+        durations = []
+        for (_, timestamp, duration), speech in zip(cues, arrays):
+            if speech is not None and len(speech):
+                speech_arrays.append(speech)
+                timestamps.append(timestamp)
+                durations.append(duration)
+        return speech_arrays, timestamps, durations
+
+    async def generate_speech_for_subtitles(self, subtitle_path, output_dir,soundfiles_path=None,concurrency=None):
         """
-        使用edge_tts为中文字幕生成语音
+        使用edge_tts为中文字幕生成语音，多条字幕并发合成
         :param subtitle_path: 字幕文件路径
         :param output_dir: 音频文件输出目录
+        :param concurrency: 同时进行的合成请求数，默认读取settings.json
         :return: 音频文件路径列表和时间戳列表
         """
         print("正在为中文字幕生成语音...")
@@ -392,7 +437,10 @@ class VideoProcessor:
         # 确保音频输出目录存在
         audio_dir = os.path.join(output_dir, "audio_segments")
         os.makedirs(audio_dir, exist_ok=True)
-        
+        # 按字幕顺序记录片段，文本和合成参数相同的片段直接从语音缓存取出
+        segments = []
+        jobs = []
+        existing = []
         for i, subtitle in enumerate(subtitles):
             # 提取中文字幕（假设在第二行）
             lines = subtitle.text.split('\n')
@@ -400,36 +448,42 @@ class VideoProcessor:
             
             # 清理文本
             chinese_text = re.sub(r'<[^>]+>', '', chinese_text).strip()
-            
-            if chinese_text and not soundfiles_path:
-                # 生成音频文件路径
-                audio_file = os.path.join(audio_dir, f"segment_{i:04d}.mp3")
-                for attempt in range(100):
-                # 使用edge_tts生成语音
-                    try:
-                        await text_to_speech_edge(text=chinese_text, filename=audio_file)
-
-                        #audio_file=index_tts(chinese_text,refer_voice_path=r"C:\Users\wangxingfeng\Music\cangjiao.wav",infer_mode="批次推理")
-                        
-                        if os.path.exists(audio_file):
-                            audio_files.append(audio_file)
-                            timestamps.append(subtitle.start.ordinal / 1000.0)  # 转换为秒
-                            #保留两位小数
-                            durations.append(round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3))
-                            break                            
-                    except Exception as e:
-                        print(f"生成语音失败 for subtitle {i}: {e}")
-                        time.sleep(5)
-            else:
-                timestamps.append(subtitle.start.ordinal / 1000.0)  # 转换为秒
-                #保留两位小数
-                durations.append(round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3))
+            timestamp = subtitle.start.ordinal / 1000.0  # 转换为秒
+            #保留三位小数
+            duration = round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3)
+            
+            if soundfiles_path:
+                existing.append((i, timestamp, duration))
+                continue
+            if not chinese_text:
+                continue
+            # 生成音频文件路径
+            audio_file = os.path.join(audio_dir, f"segment_{i:04d}.wav")
+            segments.append((audio_file, timestamp, duration))
+            jobs.append((chinese_text, audio_file))
+        
+        if jobs:
+            # 与正式混音相同的合并和切分方式，片段进入语音缓存后正式渲染直接复用
+            arrays = await synthesize_cues([text for text, _ in jobs], [timestamp for _, timestamp, _ in segments], [duration for _, _, duration in segments], DEFAULT_VOICE, provider=self.tts_provider, concurrency=concurrency)
+            results = [write_wav(audio_file, speech) if speech is not None and len(speech) else None for (audio_file, _, _), speech in zip(segments, arrays)]
+            # 合成失败的片段连同时间戳一起跳过，保证三个列表一一对应
+            for (audio_file, timestamp, duration), result in zip(segments, results):
+                if result:
+                    audio_files.append(audio_file)
+                    timestamps.append(timestamp)
+                    durations.append(duration)
         if soundfiles_path:
-            audio_files=os.listdir(soundfiles_path)
+            # 按字幕序号对应已有片段（目录或片段仓库），缺失的片段连同时间戳一起跳过
+            files = segment_files(soundfiles_path, [i for i, _, _ in existing], audio_dir)
+            for (_, timestamp, duration), audio_file in zip(existing, files):
+                if audio_file:
+                    audio_files.append(audio_file)
+                    timestamps.append(timestamp)
+                    durations.append(duration)
         
         return audio_files, timestamps,durations
 
-    def process_video(self, video_path, output_dir, add_translation=False, model_size="base", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2,sounds_files=None):
+    def process_video(self, video_path, output_dir, add_translation=False, model_size="base", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2,sounds_files=None,shards=None,smart_render=False,renderer="libass",preview=False,soft_subtitles=False,container="mp4",tts_provider=None,incremental=True):
         """
         处理视频的主要方法
         :param video_path: 输入视频路径
@@ -441,17 +495,42 @@ class VideoProcessor:
         :param audio_path: 音频文件路径（可选）
         :param skip_subtitle_generation: 是否跳过字幕生成直接使用现有字幕文件
         :param subtitle_file: 现有的字幕文件路径
+        :param shards: 烧录字幕时分段并行渲染的进程数
+        :param smart_render: 烧录字幕时只重新编码包含字幕的片段
+        :param renderer: 字幕渲染后端（"libass"、"cv2"、"overlay"、"auto"）
+        :param preview: 只生成360p低码率预览（复用已有的字幕和语音），用于正式渲染前检查
+        :param soft_subtitles: 以软字幕轨道输出，视频流直接复制不重新编码（优先于burn_subtitles）
+        :param container: 软字幕输出的封装格式（"mp4"使用mov_text，"mkv"使用ASS）
+        :param tts_provider: 语音合成引擎名称，None表示使用settings.json中的tts_provider
+        :param incremental: 修改字幕后重新运行时只重新合成修改过的字幕语音、只重新烧录修改过的部分；
+                            重新运行时跳过任务清单中已完成的阶段（不重新转录，不覆盖手动修改过的字幕）
         """
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
+        # 本任务使用的语音合成引擎（None表示settings.json中的tts_provider）
+        self.tts_provider = tts_provider
+        self.incremental = incremental
+
+        # 从视频本身开始的正式处理走单任务流水线，各阶段都记入任务清单
+        if not preview and not skip_subtitle_generation and not audio_path and not sounds_files:
+            return self._process_pipeline(
+                video_path, output_dir, model_size=model_size, add_translation=add_translation, burn_subtitles=burn_subtitles,
+                replace_audio=replace_audio, volume_factor=volume_factor, shards=shards, smart_render=smart_render, renderer=renderer,
+                soft_subtitles=soft_subtitles, container=container, tts_provider=tts_provider, resume=incremental
+            )
         
         # 获取视频文件名（不含扩展名）
         video_name = os.path.splitext(os.path.basename(video_path))[0]
         
+        cached_subtitle_path = os.path.join(output_dir, f"{video_name}_en-zh.srt" if add_translation else f"{video_name}_en.srt")
         if skip_subtitle_generation and subtitle_file and os.path.exists(subtitle_file):
             # 直接使用提供的字幕文件
             print(f"跳过字幕生成，直接使用字幕文件: {subtitle_file}")
             bilingual_subtitle_path = subtitle_file
+        elif preview and os.path.exists(cached_subtitle_path):
+            # 预览时复用之前生成的转录和翻译结果
+            print(f"预览模式: 复用已有字幕文件: {cached_subtitle_path}")
+            bilingual_subtitle_path = cached_subtitle_path
         else:
             # 转录音频
             transcription_result = self.transcribe_audio(audio_path if audio_path else video_path)
@@ -468,18 +547,29 @@ class VideoProcessor:
             else:
                 bilingual_subtitle_path = english_subtitle_path
 
+        if preview:
+            preview_path = os.path.join(output_dir, f"{video_name}_preview.mp4")
+            self._render_preview(video_path, output_dir, bilingual_subtitle_path, preview_path, burn_subtitles, replace_audio, volume_factor, sounds_files)
+            return preview_path
+
         # 初始化输出视频路径
         output_video_path = os.path.join(output_dir, f"{video_name}_with_subtitles.mp4")
+        # 任务清单记录上一次渲染时的字幕，编辑字幕后重新运行时据此增量渲染
+        manifest = JobManifest.for_video(video_path, output_dir) if incremental else None
 
+        # 软字幕只封装字幕轨道，不需要解码和重新编码视频
+        if soft_subtitles:
+            output_video_path = os.path.join(output_dir, f"{video_name}_with_subtitles.{container}")
+            self.mux_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files,language="chi" if add_translation else "eng")
         # 如果需要将字幕烧录到视频中
-        if burn_subtitles and add_translation:
+        elif burn_subtitles and add_translation:
             output_video_path = os.path.join(output_dir, f"{video_name}_with_subtitles.mp4")
             # 使用双语字幕烧录到视频
-            self.burn_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files)
+            self.burn_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files,shards=shards,smart_render=smart_render,renderer=renderer,manifest=manifest)
         elif burn_subtitles:
             output_video_path = os.path.join(output_dir, f"{video_name}_with_subtitles.mp4")
             # 使用英文字幕烧录到视频
-            self.burn_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files)
+            self.burn_subtitles_to_video(video_path, bilingual_subtitle_path, output_video_path, replace_audio,volume_factor,sounds_files,shards=shards,smart_render=smart_render,renderer=renderer,manifest=manifest)
         elif replace_audio and not burn_subtitles:
             # 如果只需要替换音频而不需要烧录字幕
             self._process_audio_only(video_path, output_dir, bilingual_subtitle_path, audio_path, volume_factor, sounds_files)
@@ -489,91 +579,55 @@ class VideoProcessor:
         print("视频处理完成！")
         return output_video_path
 
+    def _process_pipeline(self, video_path, output_dir, **options):
+        """
+        用批量处理的流水线处理单个视频（复用本处理器已加载的模型）
+        转录、翻译、语音合成、混音、渲染、封装的结果记入 <输出目录>/<视频名>.job.json，重新运行时跳过输入没有变化的阶段
+        :param options: 传给batch_scheduler.video_pipeline的处理参数
+        :return: 输出文件路径
+        """
+        pipeline = video_pipeline(output_dir, workers={stage: 1 for stage in STAGES}, report_interval=None, processor=self, **options)
+        job, = pipeline.run([BatchJob(video_path, output_dir)])
+        if not job.ok:
+            raise job.error
+        print("视频处理完成！")
+        return job.output_path
+
+    def _render_preview(self, video_path, output_dir, subtitle_path, preview_path, burn_subtitles, replace_audio, volume_factor, sounds_files):
+        """
+        生成低分辨率预览，配音使用与正式渲染相同的mix_dub混音（时间轴、闪避和响度校正一致）
+        合成的语音片段写入片段仓库，正式渲染时直接复用
+        """
+        dub_audio_path = None
+        if replace_audio:
+            dub_audio_path = os.path.splitext(preview_path)[0] + "_dub_audio.m4a"
+            self.mix_generated_speech(video_path, subtitle_path, dub_audio_path, volume_factor, sounds_files)
+        try:
+            render_preview(video_path, subtitle_path if burn_subtitles else None, preview_path, dub_audio_path)
+        finally:
+            if dub_audio_path and os.path.exists(dub_audio_path):
+                os.remove(dub_audio_path)
+
     def _process_audio_only(self, video_path, output_dir, subtitle_path, audio_path, volume_factor, sounds_files):
         """
         仅处理音频，不烧录字幕
         """
         output_video_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(video_path))[0]}_with_audio.mp4")
         print("正在生成并合并语音...")
-        # 初始化变量以便在异常情况下也能清理
-        original_video = None
-        final_video = None
-        final_audio = None
-        new_audio_tracks = []
+        # 生成语音片段
+        speech_arrays, timestamps,durations = asyncio.run(self.synthesize_speech(subtitle_path, soundfiles_path=sounds_files, store_path=segment_store_path(subtitle_path)))
         
-        try:
-            # 生成语音片段
-            audio_files, timestamps,durations = asyncio.run(self.generate_speech_for_subtitles(subtitle_path, output_dir,soundfiles_path=sounds_files))
-            
-            # 使用moviepy合并音频
-            original_video = VideoFileClip(video_path)
-            
-            # 创建新的音频轨道 - 保留原始音频，并添加生成的语音
-            new_audio_tracks = []
-            
-            # 添加原始音频（如果存在）
-            if audio_path:
-                # 如果提供了audio_path，使用该音频文件作为原始音频
-                original_audio = AudioFileClip(audio_path)
-                new_audio_tracks.append(original_audio)
-            elif original_video.audio is not None:
-                # 否则使用视频中的原始音频
-                new_audio_tracks.append(original_video.audio)
-            
-            # 添加生成的语音片段
-            speech_clips = []  # 保存语音剪辑引用以便清理
-            for audio_file, timestamp,duration in zip(audio_files, timestamps,durations):
-                if audio_file and os.path.exists(audio_file):
-                    speech_clip = AudioFileClip(audio_file)
-                    #speech_clip = speech_clip.with_speed_scaled(factor=(speech_clip.duration/duration))  # Speed up by 50%
-                    speech_clip = speech_clip.with_speed_scaled(factor=(1.5))
-                    speech_clip = speech_clip.with_volume_scaled(volume_factor)
-                    speech_clip = speech_clip.with_start(timestamp)
-                    new_audio_tracks.append(speech_clip)
-                    speech_clips.append(speech_clip)  # 保存引用以便稍后清理
-            
-            # 合并音频轨道
-            if new_audio_tracks:
-                final_audio = CompositeAudioClip(new_audio_tracks)
-                final_video = original_video.with_audio(final_audio)
-            else:
-                final_video = original_video
-                
-            final_video.write_videofile(output_video_path, codec="libx264", audio_codec="aac", 
-                                       preset="ultrafast", threads=8)
-            
-            # 显式关闭视频剪辑以释放资源
-            if original_video:
-                original_video.close()
-            if final_video:
-                final_video.close()
-            if final_audio:
-                final_audio.close()
-            
-            # 清理音频轨道
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-            
-            # 清理临时音频文件
-            audio_dir = os.path.join(output_dir, "audio_segments")
-            if os.path.exists(audio_dir):
-                shutil.rmtree(audio_dir)
-        except Exception as e:
-            # 确保即使出现异常也释放资源
-            if original_video:
-                original_video.close()
-            if final_video:
-                final_video.close()
-            if final_audio:
-                final_audio.close()
-            
-            # 清理音频轨道
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-                    
-            print(f"警告: 处理音频时出现问题: {e}")
+        # 以audio_path（未提供时为视频原音轨）为底混入语音，视频流直接复制，不再重新编码
+        final_audio_path = os.path.splitext(output_video_path)[0] + "_final_audio.mp3"
+        mix_dub(video_path, speech_arrays, timestamps, durations, final_audio_path, balance=volume_factor, original_audio_path=audio_path)
+        if not fast_merge_av(video_path, final_audio_path, output_video_path):
+            raise RuntimeError("合并音频和视频失败")
+        os.remove(final_audio_path)
+        
+        # 清理临时音频文件
+        audio_dir = os.path.join(output_dir, "audio_segments")
+        if os.path.exists(audio_dir):
+            shutil.rmtree(audio_dir)
 
     def _pre_render_universal_template(self, width, font_en, font_zh):
         """
@@ -812,7 +866,7 @@ class VideoProcessor:
             
         return frame
 
-def simple_process(video_path, output_dir="./output", add_translation=False, model_size="medium", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2.0,soundfiles_path=None):
+def simple_process(video_path, output_dir="./output", add_translation=False, model_size="medium", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2.0,soundfiles_path=None,shards=None,smart_render=False,renderer="libass",preview=False,soft_subtitles=False,container="mp4",tts_provider=None,incremental=True):
     """
     简单处理函数，直接使用参数而不通过命令行参数
     :param video_path: 输入视频文件路径
@@ -824,6 +878,13 @@ def simple_process(video_path, output_dir="./output", add_translation=False, mod
     :param audio_path: 音频文件路径（可选）
     :param skip_subtitle_generation: 是否跳过字幕生成直接使用现有字幕文件
     :param subtitle_file: 现有的字幕文件路径
+    :param shards: 烧录字幕时分段并行渲染的进程数
+    :param smart_render: 烧录字幕时只重新编码包含字幕的片段
+    :param renderer: 字幕渲染后端（"libass"、"cv2"、"overlay"、"auto"）
+    :param preview: 只生成360p低码率预览
+    :param soft_subtitles: 以软字幕轨道输出，不重新编码视频
+    :param container: 软字幕输出的封装格式（"mp4"或"mkv"）
+    :param incremental: 修改字幕后重新运行时只处理修改过的字幕
     """
     # 检查输入文件是否存在
     if not os.path.exists(video_path):
@@ -846,7 +907,7 @@ def simple_process(video_path, output_dir="./output", add_translation=False, mod
     
     # 创建处理器并处理视频
     processor = VideoProcessor(model_size=model_size)
-    output_video_path=processor.process_video(video_path, output_dir, add_translation, model_size, burn_subtitles, replace_audio, audio_path, skip_subtitle_generation, subtitle_file,volume_factor,soundfiles_path)
+    output_video_path=processor.process_video(video_path, output_dir, add_translation, model_size, burn_subtitles, replace_audio, audio_path, skip_subtitle_generation, subtitle_file,volume_factor,soundfiles_path,shards=shards,smart_render=smart_render,renderer=renderer,preview=preview,soft_subtitles=soft_subtitles,container=container,tts_provider=tts_provider,incremental=incremental)
     return output_video_path
 
 if __name__ == "__main__":
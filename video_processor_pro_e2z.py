@@ -2,11 +2,7 @@ import os
 import argparse
 import whisper
 import pysrt
-from voice import index_tts
-from moviepy import VideoFileClip,CompositeAudioClip,AudioFileClip
-from voice import text_to_speech_edge
 import cv2
-import time
 import re
 from PIL import Image, ImageDraw, ImageFont
 import asyncio
@@ -15,6 +11,11 @@ from collections import defaultdict
 import subprocess
 import shutil
 import numpy as np
+from audio_codec import write_wav, SPEECH_SAMPLE_RATE
+from audio_mix import mix_dub
+from cue_groups import synthesize_cues
+from segment_store import load_segments, segment_files, segment_store_path, write_segment_store
+from combine import mux_dual_audio, mux_original_audio
 from pathlib import Path
 def fast_merge_av(video_path, audio_path, output_path=None):
     """
@@ -78,6 +79,8 @@ class VideoProcessor:
         初始化视频处理器
         :param model_size: Whisper模型大小 ("tiny", "base", "small", "medium", "large")
         """
+        # 语音合成引擎，None表示使用settings.json中的tts_provider；process_video按任务设置
+        self.tts_provider = None
         print(f"正在加载Whisper {model_size} 模型...")
         self.model = whisper.load_model(model_size)
         
@@ -236,69 +239,30 @@ class VideoProcessor:
         if replace_audio:
             self._replace_audio_with_generated_speech(video_path, subtitle_path, output_path, volume_factor, sounds_files)
         else:
-            # 使用moviepy保留原始音频
+            # 流复制保留原始音频
             self._merge_original_audio(video_path, output_path)
         
         print(f"已完成视频处理: {output_path}")
 
     def _replace_audio_with_generated_speech(self, video_path, subtitle_path, output_path, volume_factor, sounds_files):
         """
-        用生成的语音替换原音频
+        用生成的语音替换原音频，原声作为第二条音轨保留
         """
         print("正在生成并合并语音...")
-        # 初始化变量以便在异常情况下也能清理
-        original_video = None
-        subtitled_video = None
-        final_video = None
-        final_audio = None
-        new_audio_tracks = []
-        
         try:
             # 生成语音片段
             output_dir = os.path.dirname(output_path)
-            audio_files, timestamps,durations = asyncio.run(self.generate_speech_for_subtitles(subtitle_path, output_dir,soundfiles_path=sounds_files))
-            
-            # 使用moviepy合并音频
-            original_video = VideoFileClip(video_path)
-            subtitled_video = VideoFileClip(output_path)
-            
-            # 创建新的音频轨道 - 保留原始音频，并添加生成的语音
-            new_audio_tracks = [original_video.audio]  # 保留原始音频
-            
-            # 添加生成的语音片段
-            speech_clips = []  # 保存语音剪辑引用以便清理
-            for audio_file, timestamp,duration in zip(audio_files, timestamps,durations):
-                if audio_file and os.path.exists(audio_file):
-                    speech_clip = AudioFileClip(audio_file)
-                    speech_clip = speech_clip.with_speed_scaled(factor=(speech_clip.duration/duration))
-                    speech_clip = speech_clip.with_volume_scaled(factor=volume_factor)
-                    speech_clip = speech_clip.with_start(timestamp)
-                    new_audio_tracks.append(speech_clip)
-                    speech_clips.append(speech_clip)  # 保存引用以便稍后清理
-            
-            # 合并音频轨道
-            if new_audio_tracks:
-                final_audio = CompositeAudioClip(new_audio_tracks)
-                final_audio_path=output_path.replace(".mp4", "_final_audio.mp3")
-                final_audio.write_audiofile(final_audio_path)
-                final_video_path=output_path.replace(".mp4", "_final.mp4")
-                fast_merge_av(output_path, final_audio_path, output_path)
-            else:
-                fast_merge_av(output_path, None, output_path)
-            
-            # 显式关闭视频剪辑以释放资源
-            if original_video:
-                original_video.close()
-            if subtitled_video:
-                subtitled_video.close()
-            if final_audio:
-                final_audio.close()
-            
-            # 清理音频轨道
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-
+            speech_arrays, timestamps,durations = asyncio.run(self.synthesize_speech(subtitle_path, soundfiles_path=sounds_files, store_path=segment_store_path(subtitle_path)))
+            
+            # 在NumPy缓冲区中混音，直接编码为AAC，封装时不再转码
+            output_root, output_ext = os.path.splitext(output_path)
+            dub_audio_path=output_root + "_dub_audio.m4a"
+            mix_dub(video_path, speech_arrays, timestamps, durations, dub_audio_path, balance=volume_factor)
+            # 一次FFmpeg封装：视频流直接复制，配音和原声两条音轨
+            temp_output_path=output_root + "_temp" + output_ext
+            mux_dual_audio(output_path, dub_audio_path, video_path, temp_output_path, dub_language="eng", original_language="chi")
+            os.replace(temp_output_path, output_path)
+            os.remove(dub_audio_path)
             
             # 清理临时音频文件
             audio_dir = os.path.join(output_dir, "audio_segments")
@@ -306,72 +270,74 @@ class VideoProcessor:
                 shutil.rmtree(audio_dir)
                 
         except Exception as e:
-            # 确保即使出现异常也释放资源
-            if original_video:
-                original_video.close()
-            if subtitled_video:
-                subtitled_video.close()
-            if final_video:
-                final_video.close()
-            if final_audio:
-                final_audio.close()
-            
-            # 清理音频轨道
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-                    
             print(f"警告: 合并音频时出现问题: {e}")
             print("将继续使用原音频版本")
 
     def _merge_original_audio(self, video_path, output_path):
         """
-        合并原始音频到视频
+        合并原始音频到视频，视频流直接复制不重新编码
         """
         print("正在合并原始音频...")
-        # 初始化变量以便在异常情况下也能清理
-        original_video = None
-        subtitled_video = None
-        final_video = None
-        
         try:
-            original_video = VideoFileClip(video_path)
-            subtitled_video = VideoFileClip(output_path)
-            final_video = subtitled_video.with_audio(original_video.audio)
-            final_output_path = output_path.replace(".mp4", "_final.mp4")
-            final_video.write_videofile(final_output_path, codec="libx264", audio_codec="aac",
-                                       preset="ultrafast", threads=8)
-            
-            # 显式关闭视频剪辑以释放资源
-            if original_video:
-                original_video.close()
-            if subtitled_video:
-                subtitled_video.close()
-            if final_video:
-                final_video.close()
-            
-            # 删除临时无音频视频文件
-            time.sleep(1)  # 等待文件句柄释放
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            os.rename(final_output_path, output_path)
+            mux_original_audio(output_path, video_path, output_path)
         except Exception as e:
-            # 确保即使出现异常也释放资源
-            if original_video:
-                original_video.close()
-            if subtitled_video:
-                subtitled_video.close()
-            if final_video:
-                final_video.close()
-                
             print(f"警告: 合并音频时出现问题: {e}")
             print("将继续使用无音频版本")
 
-    async def generate_speech_for_subtitles(self, subtitle_path, output_dir,soundfiles_path=None):
+    async def synthesize_speech(self, subtitle_path, sample_rate=SPEECH_SAMPLE_RATE, soundfiles_path=None, concurrency=None, store_path=None, voice="en-CA-LiamNeural"):
         """
-        使用edge_tts为中文字幕生成语音
+        为字幕合成语音并直接解码为float32数组，音频只在内存中流转，不写中间文件
+        :param subtitle_path: 字幕文件路径
+        :param sample_rate: 解码采样率，混音时再转换到输出采样率
+        :param soundfiles_path: 已有语音片段：片段仓库文件（.seg）或segment_XXXX.mp3所在目录，提供时不再合成
+        :param concurrency: 同时进行的合成请求数，默认读取settings.json
+        :param store_path: 合成后把全部片段写入这个片段仓库文件，重新混音时可作为soundfiles_path使用
+        :param voice: 音色
+        :return: (语音数组列表, 时间戳列表, 时长列表)
+        """
+        print("正在为中文字幕生成语音...")
+        subtitles = pysrt.open(subtitle_path, encoding='utf-8')
+        texts = []
+        cues = []
+        for i, subtitle in enumerate(subtitles):
+            # 提取中文字幕（假设在第二行）并清理文本
+            lines = subtitle.text.split('\n')
+            chinese_text = lines[1] if len(lines) >= 2 else lines[0]
+            chinese_text = re.sub(r'<[^>]+>', '', chinese_text).strip()
+            if chinese_text:
+                texts.append(chinese_text)
+                cues.append((i, subtitle.start.ordinal / 1000.0, round((subtitle.end.ordinal - subtitle.start.ordinal) / 1000.0, 3)))
+
+        slots = [duration for _, _, duration in cues]
+        if soundfiles_path:
+            # 按字幕序号对应已有片段，片段仓库直接内存映射，不需要解码；缺失的片段跳过
+            arrays = load_segments(soundfiles_path, [i for i, _, _ in cues], sample_rate)
+        else:
+            # 相邻短字幕合并为一个请求，语速按可用时长规划，合成后切回每条字幕
+            arrays = await synthesize_cues(texts, [timestamp for _, timestamp, _ in cues], slots, voice, provider=self.tts_provider, concurrency=concurrency, sample_rate=sample_rate)
+            if store_path:
+                try:
+                    count = write_segment_store(store_path, [i for i, _, _ in cues], arrays, sample_rate, texts)
+                    print(f"已保存 {count} 个语音片段: {store_path}")
+                except OSError as e:
+                    print(f"保存语音片段仓库失败: {e}")
+
+        speech_arrays = []
+        timestamps = []
+        durations = []
+        for (_, timestamp, duration), speech in zip(cues, arrays):
+            if speech is not None and len(speech):
+                speech_arrays.append(speech)
+                timestamps.append(timestamp)
+                durations.append(duration)
+        return speech_arrays, timestamps, durations
+
+    async def generate_speech_for_subtitles(self, subtitle_path, output_dir,soundfiles_path=None,concurrency=None):
+        """
+        使用edge_tts为中文字幕生成语音，多条字幕并发合成
         :param subtitle_path: 字幕文件路径
         :param output_dir: 音频文件输出目录
+        :param concurrency: 同时进行的合成请求数，默认读取settings.json
         :return: 音频文件路径列表和时间戳列表
         """
         print("正在为中文字幕生成语音...")
@@ -385,6 +351,9 @@ class VideoProcessor:
         audio_dir = os.path.join(output_dir, "audio_segments")
         os.makedirs(audio_dir, exist_ok=True)
         
+        segments = []
+        jobs = []
+        existing = []
         for i, subtitle in enumerate(subtitles):
             # 提取中文字幕（假设在第二行）
             lines = subtitle.text.split('\n')
@@ -392,36 +361,40 @@ class VideoProcessor:
             
             # 清理文本
             chinese_text = re.sub(r'<[^>]+>', '', chinese_text).strip()
+            timestamp = subtitle.start.ordinal / 1000.0  # 转换为秒
+            #保留三位小数
+            duration = round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3)
             
-            if chinese_text and not soundfiles_path:
+            if soundfiles_path:
+                existing.append((i, timestamp, duration))
+            elif chinese_text:
                 # 生成音频文件路径
-                audio_file = os.path.join(audio_dir, f"segment_{i:04d}.mp3")
-                for attempt in range(100):
-                # 使用edge_tts生成语音
-                    try:
-                        await text_to_speech_edge(text=chinese_text, filename=audio_file,voice="en-CA-LiamNeural")
-
-                        #audio_file=index_tts(chinese_text,refer_voice_path=r"C:\Users\wangxingfeng\Music\cangjiao.wav",infer_mode="批次推理")
-                        
-                        if os.path.exists(audio_file):
-                            audio_files.append(audio_file)
-                            timestamps.append(subtitle.start.ordinal / 1000.0)  # 转换为秒
-                            #保留两位小数
-                            durations.append(round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3))
-                            break                            
-                    except Exception as e:
-                        print(f"生成语音失败 for subtitle {i}: {e}")
-                        time.sleep(5)
-            else:
-                timestamps.append(subtitle.start.ordinal / 1000.0)  # 转换为秒
-                #保留两位小数
-                durations.append(round((subtitle.end.ordinal / 1000.0 - subtitle.start.ordinal / 1000.0),3))
+                audio_file = os.path.join(audio_dir, f"segment_{i:04d}.wav")
+                segments.append((audio_file, timestamp, duration))
+                jobs.append((chinese_text, audio_file))
+        
+        if jobs:
+            # 并发合成，结果与字幕顺序一致；失败的片段连同时间戳一起跳过
+            # 与正式混音相同的合并和切分方式，片段进入语音缓存后正式渲染直接复用
+            arrays = await synthesize_cues([text for text, _ in jobs], [timestamp for _, timestamp, _ in segments], [duration for _, _, duration in segments], "en-CA-LiamNeural", provider=self.tts_provider, concurrency=concurrency)
+            results = [write_wav(audio_file, speech) if speech is not None and len(speech) else None for (audio_file, _, _), speech in zip(segments, arrays)]
+            for (audio_file, timestamp, duration), result in zip(segments, results):
+                if result:
+                    audio_files.append(audio_file)
+                    timestamps.append(timestamp)
+                    durations.append(duration)
         if soundfiles_path:
-            audio_files=os.listdir(soundfiles_path)
+            # 按字幕序号对应已有片段（目录或片段仓库），缺失的片段连同时间戳一起跳过
+            files = segment_files(soundfiles_path, [i for i, _, _ in existing], audio_dir)
+            for (_, timestamp, duration), audio_file in zip(existing, files):
+                if audio_file:
+                    audio_files.append(audio_file)
+                    timestamps.append(timestamp)
+                    durations.append(duration)
         
         return audio_files, timestamps,durations
 
-    def process_video(self, video_path, output_dir, add_translation=False, model_size="base", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2,sounds_files=None):
+    def process_video(self, video_path, output_dir, add_translation=False, model_size="base", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2,sounds_files=None,tts_provider=None):
         """
         处理视频的主要方法
         :param video_path: 输入视频路径
@@ -433,9 +406,12 @@ class VideoProcessor:
         :param audio_path: 音频文件路径（可选）
         :param skip_subtitle_generation: 是否跳过字幕生成直接使用现有字幕文件
         :param subtitle_file: 现有的字幕文件路径
+        :param tts_provider: 语音合成引擎名称，None表示使用settings.json中的tts_provider
         """
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
+        # 本任务使用的语音合成引擎（None表示settings.json中的tts_provider）
+        self.tts_provider = tts_provider
         
         # 获取视频文件名（不含扩展名）
         video_name = os.path.splitext(os.path.basename(video_path))[0]
@@ -487,84 +463,20 @@ class VideoProcessor:
         """
         output_video_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(video_path))[0]}_with_audio.mp4")
         print("正在生成并合并语音...")
-        # 初始化变量以便在异常情况下也能清理
-        original_video = None
-        final_video = None
-        final_audio = None
-        new_audio_tracks = []
+        # 生成语音片段
+        speech_arrays, timestamps,durations = asyncio.run(self.synthesize_speech(subtitle_path, soundfiles_path=sounds_files, store_path=segment_store_path(subtitle_path)))
         
-        try:
-            # 生成语音片段
-            audio_files, timestamps,durations = asyncio.run(self.generate_speech_for_subtitles(subtitle_path, output_dir,soundfiles_path=sounds_files))
-            
-            # 使用moviepy合并音频
-            original_video = VideoFileClip(video_path)
-            
-            # 创建新的音频轨道 - 保留原始音频，并添加生成的语音
-            new_audio_tracks = []
-            
-            # 添加原始音频（如果存在）
-            if audio_path:
-                # 如果提供了audio_path，使用该音频文件作为原始音频
-                original_audio = AudioFileClip(audio_path)
-                new_audio_tracks.append(original_audio)
-            elif original_video.audio is not None:
-                # 否则使用视频中的原始音频
-                new_audio_tracks.append(original_video.audio)
-            
-            # 添加生成的语音片段
-            speech_clips = []  # 保存语音剪辑引用以便清理
-            for audio_file, timestamp,duration in zip(audio_files, timestamps,durations):
-                if audio_file and os.path.exists(audio_file):
-                    speech_clip = AudioFileClip(audio_file)
-                    speech_clip = speech_clip.with_speed_scaled(factor=(speech_clip.duration/duration))  # Speed up by 50%
-                    speech_clip = speech_clip.with_volume_scaled(volume_factor)
-                    speech_clip = speech_clip.with_start(timestamp)
-                    new_audio_tracks.append(speech_clip)
-                    speech_clips.append(speech_clip)  # 保存引用以便稍后清理
-            
-            # 合并音频轨道
-            if new_audio_tracks:
-                final_audio = CompositeAudioClip(new_audio_tracks)
-                final_video = original_video.with_audio(final_audio)
-            else:
-                final_video = original_video
-                
-            final_video.write_videofile(output_video_path, codec="libx264", audio_codec="aac", 
-                                       preset="ultrafast", threads=8)
-            
-            # 显式关闭视频剪辑以释放资源
-            if original_video:
-                original_video.close()
-            if final_video:
-                final_video.close()
-            if final_audio:
-                final_audio.close()
-            
-            # 清理音频轨道
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-            
-            # 清理临时音频文件
-            audio_dir = os.path.join(output_dir, "audio_segments")
-            if os.path.exists(audio_dir):
-                shutil.rmtree(audio_dir)
-        except Exception as e:
-            # 确保即使出现异常也释放资源
-            if original_video:
-                original_video.close()
-            if final_video:
-                final_video.close()
-            if final_audio:
-                final_audio.close()
-            
-            # 清理音频轨道
-            for track in new_audio_tracks:
-                if hasattr(track, 'close'):
-                    track.close()
-                    
-            print(f"警告: 处理音频时出现问题: {e}")
+        # 以audio_path（未提供时为视频原音轨）为底混入语音，视频流直接复制，不再重新编码
+        final_audio_path = os.path.splitext(output_video_path)[0] + "_final_audio.mp3"
+        mix_dub(video_path, speech_arrays, timestamps, durations, final_audio_path, balance=volume_factor, original_audio_path=audio_path)
+        if not fast_merge_av(video_path, final_audio_path, output_video_path):
+            raise RuntimeError("合并音频和视频失败")
+        os.remove(final_audio_path)
+        
+        # 清理临时音频文件
+        audio_dir = os.path.join(output_dir, "audio_segments")
+        if os.path.exists(audio_dir):
+            shutil.rmtree(audio_dir)
 
     def _pre_render_universal_template(self, width, font_en, font_zh):
         """
@@ -803,7 +715,7 @@ class VideoProcessor:
             
         return frame
 
-def simple_process(video_path, output_dir="./output", add_translation=False, model_size="medium", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2.0,soundfiles_path=None):
+def simple_process(video_path, output_dir="./output", add_translation=False, model_size="medium", burn_subtitles=False, replace_audio=False, audio_path=None, skip_subtitle_generation=False, subtitle_file=None,volume_factor=2.0,soundfiles_path=None,tts_provider=None):
     """
     简单处理函数，直接使用参数而不通过命令行参数
     :param video_path: 输入视频文件路径
@@ -837,7 +749,7 @@ def simple_process(video_path, output_dir="./output", add_translation=False, mod
     
     # 创建处理器并处理视频
     processor = VideoProcessor(model_size=model_size)
-    output_video_path=processor.process_video(video_path, output_dir, add_translation, model_size, burn_subtitles, replace_audio, audio_path, skip_subtitle_generation, subtitle_file,volume_factor,soundfiles_path)
+    output_video_path=processor.process_video(video_path, output_dir, add_translation, model_size, burn_subtitles, replace_audio, audio_path, skip_subtitle_generation, subtitle_file,volume_factor,soundfiles_path,tts_provider=tts_provider)
     return output_video_path
 
 if __name__ == "__main__":
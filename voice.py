@@ -1,10 +1,25 @@
 import edge_tts
 import asyncio
+import json
+import time
+import random
+from tts_cache import TTSCache, get_tts_cache, tts_cache_key
+from audio_codec import attach_boundaries
+
+# 语音合成的默认配置，可以在settings.json中用同名小写键覆盖
+TTS_CONCURRENCY = 8     # 同时进行的合成请求数
+TTS_TIMEOUT = 30        # 单条合成的超时（秒）
+TTS_RETRIES = 8         # 单条合成的最大尝试次数
+TTS_PROVIDER = "edge"   # 合成引擎，可选值见tts_providers.available_providers()
+# edge-tts的默认合成参数，同时用于计算缓存键
+DEFAULT_VOICE = "zh-CN-YunxiNeural"
+DEFAULT_RATE = "+50%"
+DEFAULT_VOLUME = "+200%"
 async def text_to_speech_edge(
     text: str,
-    voice: str = "zh-CN-YunxiNeural",
-    rate: str = "+50%",
-    volume: str = "+200%",
+    voice: str = DEFAULT_VOICE,
+    rate: str = DEFAULT_RATE,
+    volume: str = DEFAULT_VOLUME,
     filename: str = None
 ) -> str:
     """
@@ -39,6 +54,241 @@ async def text_to_speech_edge(
             
     except Exception as e:
         raise RuntimeError(f"Edge TTS failed: {str(e)}") from e
+async def text_to_speech_edge_bytes(text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE, volume=DEFAULT_VOLUME, boundaries=False, **kwargs):
+    """
+    把edge-tts流式返回的音频块收集在内存中，不写文件
+    :param text: 文本
+    :param voice: 音色
+    :param rate: 语速
+    :param volume: 音量
+    :param boundaries: 是否同时收集逐词时间（WordBoundary事件），写入MP3的ID3标签，见audio_codec.read_boundaries
+    :return: MP3数据
+    """
+    if not text or not isinstance(text, str):
+        raise ValueError("Input text must be a non-empty string")
+    chunks = []
+    words = []
+    try:
+        if boundaries:
+            try:
+                communicate = edge_tts.Communicate(text, voice, rate=rate, volume=volume, boundary="WordBoundary")
+            except TypeError:
+                # 旧版edge-tts没有boundary参数，默认就发送WordBoundary事件
+                communicate = edge_tts.Communicate(text, voice, rate=rate, volume=volume)
+        else:
+            communicate = edge_tts.Communicate(text, voice, rate=rate, volume=volume)
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                chunks.append(chunk["data"])
+            elif chunk["type"] == "WordBoundary":
+                # offset和duration的单位是100纳秒
+                words.append((chunk["offset"] / 1e7, chunk["duration"] / 1e7, chunk["text"]))
+    except Exception as e:
+        raise RuntimeError(f"Edge TTS failed: {str(e)}") from e
+    if not chunks:
+        raise RuntimeError("Edge TTS returned no audio")
+    if boundaries and words:
+        return attach_boundaries(b"".join(chunks), words)
+    return b"".join(chunks)
+def load_tts_settings(path="settings.json"):
+    """
+    读取settings.json中的语音合成配置，缺少的项使用默认值
+    :param path: 配置文件路径
+    :return: 包含tts_concurrency、tts_timeout、tts_retries、tts_provider的字典
+    """
+    settings = {
+        "tts_concurrency": TTS_CONCURRENCY,
+        "tts_timeout": TTS_TIMEOUT,
+        "tts_retries": TTS_RETRIES,
+        "tts_provider": TTS_PROVIDER,
+    }
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return settings
+    for key in settings:
+        if key in config:
+            settings[key] = config[key]
+    return settings
+
+
+class TTSStats:
+    """
+    批量合成的请求延迟统计
+    """
+    def __init__(self):
+        self.latencies = []
+        self.retries = 0
+        self.failures = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, seconds):
+        self.latencies.append(seconds)
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def report(self, concurrency):
+        """
+        打印吞吐和延迟分布
+        """
+        count = len(self.latencies)
+        throughput = count / self.elapsed if self.elapsed > 0 else 0.0
+        mean = sum(self.latencies) / count if count else 0.0
+        print(f"语音合成完成: {count} 条, 用时 {self.elapsed:.1f} 秒, {throughput:.2f} 条/秒 (并发 {concurrency}), "
+              f"延迟 平均 {mean:.2f}s / P50 {self.percentile(50):.2f}s / P95 {self.percentile(95):.2f}s / "
+              f"最大 {max(self.latencies, default=0.0):.2f}s, 重试 {self.retries}, 失败 {self.failures}")
+
+
+async def synthesize_clips(texts, synthesize=None, concurrency=None, timeout=None, retries=None, backoff=1.0, max_backoff=30.0, cache=None, provider=None, rates=None, **kwargs):
+    """
+    并发合成多条语音，结果以音频数据的形式留在内存中，用信号量限制同时进行的请求数
+    :param texts: 文本列表
+    :param synthesize: 合成协程 synthesize(text=..., **kwargs)，返回音频数据；提供时不使用provider
+    :param concurrency: 最大并发数（批量引擎为同时进行的批数），默认读取settings.json
+    :param timeout: 单条合成超时（秒），默认读取settings.json
+    :param retries: 单条合成的最大尝试次数，默认读取settings.json
+    :param backoff: 第一次重试前的等待时间（秒），之后按指数增长
+    :param max_backoff: 单次等待时间上限（秒）
+    :param cache: TTSCache，默认使用settings.json配置的共享缓存，传False关闭缓存
+    :param provider: 合成引擎名称或tts_providers.TTSProvider，默认读取settings.json的tts_provider；
+                     名称参与缓存键计算，不同引擎的结果不会混用
+    :param rates: 每条文本单独的语速（如duration_planner.plan_rates的结果），覆盖kwargs中的rate
+    :param kwargs: 传给合成函数的其他参数（如voice、rate）
+    :return: (与texts顺序一致的音频数据列表，失败为None, TTSStats)
+    """
+    settings = load_tts_settings()
+    engine = None
+    if synthesize is None:
+        from tts_providers import get_provider
+        engine = get_provider(provider or settings["tts_provider"])
+        synthesize = engine.synthesize
+        provider = engine.name
+    provider = provider if isinstance(provider, str) else getattr(provider, "name", "edge")
+    concurrency = max(1, int(concurrency or settings["tts_concurrency"]))
+    timeout = timeout or settings["tts_timeout"]
+    retries = max(1, int(retries or settings["tts_retries"]))
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = TTSStats()
+    voice = kwargs.get("voice", DEFAULT_VOICE)
+    rate = kwargs.get("rate", DEFAULT_RATE)
+    volume = kwargs.get("volume", DEFAULT_VOLUME)
+
+    async def run(index, text):
+        options = dict(kwargs, rate=rates[index]) if rates is not None else kwargs
+        for attempt in range(retries):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    data = await asyncio.wait_for(synthesize(text=text, **options), timeout)
+                    if data:
+                        stats.add(time.perf_counter() - started)
+                        return data
+                    error = "没有返回音频数据"
+                except asyncio.TimeoutError:
+                    error = f"超过 {timeout} 秒未完成"
+                except Exception as e:
+                    error = e
+            print(f"生成语音失败 for subtitle {index} (第 {attempt + 1}/{retries} 次): {error}")
+            if attempt + 1 == retries:
+                break
+            stats.retries += 1
+            # 在信号量外等待，不占用并发名额；加随机抖动避免所有请求同时重试
+            delay = min(max_backoff, backoff * 2 ** attempt)
+            await asyncio.sleep(delay * (0.5 + random.random() / 2))
+        stats.failures += 1
+        return None
+
+    async def run_batch(indices):
+        # 批量引擎一次合成多条，整批失败或个别缺失的条目再逐条重试
+        results = [None] * len(indices)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                results = await asyncio.wait_for(engine.synthesize_many(
+                    [texts[i] for i in indices], voice=voice,
+                    rates=[rates[i] if rates is not None else rate for i in indices], volume=volume
+                ), timeout * len(indices))
+                elapsed = time.perf_counter() - started
+                for data in results:
+                    if data:
+                        stats.add(elapsed / len(indices))
+            except asyncio.TimeoutError:
+                print(f"批量合成 {len(indices)} 条超过 {timeout * len(indices)} 秒未完成")
+            except Exception as e:
+                print(f"批量合成 {len(indices)} 条失败: {e}")
+        missing = [k for k, data in enumerate(results) if not data]
+        retried = await asyncio.gather(*(run(indices[k], texts[indices[k]]) for k in missing))
+        for k, data in zip(missing, retried):
+            results[k] = data
+        return results
+
+    async def synthesize_indices(indices):
+        if engine is None or engine.batch_size <= 1:
+            return list(await asyncio.gather(*(run(i, texts[i]) for i in indices)))
+        size = engine.batch_size
+        batches = await asyncio.gather(*(run_batch(indices[k:k + size]) for k in range(0, len(indices), size)))
+        return [data for batch in batches for data in batch]
+
+    if cache is False:
+        results = await synthesize_indices(list(range(len(texts))))
+        stats.finish()
+        stats.report(concurrency)
+        return results, stats
+
+    cache = cache if isinstance(cache, TTSCache) else get_tts_cache()
+    keys = [tts_cache_key(text, voice, rates[i] if rates is not None else rate, volume, provider) for i, text in enumerate(texts)]
+    # 同一批内文本相同的片段只合成一次
+    clips = {}
+    pending = []
+    for i, key in enumerate(keys):
+        if key in clips:
+            continue
+        clips[key] = cache.get(key)
+        if clips[key] is None:
+            pending.append(i)
+    hits = len(clips) - len(pending)
+
+    outputs = await synthesize_indices(pending)
+    for i, data in zip(pending, outputs):
+        clips[keys[i]] = data
+        if data:
+            cache.put(keys[i], data)
+    stats.finish()
+    print(f"语音缓存: 共 {len(texts)} 条, 批内重复 {len(texts) - len(clips)} 条, 缓存命中 {hits} 条, 实际合成 {len(pending)} 条 ({provider})")
+    cache.report()
+    stats.report(concurrency)
+    return [clips[key] for key in keys], stats
+
+
+async def synthesize_batch(jobs, synthesize=None, **kwargs):
+    """
+    并发合成多条语音并保存为文件（供需要文件路径的FFmpeg滤镜使用）
+    :param jobs: [(文本, 输出文件路径), ...]
+    :param synthesize: 合成协程，返回音频数据
+    :param kwargs: 传给synthesize_clips的其他参数（如provider、voice、rates）
+    :return: (与jobs顺序一致的结果列表，成功为文件路径、失败为None, TTSStats)
+    """
+    clips, stats = await synthesize_clips([text for text, _ in jobs], synthesize=synthesize, **kwargs)
+    results = []
+    for (_, filename), data in zip(jobs, clips):
+        if data is None:
+            results.append(None)
+            continue
+        with open(filename, 'wb') as f:
+            f.write(data)
+        results.append(filename)
+    return results, stats
+
+
 async def get_chinese_voices_list():
     voice_list = await edge_tts.list_voices()
     # Filter for Chinese voices
@@ -0,0 +1,505 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import secrets
+import argparse
+import threading
+import subprocess
+import socketserver
+from uuid import uuid4
+
+# 常驻进程的地址、日志放在用户目录下
+STATE_DIR = os.path.join(os.path.expanduser("~"), ".youtube_mover")
+ADDRESS_PATH = os.path.join(STATE_DIR, "worker.json")
+SOCKET_PATH = os.path.join(STATE_DIR, "worker.sock")
+LOG_PATH = os.path.join(STATE_DIR, "worker.log")
+# 启动常驻进程后等待其开始监听的最长时间（秒）
+START_TIMEOUT = 30.0
+# 连接和单次读写的超时（秒）；等待任务结束时不设超时
+CONNECT_TIMEOUT = 2.0
+# 任务结束（成功或失败）的事件，收到后连接关闭
+FINAL_EVENTS = ("done", "error", "bye")
+# 保留的已结束任务记录数，更早的记录在登记新任务时删除
+KEEP_FINISHED_JOBS = 200
+
+
+def _write_private(path, data):
+    """
+    写入只有当前用户可读的JSON文件（先写临时文件再替换）
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+class WorkerDaemon:
+    """
+    常驻的处理进程：Whisper模型、翻译客户端、语音合成引擎只加载一次，任务通过本地套接字提交
+    流水线任务（submit）按处理参数复用已启动的流水线；单个视频（process）在一个工作线程中依次处理
+    每个任务的阶段进度以事件的形式推送给订阅的连接
+    """
+    def __init__(self, preload=None):
+        """
+        :param preload: 启动后在后台预先加载的Whisper模型大小，None表示第一个任务时再加载
+        """
+        self.preload = preload
+        self.jobs = {}
+        self._subscribers = {}
+        self._pipelines = {}
+        self._processors = {}
+        # self._lock只保护上面的字典，加载模型、创建流水线等耗时操作使用各自的锁，不阻塞事件推送和状态查询
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._single = queue.Queue()
+        self.started = time.time()
+
+    def start(self):
+        threading.Thread(target=self._single_loop, daemon=True).start()
+        if self.preload:
+            threading.Thread(target=self.processor, args=(self.preload,), daemon=True).start()
+        return self
+
+    def processor(self, model_size):
+        """
+        :return: 单个视频任务使用的处理器，同一模型大小只创建一次
+        """
+        from video_processor_pro import VideoProcessor
+        with self._build_lock(("processor", model_size)):
+            with self._lock:
+                processor = self._processors.get(model_size)
+            if processor is None:
+                processor = VideoProcessor(model_size=model_size, shared_model=True)
+                with self._lock:
+                    self._processors[model_size] = processor
+            return processor
+
+    def pipeline(self, output_dir, options):
+        """
+        :return: 与处理参数对应的流水线，第一次使用时创建并启动，之后一直复用
+        """
+        from batch_scheduler import video_pipeline
+        key = json.dumps([os.path.abspath(output_dir), options], sort_keys=True)
+        # 同一参数的流水线只创建和启动一次，同时到达的提交等待第一个创建完成
+        with self._build_lock(("pipeline", key)):
+            with self._lock:
+                pipeline = self._pipelines.get(key)
+            if pipeline is None:
+                pipeline = video_pipeline(output_dir, on_done=self._job_done, on_stage=self._job_stage, shared_model=True, **options).start()
+                with self._lock:
+                    self._pipelines[key] = pipeline
+            return pipeline
+
+    def _build_lock(self, key):
+        """
+        :return: 创建某个处理器或流水线时使用的锁
+        """
+        with self._lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def _register(self, kind, video_path):
+        job_id = uuid4().hex[:12]
+        record = {"job": job_id, "kind": kind, "video": video_path, "status": "queued", "stage": None,
+                  "output": None, "error": None, "submitted": time.time()}
+        with self._lock:
+            finished = [key for key, job in self.jobs.items() if job["status"] in ("done", "failed")]
+            for key in finished[:max(0, len(finished) - KEEP_FINISHED_JOBS)]:
+                del self.jobs[key]
+                self._subscribers.pop(key, None)
+            self.jobs[job_id] = record
+            self._subscribers[job_id] = []
+        return job_id
+
+    def subscribe(self, job_id):
+        """
+        :return: 接收该任务事件的队列；任务已经结束时直接放入结束事件
+        """
+        events = queue.Queue()
+        with self._lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                events.put({"event": "error", "job": job_id, "error": "任务不存在"})
+            elif record["status"] in ("done", "failed"):
+                events.put(self._final_event(record))
+            else:
+                self._subscribers[job_id].append(events)
+        return events
+
+    def publish(self, job_id, event, **fields):
+        with self._lock:
+            record = self.jobs[job_id]
+            record.update(fields)
+            subscribers = list(self._subscribers.get(job_id, ()))
+            if record["status"] in ("done", "failed"):
+                self._subscribers[job_id] = []
+        payload = self._final_event(record) if event == "done" else dict({"event": event, "job": job_id}, **fields)
+        for events in subscribers:
+            events.put(payload)
+
+    @staticmethod
+    def _final_event(record):
+        return {"event": "done", "job": record["job"], "ok": record["status"] == "done", "output": record["output"], "error": record["error"]}
+
+    def submit(self, video_path, output_dir, options):
+        """
+        提交到流水线
+        :return: 任务编号
+        """
+        from batch_scheduler import BatchJob
+        job_id = self._register("pipeline", video_path)
+        job = BatchJob(video_path, output_dir)
+        job.daemon_id = job_id
+        self.pipeline(output_dir, options).submit(job)
+        return job_id
+
+    def process(self, video_path, output_dir, options):
+        """
+        单个视频按video_processor_pro.process_video处理（支持跳过字幕生成、预览等参数）
+        :return: 任务编号
+        """
+        job_id = self._register("process", video_path)
+        self._single.put((job_id, video_path, output_dir, options))
+        return job_id
+
+    def _job_stage(self, job, stage, state, seconds):
+        job_id = getattr(job, "daemon_id", None)
+        if job_id:
+            self.publish(job_id, "stage", status="running", stage=stage, state=state, seconds=round(seconds, 3))
+
+    def _job_done(self, job):
+        job_id = getattr(job, "daemon_id", None)
+        if job_id:
+            error = f"{job.failed_stage}: {job.error}" if job.error is not None else None
+            self.publish(job_id, "done", status="done" if job.ok else "failed", output=job.output_path, error=error)
+
+    def _single_loop(self):
+        while True:
+            job_id, video_path, output_dir, options = self._single.get()
+            options = dict(options)
+            model_size = options.pop("model_size", "medium")
+            self.publish(job_id, "stage", status="running", stage="process", state="start", seconds=0.0)
+            started = time.perf_counter()
+            try:
+                # 与simple_process相同的检查
+                if options.get("skip_subtitle_generation") and not (options.get("subtitle_file") and os.path.exists(options["subtitle_file"])):
+                    raise ValueError("跳过字幕生成时必须提供存在的字幕文件")
+                output = self.processor(model_size).process_video(video_path, output_dir, model_size=model_size, **options)
+                self.publish(job_id, "done", status="done" if output else "failed", output=output,
+                             error=None if output else f"处理失败，请查看日志: {LOG_PATH}")
+            except Exception as e:
+                self.publish(job_id, "done", status="failed", output=None, error=str(e))
+            print(f"单个视频处理结束: {video_path}, 用时 {time.perf_counter() - started:.0f} 秒")
+
+    def status(self):
+        with self._lock:
+            jobs = [dict(record) for record in self.jobs.values()]
+            pipelines = len(self._pipelines)
+            models = list(self._processors)
+        return {"event": "status", "pid": os.getpid(), "uptime": round(time.time() - self.started), "pipelines": pipelines,
+                "models": models, "jobs": jobs}
+
+    def handle(self, request):
+        """
+        处理一个请求，逐个返回要发送的事件
+        """
+        command = request.get("cmd")
+        if command == "ping":
+            yield {"event": "pong", "pid": os.getpid()}
+        elif command in ("submit", "process"):
+            video_path = request.get("video")
+            if not video_path or not os.path.exists(video_path):
+                yield {"event": "error", "error": f"视频文件不存在: {video_path}"}
+                return
+            output_dir = request.get("output_dir") or "./output"
+            options = request.get("options") or {}
+            job_id = (self.submit if command == "submit" else self.process)(video_path, output_dir, options)
+            # 先订阅再返回accepted，不会错过很快结束的任务的事件
+            events = self.subscribe(job_id) if request.get("wait", True) else None
+            yield {"event": "accepted", "job": job_id}
+            while events is not None:
+                event = events.get()
+                yield event
+                if event["event"] in FINAL_EVENTS:
+                    break
+        elif command == "watch":
+            events = self.subscribe(request.get("job"))
+            while True:
+                event = events.get()
+                yield event
+                if event["event"] in FINAL_EVENTS:
+                    break
+        elif command == "status":
+            yield self.status()
+        elif command == "shutdown":
+            yield {"event": "bye"}
+        else:
+            yield {"event": "error", "error": f"未知的命令: {command}"}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    每个连接一个请求：一行JSON请求，返回若干行JSON事件，结束后关闭连接
+    """
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError:
+            self._send({"event": "error", "error": "请求不是有效的JSON"})
+            return
+        if not secrets.compare_digest(str(request.get("token", "")), self.server.token):
+            self._send({"event": "error", "error": "令牌不正确"})
+            return
+        try:
+            for event in self.server.worker.handle(request):
+                self._send(event)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（如GUI关闭），任务继续在常驻进程中处理
+            return
+        if request.get("cmd") == "shutdown":
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def _send(self, event):
+        self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+def serve(preload=None, port=0):
+    """
+    启动常驻进程并一直运行：有Unix域套接字时监听 ~/.youtube_mover/worker.sock，否则（Windows）监听127.0.0.1
+    地址和访问令牌写入 ~/.youtube_mover/worker.json（只有当前用户可读），客户端据此连接
+    :param preload: 启动后预先加载的Whisper模型大小
+    :param port: 没有Unix域套接字时监听的端口，0表示自动选择
+    """
+    token = secrets.token_hex(16)
+    if hasattr(socket, "AF_UNIX"):
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+        os.makedirs(STATE_DIR, exist_ok=True)
+        server = socketserver.ThreadingUnixStreamServer(SOCKET_PATH, _Handler)
+        os.chmod(SOCKET_PATH, 0o600)
+        address = {"family": "unix", "path": SOCKET_PATH}
+    else:
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", port), _Handler)
+        address = {"family": "tcp", "host": "127.0.0.1", "port": server.server_address[1]}
+    server.daemon_threads = True
+    server.token = token
+    server.worker = WorkerDaemon(preload=preload).start()
+    _write_private(ADDRESS_PATH, dict(address, token=token, pid=os.getpid()))
+    print(f"常驻进程已启动（PID {os.getpid()}），监听: {address.get('path') or address.get('port')}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if address["family"] == "unix" and os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+        print("常驻进程已退出")
+
+
+class DaemonClient:
+    """
+    常驻进程的客户端：不导入torch、whisper等重量级模块，提交任务只需要一次本地连接
+    """
+    def __init__(self, address=None):
+        """
+        :param address: serve写入的地址信息，默认读取 ~/.youtube_mover/worker.json
+        """
+        if address is None:
+            with open(ADDRESS_PATH, "r", encoding="utf-8") as f:
+                address = json.load(f)
+        self.address = address
+
+    def _connect(self):
+        if self.address["family"] == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            target = self.address["path"]
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            target = (self.address["host"], self.address["port"])
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(target)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def request(self, command, wait_forever=False, **fields):
+        """
+        发送一个请求并逐个返回事件，连接关闭时结束
+        :param command: 命令（ping、submit、process、watch、status、shutdown）
+        :param wait_forever: 是否一直等待事件（等待任务结束时为True）
+        """
+        sock = self._connect()
+        try:
+            payload = dict(fields, cmd=command, token=self.address.get("token", ""))
+            sock.sendall((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+            if wait_forever:
+                sock.settimeout(None)
+            with sock.makefile("r", encoding="utf-8") as reader:
+                for line in reader:
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            sock.close()
+
+    def ping(self):
+        """
+        :return: 常驻进程是否在运行
+        """
+        try:
+            return any(event.get("event") == "pong" for event in self.request("ping"))
+        except (OSError, ValueError):
+            return False
+
+    def submit(self, video_path, output_dir, on_event=None, wait=True, mode="submit", **options):
+        """
+        提交任务
+        :param video_path: 视频路径（常驻进程按绝对路径读取）
+        :param output_dir: 输出目录
+        :param on_event: 收到事件时的回调 on_event(event)
+        :param wait: 是否等到任务结束
+        :param mode: "submit"进入流水线，"process"按process_video单独处理
+        :param options: 处理参数（与video_pipeline或process_video的参数一致）
+        :return: 等待时返回结束事件 {"ok", "output", "error"}，否则返回accepted事件
+        """
+        last = None
+        for event in self.request(mode, wait_forever=wait, video=os.path.abspath(video_path), output_dir=os.path.abspath(output_dir),
+                                  options=options, wait=wait):
+            if on_event:
+                on_event(event)
+            last = event
+        if last is None:
+            raise ConnectionError("常驻进程没有响应")
+        if last["event"] == "error":
+            raise RuntimeError(last["error"])
+        return last
+
+    def run_many(self, video_paths, output_dir, on_event=None, **options):
+        """
+        把多个视频提交到流水线，同时接收各任务的事件，等待全部结束
+        :return: 与video_paths顺序一致的结束事件列表
+        """
+        accepted = [self.submit(video_path, output_dir, wait=False, **options) for video_path in video_paths]
+        results = [None] * len(accepted)
+
+        def watch(index, job_id):
+            try:
+                for event in self.request("watch", wait_forever=True, job=job_id):
+                    if on_event:
+                        on_event(event)
+                    results[index] = event
+            except OSError as e:
+                results[index] = {"event": "done", "job": job_id, "ok": False, "output": None, "error": str(e)}
+
+        threads = [threading.Thread(target=watch, args=(index, event["job"]), daemon=True) for index, event in enumerate(accepted)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def status(self):
+        return next(self.request("status"))
+
+    def shutdown(self):
+        return list(self.request("shutdown"))
+
+
+def connect(start=True, preload=None, timeout=START_TIMEOUT):
+    """
+    连接常驻进程，没有运行时在后台启动一个
+    :param start: 没有运行时是否启动
+    :param preload: 启动时预先加载的Whisper模型大小
+    :param timeout: 等待启动的最长时间（秒）
+    :return: DaemonClient，无法连接时返回None
+    """
+    try:
+        client = DaemonClient()
+        if client.ping():
+            return client
+    except (OSError, ValueError, KeyError):
+        pass
+    if not start:
+        return None
+    spawn(preload)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        try:
+            client = DaemonClient()
+            if client.ping():
+                return client
+        except (OSError, ValueError, KeyError):
+            continue
+    print(f"常驻进程没有在 {timeout:.0f} 秒内启动，请查看日志: {LOG_PATH}")
+    return None
+
+
+def spawn(preload=None):
+    """
+    在后台启动常驻进程（工作目录为本脚本所在目录，以便读取settings.json），输出写入日志
+    """
+    os.makedirs(STATE_DIR, exist_ok=True)
+    command = [sys.executable, os.path.abspath(__file__), "serve"]
+    if preload:
+        command += ["--preload", preload]
+    options = {}
+    if os.name == "nt":
+        options["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        options["start_new_session"] = True
+    with open(LOG_PATH, "a", encoding="utf-8") as log:
+        subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), stdin=subprocess.DEVNULL, stdout=log,
+                         stderr=subprocess.STDOUT, env=dict(os.environ, PYTHONUNBUFFERED="1"), **options)
+
+
+def use_daemon(path="settings.json"):
+    """
+    :return: settings.json中的worker_daemon是否开启（默认关闭：常驻进程不会自动退出，需要时手动开启）
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return bool(json.load(f).get("worker_daemon", False))
+    except (OSError, ValueError):
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻处理进程：模型只加载一次，通过本地套接字接收任务")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="启动常驻进程（前台运行）")
+    serve_parser.add_argument("--preload", default=None, help="预先加载的Whisper模型大小")
+    serve_parser.add_argument("--port", type=int, default=0, help="没有Unix域套接字时监听的端口")
+    submit_parser = sub.add_parser("submit", help="提交视频并等待处理结束")
+    submit_parser.add_argument("videos", nargs="+", help="视频文件")
+    submit_parser.add_argument("--output-dir", default="./output", help="输出目录")
+    submit_parser.add_argument("--options", default="{}", help="处理参数（JSON）")
+    sub.add_parser("status", help="查看常驻进程和任务状态")
+    sub.add_parser("stop", help="停止常驻进程")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.preload, args.port)
+    elif args.command == "submit":
+        client = connect()
+        if client is None:
+            sys.exit(1)
+        for video in args.videos:
+            result = client.submit(video, args.output_dir, wait=False, **json.loads(args.options))
+            print(f"已提交: {video} (任务 {result['job']})")
+    elif args.command == "status":
+        client = connect(start=False)
+        print(json.dumps(client.status(), ensure_ascii=False, indent=2) if client else "常驻进程没有运行")
+    elif args.command == "stop":
+        client = connect(start=False)
+        if client:
+            client.shutdown()
+        print("常驻进程已停止" if client else "常驻进程没有运行")